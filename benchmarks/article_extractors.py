@@ -0,0 +1,121 @@
+"""Benchmark of the article text extractors of the scraper.
+
+The extractors are timed on synthetic pages, with the markup that they could disagree on, or on
+a corpus of saved pages with --pages 0. The corpus is a directory of saved pages, page.html,
+with the expected article text of each in page.txt; tests/test_article_extractors.py checks
+that every extractor gives the golden text of the pages of data/icij-pages:
+
+python -m benchmarks.article_extractors
+
+To add the pages of the URLs of a file, with their text from the reference extractor as the
+golden text, to be reviewed before it is committed:
+
+python -m benchmarks.article_extractors --save urls.txt
+"""
+
+import argparse
+import pathlib
+import random
+import time
+
+from src.scraper import (
+    EXTRACTORS,
+    FetchConfig,
+    bs4_article_text,
+    fetch_pages,
+    read_urls,
+)
+
+GOLDEN_CORPUS: pathlib.Path = pathlib.Path("data/icij-pages")
+PAGE: str = """<!DOCTYPE html>
+<html><head><title>Article {number}</title><style>p {{ color: red; }}</style></head>
+<body>
+<nav><p>Menu, not part of the article</p></nav>
+<header class="entry post-header"><h1>Offshore &amp; secret: article {number}</h1>
+<p class="byline">By <a href="#">A Reporter</a></p></header>
+<div class="post-body wide">
+{paragraphs}
+<figure><img src="x.jpg">
+<figcaption> A caption&nbsp;with entities &eacute;&#233; </figcaption></figure>
+<p>Script <script>var skipped = "<p>";</script>and <!-- comment -->comment skipped.</p>
+<p><em>Nested</em> <strong>inline <span>tags</span></strong> and a<br>line break.</p>
+<div class="newsrelated-widget"><p>Related news, kept like the reference does.</p></div>
+</div>
+<footer><p>Footer, not part of the article</p></footer>
+</body></html>
+"""
+WORDS = "the former prime minister bought an estate through offshore companies in Panama".split()
+
+
+def synthetic_pages(count: int) -> dict[str, str]:
+    rng = random.Random(0)
+    pages = {}
+    for number in range(count):
+        paragraphs = "\n".join(
+            f"<p>{' '.join(rng.choices(WORDS, k=rng.randint(20, 80)))}.</p>"
+            for _ in range(rng.randint(10, 40))
+        )
+        pages[f"synthetic-{number}"] = PAGE.format(number=number, paragraphs=paragraphs)
+    return pages
+
+
+def save_pages(corpus: pathlib.Path, urls_path: str) -> None:
+    corpus.mkdir(parents=True, exist_ok=True)
+    urls = read_urls(urls_path)
+    for url, page in zip(urls, fetch_pages(urls, FetchConfig())):
+        if page is not None:
+            name = url.rstrip("/").rsplit("/", 1)[-1]
+            (corpus / f"{name}.html").write_text(page)
+            (corpus / f"{name}.txt").write_text(bs4_article_text(page))
+
+
+def read_corpus(corpus: pathlib.Path) -> dict[str, str]:
+    pages = {path.stem: path.read_text() for path in sorted(corpus.glob("*.html"))}
+    assert pages, f"No saved pages in {corpus}"
+    return pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--corpus",
+        type=pathlib.Path,
+        default=GOLDEN_CORPUS,
+        help="directory of saved pages (default: %(default)s)",
+    )
+    parser.add_argument("--save", metavar="URLS_FILE", help="save the pages of these URLs first")
+    parser.add_argument(
+        "--pages", type=int, default=200, help="number of synthetic pages, 0 to time the corpus"
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.save:
+        save_pages(args.corpus, args.save)
+    if args.pages:
+        # no golden text for the synthetic pages: the extractors give the reference one
+        pages = synthetic_pages(args.pages)
+        reference = {name: bs4_article_text(page) for name, page in pages.items()}
+    else:
+        pages = read_corpus(args.corpus)
+    megabytes = sum(len(page.encode()) for page in pages.values()) / 2**20
+
+    for name, extractor in EXTRACTORS.items():
+        if args.pages:
+            mismatches = [
+                page for page, markup in pages.items() if extractor(markup) != reference[page]
+            ]
+            assert not mismatches, f"{name} differs from the reference on {mismatches[:10]}"
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for markup in pages.values():
+                extractor(markup)
+        seconds = (time.perf_counter() - start) / args.repeat
+        print(
+            f"{name:>5}: {len(pages)} pages ({megabytes:.1f} MiB) in {seconds:.3f}s, "
+            f"{1000 * seconds / len(pages):.2f} ms/page, {megabytes / seconds:.1f} MiB/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
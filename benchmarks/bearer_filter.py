@@ -0,0 +1,102 @@
+"""Micro-benchmark of the bearer name filter.
+
+python -m benchmarks.bearer_filter --names 3000000
+"""
+
+import argparse
+import random
+import re
+import time
+
+import pandas as pd
+
+from src.senzing_pipeline import PAT_LIST, filter_bearer, filter_bearer_batch
+
+BEARER_NAMES: list[str] = [
+    "Bearer",
+    "THE BEARER",
+    "to the bearer 12",
+    "bearer shares",
+    "Bearer 1-2",
+    "bearer no. 7",
+    "El Portador",
+    "the, bearer",
+    "nan",
+    "???",
+]
+# a few of them contain "bearer" or "portador" without being bearer names
+NAMES: list[str] = [
+    "Acme Holdings Limited",
+    "Andrej Babiš",
+    "Sotheby's International Realty",
+    "Bearer Capital Partners S.A.",
+    "Mossack Fonseca & Co.",
+    "John Smith",
+    "Portador Trading Inc",
+    "Nancy Jones",
+    "Société Générale",
+    "Blue Ocean Investments Ltd.",
+    "Maria Fernanda López",
+    "Golden Gate Consulting LLC",
+    "Olga Petrova",
+    "Harbour View Trust",
+    "Zhang Wei",
+    "Northern Star Shipping Co.",
+]
+
+
+def filter_bearer_reference(name: str) -> bool:
+    """The filter as it was, searching for each pattern in turn."""
+    name = str(name).lower()
+
+    for pat in PAT_LIST:
+        if re.search(pat, name) is not None:
+            return False
+
+    return True
+
+
+def generate_names(num_names: int, bearer_rate: float, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    return [
+        rng.choice(BEARER_NAMES) if rng.random() < bearer_rate else f"{rng.choice(NAMES)} {idx}"
+        for idx in range(num_names)
+    ]
+
+
+def timed(label: str, num_names: int, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<12} {elapsed:8.2f}s {num_names / elapsed:14,.0f} names/s")
+    return result, elapsed
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--names", type=int, default=3_000_000)
+    parser.add_argument("--bearer-rate", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    names = generate_names(args.names, args.bearer_rate, args.seed)
+    column = pd.Series(names)
+
+    reference, reference_time = timed(
+        "reference", args.names, lambda: [filter_bearer_reference(name) for name in names]
+    )
+    scalar, scalar_time = timed(
+        "scalar", args.names, lambda: [filter_bearer(name) for name in names]
+    )
+    batch, batch_time = timed("batch", args.names, lambda: filter_bearer_batch(column))
+
+    assert scalar == reference, "filter_bearer disagrees with the reference filter"
+    assert batch.tolist() == reference, "filter_bearer_batch disagrees with the reference filter"
+    print(
+        f"speedup: scalar x{reference_time / scalar_time:.1f}, "
+        f"batch x{reference_time / batch_time:.1f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
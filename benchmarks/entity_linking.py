@@ -0,0 +1,54 @@
+"""Entity linking of the scraped articles with AnnLinker, then with the batched linker.
+
+Needs the knowledge base and the dataset of the dagster assets, and the spaCy model:
+
+python -m benchmarks.entity_linking --lancedb-uri data/sample-lancedb --dataset data/dataset
+"""
+
+import argparse
+import time
+
+import spacy
+from spacy_lancedb_linker.linker import AnnLinker  # noqa
+
+from src.batched_linker import BatchedAnnLinker  # noqa
+from src.doc_shards import DocShards
+from src.knowledge_base import PersistentKnowledgeBase
+from src.scraper import SPACY_MODEL
+
+
+def link(linker: str, ann_kb: PersistentKnowledgeBase, dataset: DocShards, batch_size: int):
+    nlp = spacy.load(SPACY_MODEL)
+    ann_linker = nlp.add_pipe(linker, last=True)
+    ann_linker.set_kb(ann_kb)  # type: ignore
+
+    start = time.perf_counter()
+    docs = list(nlp.pipe(dataset.get_docs(nlp.vocab), batch_size=batch_size))
+    seconds = time.perf_counter() - start
+    links = [[(ent.start_char, ent.text, ent.kb_id_) for ent in doc.ents] for doc in docs]
+    mentions = sum(len(doc.ents) for doc in docs)
+    print(
+        f"{linker}: {seconds:.2f}s, {len(docs) / seconds:.1f} docs/s, "
+        f"{mentions / seconds:.1f} mentions/s"
+    )
+    return links, ann_linker
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lancedb-uri", default="data/sample-lancedb")
+    parser.add_argument("--dataset", default="data/dataset")
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    ann_kb = PersistentKnowledgeBase(uri=args.lancedb_uri)
+    dataset = DocShards.from_disk(args.dataset)
+
+    expected, _ = link("ann_linker", ann_kb, dataset, args.batch_size)
+    links, batched_linker = link("batched_ann_linker", ann_kb, dataset, args.batch_size)
+    assert links == expected, "the batched linker links differently"
+    print(batched_linker.stats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Entities to review: one DataFrame per document versus a single frame built from Arrow batches.
+
+The documents are stand-ins with the attributes pytextrank and the linker set, so that only the
+analysis is timed.
+
+python -m benchmarks.review_rows --docs 2000
+"""
+
+import argparse
+import random
+import tempfile
+import time
+from types import SimpleNamespace
+
+import pandas as pd
+
+from src.analysis import analyse_el_docs
+
+NAMES = [f"Entity {number}" for number in range(50)]
+
+
+def stand_in_doc(rng: random.Random) -> SimpleNamespace:
+    phrases = [
+        SimpleNamespace(
+            text=f"phrase {number}",
+            rank=rng.random(),
+            count=rng.randint(1, 5),
+            chunks=[
+                SimpleNamespace(
+                    ents=[
+                        SimpleNamespace(text=rng.choice(NAMES), kb_id_=rng.choice(["", "", "Q1"]))
+                        for _ in range(rng.randint(1, 3))
+                    ]
+                )
+                for _ in range(rng.randint(1, 3))
+            ],
+        )
+        for number in range(rng.randint(1, 45))
+    ]
+    return SimpleNamespace(_=SimpleNamespace(phrases=phrases))
+
+
+def per_doc_frames(docs) -> list[pd.DataFrame]:
+    """The previous implementation of analyse_el_docs."""
+    for_review = []
+    for doc in docs:
+        records = [
+            (
+                phrase.text,
+                phrase.rank,
+                phrase.count,
+                [
+                    {"text": text, "kb_id": kb_id}
+                    for text, kb_id in set(
+                        (ent.text, ent.kb_id_) for chunk in phrase.chunks for ent in chunk.ents
+                    )
+                ],
+            )
+            for phrase in doc._.phrases[:30]
+        ]
+        raw_entities = pd.DataFrame.from_records(
+            records, columns=["phrase", "rank", "count", "entities"]
+        ).explode("entities")
+        df = pd.concat(
+            [
+                raw_entities.drop(columns="entities"),
+                pd.json_normalize(raw_entities.entities).set_index(raw_entities.index),
+            ],
+            axis=1,
+        )
+        for_review.append(df.loc[lambda d: (d.text.notnull()) & (d.kb_id == "")])
+    return for_review
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    docs = [stand_in_doc(rng) for _ in range(args.docs)]
+
+    start = time.perf_counter()
+    frames = per_doc_frames(docs)
+    per_doc_seconds = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        for_review = analyse_el_docs(docs, f"{tmp}/for-review.jsonl")
+        seconds = time.perf_counter() - start
+
+    previous = pd.concat([frame.assign(doc_id=doc_id) for doc_id, frame in enumerate(frames)])
+    columns = ["doc_id", "phrase", "text"]
+    assert (
+        previous[for_review.columns].sort_values(columns).astype(str).values
+        == for_review.sort_values(columns).astype(str).values
+    ).all()
+    print(
+        f"{len(for_review)} rows of {args.docs} docs: per-doc frames {per_doc_seconds:.2f}s, "
+        f"single frame and JSONL {seconds:.2f}s, x{per_doc_seconds / seconds:.1f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
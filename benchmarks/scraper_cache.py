@@ -0,0 +1,59 @@
+"""Scraper runs with the on-disk cache, against a local stand-in for the ICIJ website.
+
+python -m benchmarks.scraper_cache --pages 200
+"""
+
+import argparse
+import tempfile
+import threading
+import time
+
+import spacy
+
+from benchmarks.scraper_fetch import StandInServer
+from src.scrape_cache import ScrapeCache
+from src.scraper import FetchConfig, scrape
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds per response")
+    parser.add_argument("--model", help="spaCy pipeline to run (default: a blank English one)")
+    args = parser.parse_args()
+
+    server = StandInServer(args.latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    urls = [f"{base}/article/{number}" for number in range(args.pages)]
+    # the same articles under other URLs are only processed once
+    urls += [f"{base}/copy/{number}" for number in range(0, args.pages, 10)]
+
+    nlp = spacy.load(args.model) if args.model else spacy.blank("en")
+    config = FetchConfig(workers=16, max_per_host=8, max_rate_per_host=1000.0)
+
+    start = time.perf_counter()
+    docs, _ = scrape(urls, nlp, config)
+    expected = [doc.to_json() for doc in docs]
+    uncached_seconds = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        runs = []
+        for _ in range(2):
+            start = time.perf_counter()
+            docs, stats = scrape(urls, nlp, config, ScrapeCache(cache_dir))
+            docs = [doc.to_json() for doc in docs]
+            runs.append((time.perf_counter() - start, docs, stats))
+    server.shutdown()
+
+    for seconds, docs, stats in runs:
+        assert docs == expected
+        print(f"{seconds:6.2f}s {stats}")
+    _, _, warm = runs[1]
+    assert warm.not_modified == len(urls) and warm.parsed == 0 and warm.nlp_runs == 0, warm
+    assert warm.duplicates == len(urls) - args.pages, warm
+    print(f"uncached: {uncached_seconds:.2f}s, cached run x{uncached_seconds / runs[1][0]:.1f}")
+
+
+if __name__ == "__main__":
+    main()
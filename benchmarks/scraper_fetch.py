@@ -0,0 +1,127 @@
+"""Concurrent fetching of the scraper, against a local stand-in for the ICIJ website.
+
+python -m benchmarks.scraper_fetch --pages 200 --latency 0.05
+"""
+
+import argparse
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from src.scraper import FetchConfig, article_text, fetch_pages
+
+ARTICLE: str = """<html><body>
+<header class="post-header"><h1>Article {number}</h1></header>
+<div class="post-body"><p>Paragraph of article {number}.</p></div>
+</body></html>"""
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Serves /article/N after some latency, /flaky/N once with a 503, and a 404 for the rest.
+
+    /copy/N serves the same article as /article/N. Articles have an ETag, and a conditional
+    request with it gets a 304 Not Modified.
+    """
+
+    server: "StandInServer"
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.in_flight += 1
+            self.server.max_in_flight = max(self.server.max_in_flight, self.server.in_flight)
+            first_request = self.path not in self.server.seen
+            self.server.seen.add(self.path)
+        try:
+            time.sleep(self.server.latency)
+            kind, _, number = self.path.strip("/").partition("/")
+            if kind == "flaky" and first_request:
+                self.send_response(503)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+            elif kind in ("article", "flaky", "copy"):
+                etag = f'"{number}"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                body = ARTICLE.format(number=number).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+            else:
+                self.send_error(404)
+        finally:
+            with self.server.lock:
+                self.server.in_flight -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency: float):
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.seen: set[str] = set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per response")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--max-per-host", type=int, default=8)
+    parser.add_argument("--max-rate-per-host", type=float, default=1000.0)
+    args = parser.parse_args()
+
+    server = StandInServer(args.latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    urls = [f"{base}/article/{number}" for number in range(args.pages)]
+
+    start = time.perf_counter()
+    sequential = [requests.get(url, timeout=10).text for url in urls]
+    sequential_seconds = time.perf_counter() - start
+
+    # a few failing pages must not abort the batch
+    urls += [f"{base}/flaky/1", f"{base}/missing"]
+    config = FetchConfig(
+        workers=args.workers,
+        max_per_host=args.max_per_host,
+        max_rate_per_host=args.max_rate_per_host,
+        backoff_factor=0.01,
+    )
+    server.max_in_flight = 0
+    start = time.perf_counter()
+    pages = list(fetch_pages(urls, config))
+    concurrent_seconds = time.perf_counter() - start
+    server.shutdown()
+
+    assert pages[: args.pages] == sequential, "concurrent fetch differs from sequential fetch"
+    assert (
+        pages[-2] is not None and article_text(pages[-2]) == "Article 1.\nParagraph of article 1."
+    )
+    assert pages[-1] is None
+    assert server.max_in_flight <= args.max_per_host, server.max_in_flight
+
+    print(f"sequential: {args.pages / sequential_seconds:8.1f} pages/s")
+    print(
+        f"concurrent: {args.pages / concurrent_seconds:8.1f} pages/s "
+        f"(x{sequential_seconds / concurrent_seconds:.1f}, "
+        f"at most {server.max_in_flight} requests in flight)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""spaCy processing of the articles: one text at a time into a DocBin, or nlp.pipe into shards.
+
+Run each mode in its own process, to compare their peak memory:
+
+python -m benchmarks.scraper_pipe --docs 5000 --mode docbin
+python -m benchmarks.scraper_pipe --docs 5000 --mode shards --n-process 2
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import tempfile
+import time
+
+import spacy
+from spacy.tokens import DocBin
+
+from src.doc_shards import DocShards, DocShardWriter
+from src.instrumentation import peak_rss_mb
+
+WORDS = "the former prime minister bought an estate through offshore companies in Panama".split()
+
+
+def articles(docs: int, paragraphs: int = 20):
+    rng = random.Random(0)
+    for _ in range(docs):
+        yield "\n".join(
+            " ".join(rng.choices(WORDS, k=rng.randint(20, 80))) + "." for _ in range(paragraphs)
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--mode", choices=["docbin", "shards"], default="shards")
+    parser.add_argument("--model", help="spaCy pipeline to run (default: a blank English one)")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--n-process", type=int, default=1)
+    parser.add_argument("--max-shard-mb", type=float, default=8)
+    args = parser.parse_args()
+
+    nlp = spacy.load(args.model) if args.model else spacy.blank("en")
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        if args.mode == "docbin":
+            doc_bin = DocBin()
+            for text in articles(args.docs):
+                doc_bin.add(nlp(text))
+            doc_bin.to_disk(f"{tmp}/dataset.spacy")
+            dataset = DocShards.from_disk(f"{tmp}/dataset.spacy")
+        else:
+            texts = articles(args.docs)
+            with DocShardWriter(f"{tmp}/dataset", int(args.max_shard_mb * 2**20)) as writer:
+                for doc in nlp.pipe(texts, batch_size=args.batch_size, n_process=args.n_process):
+                    writer.add(doc)
+                dataset = writer.close()
+        seconds = time.perf_counter() - start
+
+        # compare the datasets of the two modes by their digest
+        digest = hashlib.blake2b(digest_size=8)
+        for doc in dataset.get_docs(nlp.vocab):
+            digest.update(json.dumps(doc.to_json(), sort_keys=True).encode())
+    print(
+        f"{args.mode}: {seconds:.2f}s, {len(dataset)} docs in {len(dataset.shards)} files, "
+        f"peak RSS {peak_rss_mb():.0f} MiB, digest {digest.hexdigest()}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Memory held by the parsed Senzing results, on synthetic Senzing results.
+
+Each structure is loaded in a fresh process, which traces the Python heap with tracemalloc: the
+heap held once the structure is loaded and the garbage collected, and its peak while loading.
+The resident set of a process is not a good measure here, as the allocator keeps the memory
+freed by the parsing. Tracing slows the loading down, so the times are only comparable between
+runs of this benchmark.
+
+python -m benchmarks.senzing_memory --entities 1000000
+"""
+
+import argparse
+import gc
+import multiprocessing
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+from loguru import logger
+
+from benchmarks.synthetic_report import (
+    add_config_arguments,
+    config_from_arguments,
+    synthetic_report,
+)
+from src.senzing_pipeline import (
+    extract_senzing_results,
+    load_aliases,
+    read_senzing_report,
+)
+
+LOADERS = {
+    "graph": extract_senzing_results,
+    "aliases": load_aliases,
+    "report": read_senzing_report,
+}
+
+
+def measure(loader: str, report_path: str) -> tuple[float, float, float]:
+    """Seconds, held and peak heap in MiB of loading a structure, in the current process."""
+    logger.remove()
+    gc.collect()
+    tracemalloc.start()
+
+    start = time.perf_counter()
+    loaded = LOADERS[loader](report_path)  # noqa: F841
+    seconds = time.perf_counter() - start
+    gc.collect()
+
+    held, peak = tracemalloc.get_traced_memory()
+    return seconds, held / 2**20, peak / 2**20
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entities", type=int, nargs="+", default=[1_000_000])
+    parser.add_argument("--loaders", nargs="+", choices=list(LOADERS), default=list(LOADERS))
+    parser.add_argument("--data-dir", default="data/synthetic")
+    add_config_arguments(parser)
+    args = parser.parse_args(argv)
+
+    # a spawned process starts from an empty heap, whatever the platform
+    context = multiprocessing.get_context("spawn")
+    for entities in args.entities:
+        report_path = synthetic_report(config_from_arguments(args, entities), args.data_dir)
+        print(f"{entities:,} entities, {report_path}", file=sys.stderr)
+        for loader in args.loaders:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                seconds, held, peak = executor.submit(measure, loader, str(report_path)).result()
+            print(f"  {loader:<8} {seconds:8.2f}s {held:9.1f} MiB held {peak:9.1f} MiB peak")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Time and peak memory of each stage of the Senzing pipeline, on synthetic Senzing results.
+
+The results of each scale are compared to a stored baseline, and the stages slower or bigger than
+their baseline by more than the tolerance are flagged as regressions, with a non-zero exit code.
+
+python -m benchmarks.senzing_stages --entities 10000 1000000 --save-baseline
+python -m benchmarks.senzing_stages --entities 10000 1000000
+"""
+
+import argparse
+import gc
+import json
+import pathlib
+import platform
+import sys
+from dataclasses import asdict
+from typing import Any, Callable
+
+from benchmarks.synthetic_report import (
+    COUNTRIES,
+    add_config_arguments,
+    config_from_arguments,
+    synthetic_report,
+)
+from src.instrumentation import StageTiming, reset_peak_rss, stage
+from src.senzing_pipeline import (
+    entity_features_table,
+    extract_senzing_results,
+    filter_senzing,
+    generate_aliases,
+    generate_entities,
+    generate_entities_batch,
+    load_aliases,
+    load_entities,
+    read_senzing_report,
+)
+
+BASELINE: str = "data/benchmarks/senzing-stages.json"
+
+
+Stage = Callable[..., Any]
+
+
+def graph_stages(run: Stage, report_path: pathlib.Path, suspicions: int) -> None:
+    graph = run("extract_senzing_results", lambda: extract_senzing_results(report_path))
+    # suspicions spread over the whole graph
+    uids = graph.entity_uids[:: max(1, len(graph) // suspicions)][:suspicions]
+    names = [graph[int(uid)].name for uid in uids]
+    run("filter_senzing", lambda: filter_senzing(names, graph))
+
+
+def entity_stages(run: Stage, report_path: pathlib.Path) -> None:
+    raw_entities = run("load_entities", lambda: load_entities(report_path))
+    run("generate_entities", lambda: generate_entities(raw_entities, COUNTRIES))
+    run(
+        "generate_entities_batch",
+        lambda: generate_entities_batch(entity_features_table(raw_entities), COUNTRIES),
+        lambda entities: entities.num_rows,
+    )
+
+
+def alias_stages(run: Stage, report_path: pathlib.Path) -> None:
+    raw_aliases = run("load_aliases", lambda: load_aliases(report_path))
+    run("generate_aliases", lambda: generate_aliases(raw_aliases))
+
+
+def run_stages(report_path: pathlib.Path, suspicions: int) -> list[StageTiming]:
+    """Run the stages one after the other, keeping only the inputs of the next ones in memory."""
+    results = []
+
+    def run(name: str, func: Callable[[], Any], count: Callable[[Any], int] = len) -> Any:
+        gc.collect()
+        with stage(name) as timing:
+            result = func()
+            timing.items = count(result)
+        results.append(timing)
+        print(
+            f"  {name:<24} {timing.wall_seconds:8.2f}s {timing.peak_rss_mb:9.1f} MiB "
+            f"{timing.items_per_second:12,.0f} items/s",
+            file=sys.stderr,
+        )
+        return result
+
+    run("read_senzing_report", lambda: read_senzing_report(report_path), lambda r: len(r.entities))
+    # the inputs of each group of stages are freed before the next group
+    graph_stages(run, report_path, suspicions)
+    entity_stages(run, report_path)
+    alias_stages(run, report_path)
+    return results
+
+
+def compare(results: list[StageTiming], baseline: dict[str, dict], tolerance: float) -> list[str]:
+    """The regressions of the results compared to the baseline of the same scale."""
+    regressions = []
+    for result in results:
+        base = baseline.get(result.stage)
+        if base is None:
+            continue
+        # small absolute differences are noise, whatever their ratio
+        if (
+            result.wall_seconds > base["wall_seconds"] * (1 + tolerance)
+            and result.wall_seconds - base["wall_seconds"] > 0.1
+        ):
+            regressions.append(
+                f"{result.stage}: {base['wall_seconds']:.2f}s -> {result.wall_seconds:.2f}s"
+            )
+        # the peaks of the process, rather than of the stages, are not compared
+        if (
+            result.peak_rss_scope == base.get("peak_rss_scope", "stage") == "stage"
+            and result.peak_rss_mb > base["peak_rss_mb"] * (1 + tolerance)
+            and result.peak_rss_mb - base["peak_rss_mb"] > 10
+        ):
+            regressions.append(
+                f"{result.stage}: {base['peak_rss_mb']:.1f} MiB -> {result.peak_rss_mb:.1f} MiB"
+            )
+    return regressions
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entities", type=int, nargs="+", default=[10_000])
+    parser.add_argument("--suspicions", type=int, default=100)
+    parser.add_argument("--data-dir", default="data/synthetic")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument(
+        "--save-baseline", action="store_true", help="store the results as the new baseline"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="relative slowdown or memory growth flagged as a regression (default: %(default)s)",
+    )
+    add_config_arguments(parser)
+    args = parser.parse_args(argv)
+
+    baseline_path = pathlib.Path(args.baseline)
+    baselines = json.loads(baseline_path.read_text()) if baseline_path.exists() else {}
+    if not reset_peak_rss():
+        print("cannot reset the peak RSS, the peaks are the ones of the process", file=sys.stderr)
+
+    regressions = []
+    for entities in args.entities:
+        config = config_from_arguments(args, entities)
+        # the baselines are only comparable for the same synthetic results and machine
+        scale = f"{entities}-{config.fingerprint()}-{platform.node()}"
+        report_path = synthetic_report(config, args.data_dir)
+        print(f"{entities:,} entities, {report_path}", file=sys.stderr)
+
+        results = run_stages(report_path, args.suspicions)
+        if args.save_baseline:
+            baselines[scale] = {
+                "config": asdict(config),
+                "python": platform.python_version(),
+                **{result.stage: asdict(result) for result in results},
+            }
+        elif scale in baselines:
+            regressions += [
+                f"{entities:,} entities, {regression}"
+                for regression in compare(results, baselines[scale], args.tolerance)
+            ]
+        else:
+            print(f"no baseline for {scale}, run with --save-baseline", file=sys.stderr)
+
+    if args.save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps(baselines, indent=2))
+        print(f"baseline saved to {baseline_path}", file=sys.stderr)
+
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
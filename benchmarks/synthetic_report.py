@@ -0,0 +1,233 @@
+"""Seeded generator of synthetic Senzing results, in the JSON lines format of the ICIJ report.
+
+Each line has a RESOLVED_ENTITY with its features and records, and its RELATED_ENTITIES, which
+always refer to entities of the same file.
+
+python -m benchmarks.synthetic_report --entities 1000000 --output data/synthetic/report-1m.json
+"""
+
+import argparse
+import hashlib
+import json
+import pathlib
+import random
+from dataclasses import asdict, dataclass, field
+
+from src.senzing_pipeline import MATCH_LEVEL_CODES
+
+# fmt: off
+FIRST_NAMES: list[str] = [
+    "John", "Maria", "Zhang", "Olga", "Andrej", "Fatima", "Carlos", "Nancy", "Yuki", "Ahmed",
+    "Ingrid", "Pierre", "Ana", "Dmitri", "Priya", "Kwame",
+]
+LAST_NAMES: list[str] = [
+    "Smith", "Fernanda López", "Wei", "Petrova", "Babiš", "Haddad", "Mendes", "Jones", "Tanaka",
+    "Okafor", "Larsen", "Dubois", "Silva", "Ivanov", "Sharma", "Mensah",
+]
+COMPANY_WORDS: list[str] = [
+    "Acme", "Blue Ocean", "Golden Gate", "Northern Star", "Harbour View", "Mossack", "Silver Leaf",
+    "Pacific", "Atlas", "Orion", "Meridian", "Crown", "Evergreen", "Summit", "Falcon", "Baltic",
+]
+COMPANY_SUFFIXES: list[str] = [
+    "Holdings Limited", "Investments Ltd.", "Consulting LLC", "Trust", "Shipping Co.", "S.A.",
+    "International Inc", "Partners",
+]
+BEARER_NAMES: list[str] = [
+    "Bearer", "THE BEARER", "to the bearer 12", "bearer shares", "Bearer 1-2", "bearer no. 7",
+    "El Portador", "the, bearer", "nan", "???",
+]
+# fmt: on
+DATA_SOURCES: list[str] = ["ICIJ", "OPEN-OWNERSHIP", "OPEN-SANCTIONS", "PANAMA-PAPERS"]
+MATCH_KEYS: list[str] = ["", "+NAME", "+NAME+ADDRESS", "+NAME+DOB", "+NAME+COUNTRY"]
+# country codes, as found in the COUNTRY_OF_ASSOCIATION features, with their names
+COUNTRIES: dict[str, str] = {
+    "FR": "France",
+    "GB": "United Kingdom",
+    "PA": "Panama",
+    "US": "United States",
+    "VG": "British Virgin Islands",
+    "CZ": "Czech Republic",
+    "RU": "Russian Federation",
+    "CY": "Cyprus",
+}
+
+
+@dataclass
+class SyntheticReportConfig:
+    """Shape of the synthetic Senzing results."""
+
+    entities: int = 10_000
+    # means of the records per entity, at least one, and of the related entities per entity
+    records_per_entity: float = 2.0
+    fanout: float = 3.0
+    # relative frequency of each MATCH_LEVEL_CODE among the relationships
+    match_levels: dict[str, float] = field(
+        default_factory=lambda: {
+            "RESOLVED": 0.05,
+            "POSSIBLY_SAME": 0.35,
+            "POSSIBLY_RELATED": 0.5,
+            "DISCLOSED": 0.1,
+        }
+    )
+    # share of the entities named like a bearer share holder
+    bearer_rate: float = 0.01
+    # share of the entities that are people, the others being organizations
+    person_rate: float = 0.4
+    seed: int = 42
+
+    def fingerprint(self) -> str:
+        """Short hash of the config, e.g. to name the generated files."""
+        config = json.dumps(asdict(self), sort_keys=True)
+        return hashlib.blake2b(config.encode(), digest_size=6).hexdigest()
+
+
+def _count(rng: random.Random, mean: float, minimum: int) -> int:
+    """Random count with the given mean, from a geometric-like distribution."""
+    if mean <= minimum:
+        return minimum
+    return minimum + int(rng.expovariate(1 / (mean - minimum)))
+
+
+def _name(rng: random.Random, is_person: bool, bearer_rate: float) -> str:
+    if rng.random() < bearer_rate:
+        return rng.choice(BEARER_NAMES)
+    if is_person:
+        return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {rng.randrange(10_000)}"
+    return f"{rng.choice(COMPANY_WORDS)} {rng.randrange(10_000)} {rng.choice(COMPANY_SUFFIXES)}"
+
+
+def synthetic_line(rng: random.Random, entity_id: int, config: SyntheticReportConfig) -> dict:
+    """One line of the Senzing results, for the entity `entity_id` in 1..config.entities."""
+    is_person = rng.random() < config.person_rate
+    name = _name(rng, is_person, config.bearer_rate)
+
+    features = {"NAME": [{"FEAT_DESC": name}]}
+    features["RECORD_TYPE"] = [{"FEAT_DESC": "PERSON" if is_person else "ORGANIZATION"}]
+    if rng.random() < 0.5:
+        features["COUNTRY_OF_ASSOCIATION"] = [{"FEAT_DESC": rng.choice(list(COUNTRIES))}]
+    if rng.random() < 0.4:
+        features["ADDRESS"] = [
+            {"FEAT_DESC": f"{rng.randrange(1, 300)} Harbour Road, Unit {entity_id}"}
+        ]
+    if rng.random() < 0.1:
+        features["PHONE"] = [{"FEAT_DESC": f"+1 555 {entity_id:07d}"}]
+    if is_person:
+        if rng.random() < 0.3:
+            features["DOB"] = [{"FEAT_DESC": f"{rng.randrange(1940, 2000)}-01-01"}]
+        if rng.random() < 0.1:
+            features["GROUP_ASSOCIATION"] = [{"FEAT_DESC": rng.choice(COMPANY_WORDS)}]
+    else:
+        if rng.random() < 0.05:
+            features["DUNS_NUMBER"] = [{"FEAT_DESC": f"{entity_id:09d}"}]
+        if rng.random() < 0.1:
+            features["WEBSITE"] = [{"FEAT_DESC": f"www.entity-{entity_id}.com"}]
+
+    records = [
+        {
+            "DATA_SOURCE": rng.choice(DATA_SOURCES),
+            "RECORD_ID": f"{entity_id}-{idx}",
+            # records sometimes spell the name differently, or not at all
+            "ENTITY_DESC": rng.choice([name, name, name.upper(), ""]),
+            "MATCH_KEY": rng.choice(MATCH_KEYS),
+            "INTERNAL_ID": entity_id * 100 + idx,
+        }
+        for idx in range(_count(rng, config.records_per_entity, 1))
+    ]
+
+    levels, weights = zip(*config.match_levels.items())
+    related: dict[int, dict] = {}
+    for _ in range(_count(rng, config.fanout, 0)):
+        related_id = rng.randint(1, config.entities)
+        if related_id != entity_id:
+            related[related_id] = {
+                "ENTITY_ID": related_id,
+                "MATCH_LEVEL_CODE": rng.choices(levels, weights)[0],
+                "MATCH_KEY": rng.choice(MATCH_KEYS[1:]),
+                "ENTITY_NAME": "",
+            }
+
+    return {
+        "RESOLVED_ENTITY": {
+            "ENTITY_ID": entity_id,
+            "ENTITY_NAME": name if rng.random() > 0.02 else "",
+            "FEATURES": features,
+            "RECORDS": records,
+        },
+        "RELATED_ENTITIES": list(related.values()),
+    }
+
+
+def write_synthetic_report(path: str | pathlib.Path, config: SyntheticReportConfig) -> None:
+    """Write synthetic Senzing results to `path`, the same ones for the same config."""
+    unknown = set(config.match_levels) - set(MATCH_LEVEL_CODES)
+    if unknown:
+        raise ValueError(f"Unknown match levels {unknown}, expected some of {MATCH_LEVEL_CODES}")
+
+    rng = random.Random(config.seed)
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    staging = path.with_name(f".{path.name}.tmp")
+    with open(staging, "w", encoding="utf-8") as fp:
+        for entity_id in range(1, config.entities + 1):
+            fp.write(json.dumps(synthetic_line(rng, entity_id, config)) + "\n")
+    staging.replace(path)
+
+
+def synthetic_report(
+    config: SyntheticReportConfig, data_dir: str | pathlib.Path = "data/synthetic"
+) -> pathlib.Path:
+    """Path to the synthetic Senzing results of a config, generated on first use."""
+    path = pathlib.Path(data_dir) / f"report-{config.entities}-{config.fingerprint()}.json"
+    if not path.exists():
+        write_synthetic_report(path, config)
+    return path
+
+
+def parse_match_levels(values: list[str]) -> dict[str, float]:
+    """Parse CODE=WEIGHT pairs, e.g. POSSIBLY_SAME=0.4."""
+    match_levels = {}
+    for value in values:
+        code, _, weight = value.partition("=")
+        match_levels[code] = float(weight)
+    return match_levels
+
+
+def add_config_arguments(parser: argparse.ArgumentParser) -> None:
+    defaults = SyntheticReportConfig()
+    parser.add_argument("--records-per-entity", type=float, default=defaults.records_per_entity)
+    parser.add_argument("--fanout", type=float, default=defaults.fanout)
+    parser.add_argument(
+        "--match-levels",
+        nargs="+",
+        default=[f"{code}={weight}" for code, weight in defaults.match_levels.items()],
+        help="relative frequency of each MATCH_LEVEL_CODE, as CODE=WEIGHT",
+    )
+    parser.add_argument("--bearer-rate", type=float, default=defaults.bearer_rate)
+    parser.add_argument("--person-rate", type=float, default=defaults.person_rate)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+
+
+def config_from_arguments(args: argparse.Namespace, entities: int) -> SyntheticReportConfig:
+    return SyntheticReportConfig(
+        entities=entities,
+        records_per_entity=args.records_per_entity,
+        fanout=args.fanout,
+        match_levels=parse_match_levels(args.match_levels),
+        bearer_rate=args.bearer_rate,
+        person_rate=args.person_rate,
+        seed=args.seed,
+    )
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entities", type=int, default=10_000)
+    parser.add_argument("--output", required=True)
+    add_config_arguments(parser)
+    args = parser.parse_args(argv)
+
+    write_synthetic_report(args.output, config_from_arguments(args, args.entities))
+
+
+if __name__ == "__main__":
+    main()
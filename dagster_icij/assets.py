@@ -1,39 +1,93 @@
+from dataclasses import asdict
+from typing import Iterator
+
 import pandas as pd
+import pyarrow as pa
 import pytextrank  # noqa
 import spacy
-import srsly
-from dagster import AssetSpec, Config, asset
+from dagster import (
+    AssetOut,
+    AssetSpec,
+    Config,
+    MaterializeResult,
+    Output,
+    asset,
+    multi_asset,
+)
 from spacy.language import Language
-from spacy.tokens import DocBin
-from spacy_lancedb_linker.kb import AnnKnowledgeBase
-from spacy_lancedb_linker.linker import AnnLinker  # noqa
-from spacy_lancedb_linker.types import Alias, Entity
+from spacy.tokens import Doc
 
 from src.analysis import analyse_el_docs
-from src.scraper import SPACY_MODEL
-from src.scraper import main as scraper_entrypoint
-from src.senzing_pipeline import Entity as GraphEntity
+from src.batched_linker import BatchedAnnLinker  # noqa
+from src.doc_shards import DocShards
+from src.exact_aliases import write_exact_aliases
+from src.instrumentation import collect_stages, stage, stages_metadata
+from src.knowledge_base import PersistentKnowledgeBase, sync_knowledge_base
+from src.linking_cache import LinkingCache
+from src.scraper import SPACY_MODEL, FetchConfig, PipeConfig, run_scraper
+from src.senzing_cache import GRAPH_TABLES, cached_senzing_tables
+from src.senzing_incremental import update_aliases, update_entities
 from src.senzing_pipeline import (
-    extract_senzing_results,
+    AliasRecords,
+    SenzingGraph,
+    entity_features_table,
+    filter_alias_table,
+    filter_entity_features,
     filter_senzing,
     generate_aliases,
-    generate_entities,
-    load_aliases,
+    generate_entities_batch,
     load_countries,
-    load_entities,
+    read_senzing_report,
     write_aliases,
-    write_entities,
+    write_entities_batch,
 )
 
 
 class ICIJSenzingConfig(Config):
+    # JSON lines, or compressed as .zip, .gz or .zst
     senzing_results_path: str = "data/ICIJ-entity-report-2024-06-21_12-04-57-std.json"
+    # set to None to always parse the Senzing results from scratch
+    senzing_cache_dir: str | None = "data/senzing-cache"
+    # number of processes parsing the Senzing results
+    senzing_workers: int = 1
     suspicions_path: str = "data/icij-example/suspicious.txt"
+    # how suspicions are matched to entity names: exact, normalized or tokens
+    name_match: str = "exact"
+    # how many relationships away from a suspicion to go, following only these match levels
+    hops: int = 2
+    match_levels: list[str] | None = None
     country_codes_path: str = "data/senzing/country.tsv"
-    spacy_dataset_path: str = "data/dataset.spacy"
+    # directory of the DocBin shards of the scraped articles
+    spacy_dataset_path: str = "data/dataset"
+    # file with one URL to scrape per line, instead of the example articles
+    scraper_urls_path: str | None = None
+    scraper_workers: int = 8
+    scraper_max_rate_per_host: float = 2.0
+    # set to None to fetch and process every article again
+    scraper_cache_dir: str | None = "data/scrape-cache"
+    # how the article text is extracted from a page: bs4, or lxml which is faster
+    scraper_extractor: str = "bs4"
+    # texts processed per nlp.pipe batch, by this many processes
+    scraper_batch_size: int = 64
+    scraper_n_process: int = 1
     output_entities_jsonl_path: str = "data/icij-example/entities.jsonl"
     output_aliases_jsonl_path: str = "data/icij-example/aliases.jsonl"
+    # table of the unambiguous aliases, linked without querying the knowledge base
+    output_exact_aliases_path: str = "data/icij-example/exact-aliases"
+    # only regenerate the rows of the entities that changed since the previous materialization
+    incremental: bool = False
     lancedb_uri: str = "data/sample-lancedb"
+    # fraction of changed rows of the knowledge base after which its ANN index is rebuilt
+    kb_index_rebuild_fraction: float = 0.1
+    # documents per nlp.pipe batch, which the linker queries the knowledge base for at once. The
+    # linking runs in a single process: the linkers count their links and fill the linking cache
+    linking_batch_size: int = 64
+    # linking results of the mentions kept between runs, until the knowledge base changes; set to
+    # None to only cache them during a run
+    linking_cache_path: str | None = "data/linking-cache.msgpack"
+    linking_cache_size: int = 100_000
+    # JSONL file the entities to review are written to as the documents are linked, if any
+    review_rows_path: str | None = None
 
 
 icij_senzing_results = AssetSpec(key="icij_senzing_results", group_name="source_dataset")
@@ -46,35 +100,60 @@ def suspicions(config: ICIJSenzingConfig) -> list[str]:
         return names
 
 
-@asset(group_name="senzing_pipeline", deps=[icij_senzing_results])
-def graph(config: ICIJSenzingConfig) -> dict[int, GraphEntity]:
-    graph = extract_senzing_results(config.senzing_results_path)
-    return graph
+@multi_asset(
+    outs={
+        # the large assets are Arrow tables, memory-mapped downstream
+        "graph": AssetOut(group_name="senzing_pipeline", io_manager_key="arrow_io_manager"),
+        "raw_entities": AssetOut(group_name="senzing_pipeline", io_manager_key="arrow_io_manager"),
+        "raw_aliases": AssetOut(group_name="senzing_pipeline", io_manager_key="arrow_io_manager"),
+    },
+    deps=[icij_senzing_results],
+)
+def senzing_report(config: ICIJSenzingConfig):
+    # a single pass over the Senzing results feeds the three assets
+    with collect_stages() as timings:
+        if config.senzing_cache_dir is None:
+            report = read_senzing_report(
+                config.senzing_results_path, workers=config.senzing_workers
+            )
+            graph = report.graph
+            entities = entity_features_table(report.entities)
+            aliases = report.aliases.to_table()
+            metadata = {}
+        else:
+            # the memory-mapped tables of the cache entry, no Python objects are built
+            tables, stats = cached_senzing_tables(
+                config.senzing_results_path, config.senzing_cache_dir, config.senzing_workers
+            )
+            graph = {name: tables[name] for name in GRAPH_TABLES}
+            entities, aliases = tables["entities"], tables["aliases"]
+            metadata = asdict(stats)
+    metadata.update(stages_metadata(timings))
+
+    yield Output(graph, output_name="graph", metadata=metadata)
+    yield Output(entities, output_name="raw_entities", metadata=metadata)
+    yield Output(aliases, output_name="raw_aliases", metadata=metadata)
 
 
 @asset(group_name="senzing_pipeline")
-def suspicious_ids(suspicions: list[str], graph: dict[int, GraphEntity]) -> set[str]:
-    return filter_senzing(suspicions, graph)
-
+def suspicious_ids(
+    config: ICIJSenzingConfig, suspicions: list[str], graph: SenzingGraph
+) -> Output[set[str]]:
+    with collect_stages() as timings:
+        entity_ids = filter_senzing(
+            suspicions, graph, config.name_match, config.hops, config.match_levels
+        )
+    return Output(entity_ids, metadata=stages_metadata(timings))
 
-@asset(group_name="senzing_pipeline", deps=[icij_senzing_results])
-def raw_entities(config: ICIJSenzingConfig):
-    return load_entities(config.senzing_results_path)
 
-
-@asset(group_name="senzing_pipeline", deps=[icij_senzing_results])
-def raw_aliases(config: ICIJSenzingConfig):
-    return load_aliases(config.senzing_results_path)
+@asset(group_name="senzing_pipeline", io_manager_key="arrow_io_manager")
+def filtered_entities(suspicious_ids: set[str], raw_entities: pa.Table) -> pa.Table:
+    return filter_entity_features(raw_entities, suspicious_ids)
 
 
 @asset(group_name="senzing_pipeline")
-def filtered_entities(suspicious_ids, raw_entities):
-    return {k: v for k, v in raw_entities.items() if str(k) in suspicious_ids}
-
-
-@asset(group_name="senzing_pipeline")
-def filtered_aliases(suspicious_ids: set[str], raw_aliases):
-    return [alias for alias in raw_aliases if str(alias["entity"]) in suspicious_ids]
+def filtered_aliases(suspicious_ids: set[str], raw_aliases: pa.Table) -> AliasRecords:
+    return AliasRecords.from_table(filter_alias_table(raw_aliases, suspicious_ids))
 
 
 @asset(group_name="senzing_pipeline")
@@ -85,22 +164,66 @@ def countries(config: ICIJSenzingConfig) -> dict:
 @asset(group_name="entity_linking_inputs")
 def entities_jsonl(
     config: ICIJSenzingConfig,
-    filtered_entities,
+    filtered_entities: pa.Table,
     countries: dict,
-) -> None:
-    entities = generate_entities(filtered_entities, countries)
-    write_entities(entities, config.output_entities_jsonl_path)
+) -> MaterializeResult:
+    with collect_stages() as timings:
+        if config.incremental:
+            delta = update_entities(filtered_entities, countries, config.output_entities_jsonl_path)
+            metadata = asdict(delta)
+        else:
+            entities = generate_entities_batch(filtered_entities, countries)
+            write_entities_batch(entities, config.output_entities_jsonl_path)
+            metadata = {}
+    return MaterializeResult(metadata={**metadata, **stages_metadata(timings)})
 
 
 @asset(group_name="entity_linking_inputs")
-def aliases_jsonl(config: ICIJSenzingConfig, filtered_aliases) -> None:
-    aliases = generate_aliases(filtered_aliases)
-    write_aliases(aliases, config.output_aliases_jsonl_path)
+def aliases_jsonl(config: ICIJSenzingConfig, filtered_aliases) -> MaterializeResult:
+    with collect_stages() as timings:
+        if config.incremental:
+            delta = update_aliases(filtered_aliases, config.output_aliases_jsonl_path)
+            metadata = asdict(delta)
+        else:
+            aliases = generate_aliases(filtered_aliases)
+            write_aliases(aliases, config.output_aliases_jsonl_path)
+            metadata = {}
+    return MaterializeResult(metadata={**metadata, **stages_metadata(timings)})
+
+
+@asset(group_name="entity_linking_inputs", deps=[entities_jsonl, aliases_jsonl])
+def exact_aliases(config: ICIJSenzingConfig) -> MaterializeResult:
+    # the aliases the knowledge base is built from
+    aliases, ambiguous = write_exact_aliases(
+        config.output_entities_jsonl_path,
+        config.output_aliases_jsonl_path,
+        config.output_exact_aliases_path,
+    )
+    return MaterializeResult(metadata={"aliases": aliases, "ambiguous_aliases": ambiguous})
 
 
 @asset(group_name="entity_linking_inputs")
-def spacy_dataset(config: ICIJSenzingConfig) -> DocBin:
-    return scraper_entrypoint(config.spacy_dataset_path)
+def spacy_dataset(config: ICIJSenzingConfig) -> Output[DocShards]:
+    fetch_config = FetchConfig(
+        workers=config.scraper_workers, max_rate_per_host=config.scraper_max_rate_per_host
+    )
+    pipe_config = PipeConfig(
+        batch_size=config.scraper_batch_size, n_process=config.scraper_n_process
+    )
+    # only the paths of the shards are passed on, the Docs are read lazily downstream
+    with collect_stages() as timings:
+        dataset, stats = run_scraper(
+            config.spacy_dataset_path,
+            config.scraper_urls_path,
+            fetch_config,
+            config.scraper_cache_dir,
+            pipe_config,
+            config.scraper_extractor,
+        )
+    return Output(
+        dataset,
+        metadata={**asdict(stats), "shards": len(dataset.shards), **stages_metadata(timings)},
+    )
 
 
 @asset(group_name="spacy_pipeline")
@@ -108,30 +231,68 @@ def nlp() -> spacy.Language:
     return spacy.load(SPACY_MODEL)
 
 
+@asset(group_name="spacy_pipeline", deps=[aliases_jsonl, entities_jsonl])
+def knowledge_base(config: ICIJSenzingConfig) -> MaterializeResult:
+    # the LanceDB tables persist at lancedb_uri, only the rows that changed are upserted
+    _, delta = sync_knowledge_base(
+        config.lancedb_uri,
+        config.output_entities_jsonl_path,
+        config.output_aliases_jsonl_path,
+        config.kb_index_rebuild_fraction,
+    )
+    return MaterializeResult(metadata=asdict(delta))
+
+
 @asset(
     group_name="spacy_pipeline",
-    deps=[aliases_jsonl, entities_jsonl],
+    deps=[knowledge_base, exact_aliases],
     io_manager_key="mem_io_manager",
 )
 def entity_linking(
-    config: ICIJSenzingConfig, nlp: Language, spacy_dataset: DocBin
-) -> list[pd.DataFrame]:
-    entities = [Entity(**entity) for entity in srsly.read_jsonl(config.output_entities_jsonl_path)]
-
-    aliases = [Alias(**alias) for alias in srsly.read_jsonl(config.output_aliases_jsonl_path)] + [
-        Alias(alias=entity.name, entities=[entity.entity_id], probabilities=[1])
-        for entity in entities
-    ]
-
-    ann_kb = AnnKnowledgeBase(uri=config.lancedb_uri)
-    ann_kb.add_entities(entities)
-    ann_kb.add_aliases(aliases)
-
-    ann_linker = nlp.add_pipe("ann_linker", last=True)
+    config: ICIJSenzingConfig, nlp: Language, spacy_dataset: DocShards
+) -> Output[pd.DataFrame]:
+    ann_kb = PersistentKnowledgeBase(uri=config.lancedb_uri)
+
+    exact_alias_linker = nlp.add_pipe("exact_alias_linker", last=True)
+    exact_alias_linker.from_disk(config.output_exact_aliases_path)  # type: ignore
+    # links the other mentions of a whole batch of documents with each knowledge base query
+    ann_linker = nlp.add_pipe("batched_ann_linker", last=True)
     ann_linker.set_kb(ann_kb)  # type: ignore
+    linking_cache = LinkingCache.open(
+        config.linking_cache_path, config.linking_cache_size, ann_kb.fingerprint
+    )
+    ann_linker.set_cache(linking_cache)  # type: ignore
 
     nlp.add_pipe("textrank")
 
     docs = spacy_dataset.get_docs(nlp.vocab)
 
-    return analyse_el_docs(nlp.pipe(docs))
+    counts = {"docs": 0, "mentions": 0}
+
+    def counted(linked_docs: Iterator[Doc]) -> Iterator[Doc]:
+        for doc in linked_docs:
+            counts["docs"] += 1
+            counts["mentions"] += len(doc.ents)
+            yield doc
+
+    # the documents are linked as the analysis consumes them
+    with collect_stages() as timings, stage("entity_linking") as timing:
+        linked_docs = nlp.pipe(docs, batch_size=config.linking_batch_size)
+        for_review = analyse_el_docs(counted(linked_docs), config.review_rows_path)
+        timing.items = counts["docs"]
+
+    metadata = {
+        "rows": len(for_review),
+        "docs_with_rows": for_review["doc_id"].nunique(),
+        **counts,
+        "mentions_per_second": (
+            counts["mentions"] / timing.wall_seconds if timing.wall_seconds else 0.0
+        ),
+        **stages_metadata(timings),
+    }
+    metadata["exact_alias_links"] = exact_alias_linker.linked  # type: ignore
+    metadata.update({f"linker_{key}": value for key, value in asdict(ann_linker.stats).items()})
+    metadata.update({f"cache_{key}": value for key, value in asdict(linking_cache.stats).items()})
+    metadata["cache_hit_rate"] = linking_cache.stats.hit_rate
+    linking_cache.save()
+    return Output(for_review, metadata=metadata)
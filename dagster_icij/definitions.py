@@ -1,12 +1,16 @@
 from dagster import Definitions, InMemoryIOManager, load_assets_from_modules
 
-from dagster_icij import assets
+from dagster_icij import assets, partitioned_assets
+from dagster_icij.io_managers import ArrowIOManager
 
 all_assets = load_assets_from_modules([assets])
+# the same pipeline, partitioned by shards of the Senzing results
+sharded_assets = load_assets_from_modules([partitioned_assets])
 
 defs = Definitions(
-    assets=all_assets,
+    assets=[*all_assets, *sharded_assets],
     resources={
         "mem_io_manager": InMemoryIOManager(),
+        "arrow_io_manager": ArrowIOManager(),
     },
 )
@@ -0,0 +1,78 @@
+"""IO manager storing the large assets of the Senzing pipeline as Arrow IPC files.
+
+The default IO manager pickles the assets, which turns the entity features and the graph into
+millions of Python objects at every step. Here, the entity features are stored as a table, the
+alias records as the table of their columns and the graph as the tables of the Senzing cache,
+which downstream assets memory-map. The tables of a cache entry are passed through as they are.
+"""
+
+import pathlib
+
+import pyarrow as pa
+from dagster import (
+    ConfigurableIOManagerFactory,
+    InitResourceContext,
+    InputContext,
+    OutputContext,
+    UPathIOManager,
+)
+from upath import UPath
+
+from src.senzing_cache import graph_to_tables, read_table, tables_to_graph, write_table
+from src.senzing_pipeline import AliasRecords, SenzingGraph
+
+# the single table of a pa.Table asset and of an AliasRecords asset, next to which SenzingGraph
+# assets store their tables
+TABLE: str = "table"
+ALIASES: str = "aliases"
+
+
+class ArrowTablesIOManager(UPathIOManager):
+    """Store each asset as a directory of Arrow IPC files: a table, alias records or a graph.
+
+    Tables are loaded as zero-copy views on the memory-mapped files, so downstream assets filter
+    them with Arrow compute functions. Only local paths can be memory-mapped.
+    """
+
+    extension: str = ""
+
+    def dump_to_path(self, context: OutputContext, obj, path: UPath) -> None:
+        if isinstance(obj, pa.Table):
+            tables = {TABLE: obj}
+        elif isinstance(obj, AliasRecords):
+            tables = {ALIASES: obj.to_table()}
+        elif isinstance(obj, SenzingGraph):
+            tables = graph_to_tables(obj)
+        elif isinstance(obj, dict) and all(isinstance(t, pa.Table) for t in obj.values()):
+            # the tables of a graph, as read from the Senzing cache
+            tables = obj
+        else:
+            raise TypeError(f"Cannot store {type(obj).__name__} as Arrow tables")
+
+        path = pathlib.Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for stale in path.glob("*.arrow"):
+            stale.unlink()
+        for name, table in tables.items():
+            write_table(table, path / f"{name}.arrow")
+
+    def load_from_path(
+        self, context: InputContext, path: UPath
+    ) -> pa.Table | AliasRecords | SenzingGraph:
+        path = pathlib.Path(path)
+        tables = {table.stem: read_table(table) for table in path.glob("*.arrow")}
+        if TABLE in tables:
+            return tables[TABLE]
+        if ALIASES in tables:
+            return AliasRecords.from_table(tables[ALIASES])
+        return tables_to_graph(tables)
+
+
+class ArrowIOManager(ConfigurableIOManagerFactory):
+    """Arrow IPC files under `base_dir`, the storage directory of the instance by default."""
+
+    base_dir: str | None = None
+
+    def create_io_manager(self, context: InitResourceContext) -> ArrowTablesIOManager:
+        base_dir = self.base_dir or context.instance.storage_directory()  # type: ignore[union-attr]
+        return ArrowTablesIOManager(base_path=UPath(base_dir))
@@ -0,0 +1,273 @@
+"""The Senzing pipeline, partitioned by shards of the Senzing results.
+
+Each partition parses a line-aligned byte range of the results file, so the partitions run in
+parallel and a failed or stale shard is materialized again on its own. The graph and the
+suspicious ids need every entity for the multi-hop expansion, so they are not partitioned, and
+the JSONL files are assembled from the shards in file order, the same as the unpartitioned
+pipeline writes them. The shards are byte ranges, so the Senzing results must be decompressed.
+
+The assets have the "sharded" key prefix, next to the unpartitioned ones.
+"""
+
+import os
+import pathlib
+import shutil
+
+import pandas as pd
+import pyarrow as pa
+from dagster import (
+    AssetExecutionContext,
+    AssetIn,
+    AssetKey,
+    AssetOut,
+    AssetRecordsFilter,
+    MaterializeResult,
+    Output,
+    StaticPartitionsDefinition,
+    asset,
+    multi_asset,
+)
+
+from dagster_icij import assets
+from dagster_icij.assets import ICIJSenzingConfig
+from src.exact_aliases import write_exact_aliases
+from src.instrumentation import collect_stages, stages_metadata
+from src.senzing_cache import CACHE_DIR, fingerprint_report
+from src.senzing_pipeline import (
+    AliasRecords,
+    EdgeList,
+    SenzingGraph,
+    SenzingReport,
+    alias_pair_counts,
+    aliases_from_pair_counts,
+    entity_features_table,
+    filter_alias_table,
+    filter_entity_features,
+    filter_senzing,
+    generate_entities_batch,
+    read_report_range,
+    report_offsets,
+    write_aliases,
+    write_entities_batch,
+)
+
+SENZING_SHARDS: int = 16
+
+GROUP_NAME: str = "senzing_pipeline_sharded"
+KEY_PREFIX: str = "sharded"
+
+
+def sharded(*names: str) -> dict[str, AssetIn]:
+    """The inputs of an asset from the other sharded assets."""
+    return {name: AssetIn(key_prefix=KEY_PREFIX) for name in names}
+
+
+senzing_shards = StaticPartitionsDefinition([f"{shard:03d}" for shard in range(SENZING_SHARDS)])
+
+
+def shard_fingerprint(context: AssetExecutionContext, name: str, shard: str) -> str | None:
+    """Fingerprint of the Senzing results the latest materialization of a shard was read from."""
+    records = context.instance.fetch_materializations(
+        AssetRecordsFilter(asset_key=AssetKey([KEY_PREFIX, name]), asset_partitions=[shard]),
+        limit=1,
+    ).records
+    if not records or records[0].asset_materialization is None:
+        return None
+    fingerprint = records[0].asset_materialization.metadata.get("fingerprint")
+    return fingerprint.value if fingerprint is not None else None
+
+
+def check_shard_fingerprints(context: AssetExecutionContext, name: str) -> str:
+    """Fingerprint of the Senzing results all the shards of an asset were read from.
+
+    The byte ranges of the shards are aligned on the lines of the results, so shards read from
+    different versions of the results cannot be merged.
+    """
+    fingerprints = {
+        shard: shard_fingerprint(context, name, shard)
+        for shard in senzing_shards.get_partition_keys()
+    }
+    if len(set(fingerprints.values())) != 1 or None in fingerprints.values():
+        raise ValueError(
+            f"The shards of {name} were read from different Senzing results, materialize them"
+            f" again: {fingerprints}"
+        )
+    return next(iter(fingerprints.values()))
+
+
+def entity_parts_dir(config: ICIJSenzingConfig) -> pathlib.Path:
+    path = pathlib.Path(config.output_entities_jsonl_path)
+    return path.with_name(f"{path.name}.parts")
+
+
+@multi_asset(
+    outs={
+        "graph_shard": AssetOut(key_prefix=KEY_PREFIX),
+        "raw_entities": AssetOut(key_prefix=KEY_PREFIX, io_manager_key="arrow_io_manager"),
+        "raw_aliases": AssetOut(key_prefix=KEY_PREFIX, io_manager_key="arrow_io_manager"),
+    },
+    deps=[assets.icij_senzing_results.key],
+    group_name=GROUP_NAME,
+    partitions_def=senzing_shards,
+)
+def senzing_report_shard(context: AssetExecutionContext, config: ICIJSenzingConfig):
+    shard = int(context.partition_key)
+    # the offsets are moved to the start of the next line, so they depend on the content of the
+    # results: the shards are only merged if they were all read from the same results
+    offsets = report_offsets(config.senzing_results_path, SENZING_SHARDS)
+    start, end = offsets[shard], offsets[shard + 1]
+    if start < end:
+        report = read_report_range(config.senzing_results_path, start, end)
+    else:
+        report = SenzingReport()
+    fingerprint = fingerprint_report(
+        config.senzing_results_path, config.senzing_cache_dir or CACHE_DIR
+    )
+    metadata = {"start": start, "end": end, "fingerprint": fingerprint}
+
+    # the relationships are linked once the shards are merged into the graph
+    graph_shard = SenzingReport(graph=report.graph, edges=report.edges)
+    yield Output(graph_shard, output_name="graph_shard", metadata=metadata)
+    yield Output(
+        entity_features_table(report.entities), output_name="raw_entities", metadata=metadata
+    )
+    yield Output(report.aliases.to_table(), output_name="raw_aliases", metadata=metadata)
+
+
+@asset(
+    key_prefix=KEY_PREFIX,
+    group_name=GROUP_NAME,
+    ins=sharded("graph_shard"),
+    io_manager_key="arrow_io_manager",
+)
+def graph(
+    context: AssetExecutionContext, graph_shard: dict[str, SenzingReport]
+) -> Output[SenzingGraph]:
+    fingerprint = check_shard_fingerprints(context, "graph_shard")
+    merged = SenzingGraph()
+    edges = EdgeList()
+    for shard in sorted(graph_shard):
+        merged.entities.update(graph_shard[shard].graph.entities)
+        merged.records.extend(graph_shard[shard].graph.records)
+        edges.extend(graph_shard[shard].edges)
+    merged.link(edges)
+    return Output(merged, metadata={"fingerprint": fingerprint})
+
+
+@asset(key_prefix=KEY_PREFIX, group_name=GROUP_NAME, ins=sharded("graph"))
+def suspicious_ids(
+    config: ICIJSenzingConfig, suspicions: list[str], graph: SenzingGraph
+) -> Output[set[str]]:
+    with collect_stages() as timings:
+        entity_ids = filter_senzing(
+            suspicions, graph, config.name_match, config.hops, config.match_levels
+        )
+    return Output(entity_ids, metadata=stages_metadata(timings))
+
+
+@asset(
+    key_prefix=KEY_PREFIX,
+    group_name=GROUP_NAME,
+    partitions_def=senzing_shards,
+    ins=sharded("suspicious_ids", "raw_entities"),
+    io_manager_key="arrow_io_manager",
+)
+def filtered_entities(
+    context: AssetExecutionContext, suspicious_ids: set[str], raw_entities: pa.Table
+) -> Output[pa.Table]:
+    fingerprint = shard_fingerprint(context, "raw_entities", context.partition_key)
+    return Output(
+        filter_entity_features(raw_entities, suspicious_ids), metadata={"fingerprint": fingerprint}
+    )
+
+
+@asset(
+    key_prefix=KEY_PREFIX,
+    group_name=GROUP_NAME,
+    partitions_def=senzing_shards,
+    ins=sharded("suspicious_ids", "raw_aliases"),
+    io_manager_key="arrow_io_manager",
+)
+def filtered_aliases(suspicious_ids: set[str], raw_aliases: pa.Table) -> AliasRecords:
+    return AliasRecords.from_table(filter_alias_table(raw_aliases, suspicious_ids))
+
+
+@asset(
+    key_prefix=KEY_PREFIX,
+    group_name=GROUP_NAME,
+    partitions_def=senzing_shards,
+    ins=sharded("filtered_entities"),
+)
+def entities_jsonl_part(
+    context: AssetExecutionContext,
+    config: ICIJSenzingConfig,
+    filtered_entities: pa.Table,
+    countries: dict,
+) -> MaterializeResult:
+    parts = entity_parts_dir(config)
+    parts.mkdir(parents=True, exist_ok=True)
+    with collect_stages() as timings:
+        entities = generate_entities_batch(filtered_entities, countries)
+        write_entities_batch(entities, parts / f"{context.partition_key}.jsonl")
+    fingerprint = shard_fingerprint(context, "filtered_entities", context.partition_key)
+    return MaterializeResult(
+        metadata={
+            "entities": entities.num_rows,
+            "fingerprint": fingerprint,
+            **stages_metadata(timings),
+        }
+    )
+
+
+@asset(
+    key_prefix=KEY_PREFIX,
+    group_name=GROUP_NAME,
+    partitions_def=senzing_shards,
+    ins=sharded("filtered_aliases"),
+)
+def alias_pairs(filtered_aliases: AliasRecords) -> pd.DataFrame:
+    return alias_pair_counts(filtered_aliases)
+
+
+@asset(key_prefix=KEY_PREFIX, group_name=GROUP_NAME, deps=[entities_jsonl_part])
+def entities_jsonl(context: AssetExecutionContext, config: ICIJSenzingConfig) -> MaterializeResult:
+    parts = [
+        entity_parts_dir(config) / f"{shard}.jsonl" for shard in senzing_shards.get_partition_keys()
+    ]
+    missing = [part.name for part in parts if not part.exists()]
+    if missing:
+        raise FileNotFoundError(f"Shards {missing} of the entities are not materialized")
+    fingerprint = check_shard_fingerprints(context, "entities_jsonl_part")
+
+    # readers never see a partly merged file
+    output = pathlib.Path(config.output_entities_jsonl_path)
+    staging = output.with_name(f".{output.name}.tmp")
+    with open(staging, "wb") as outfile:
+        for part in parts:
+            with open(part, "rb") as infile:
+                shutil.copyfileobj(infile, outfile)
+    os.replace(staging, output)
+    return MaterializeResult(metadata={"fingerprint": fingerprint})
+
+
+@asset(key_prefix=KEY_PREFIX, group_name=GROUP_NAME, ins=sharded("alias_pairs"))
+def aliases_jsonl(
+    config: ICIJSenzingConfig, alias_pairs: dict[str, pd.DataFrame]
+) -> MaterializeResult:
+    # in shard order, the pairs come in order of first appearance in the whole file
+    pairs = pd.concat([alias_pairs[shard] for shard in sorted(alias_pairs)], ignore_index=True)
+    with collect_stages() as timings:
+        aliases = aliases_from_pair_counts(pairs)
+        write_aliases(aliases, config.output_aliases_jsonl_path)
+    return MaterializeResult(metadata={"aliases": len(aliases), **stages_metadata(timings)})
+
+
+@asset(key_prefix=KEY_PREFIX, group_name=GROUP_NAME, deps=[entities_jsonl, aliases_jsonl])
+def exact_aliases(config: ICIJSenzingConfig) -> MaterializeResult:
+    # the aliases the knowledge base is built from
+    aliases, ambiguous = write_exact_aliases(
+        config.output_entities_jsonl_path,
+        config.output_aliases_jsonl_path,
+        config.output_exact_aliases_path,
+    )
+    return MaterializeResult(metadata={"aliases": aliases, "ambiguous_aliases": ambiguous})
@@ -1,37 +1,84 @@
-from typing import Iterator
+import json
+import pathlib
+from typing import Iterable, Iterator
 
 import pandas as pd
+import pyarrow as pa
 from spacy.tokens import Doc
 
+from src.instrumentation import instrumented
 
-def analyse_el_docs(docs: Iterator[Doc]) -> list[pd.DataFrame]:
-    for_review: list[pd.DataFrame] = []
-    for doc in docs:
-        records = []
-        for phrase in doc._.phrases[:30]:
-            records.append(
-                (
-                    phrase.text,
-                    phrase.rank,
-                    phrase.count,
-                    [
-                        {"text": text, "kb_id": kb_id}
-                        for text, kb_id in set(
-                            (ent.text, ent.kb_id_) for chunk in phrase.chunks for ent in chunk.ents
-                        )
-                    ],
-                )
+# entities of the top phrases of each document that the linker left without a kb_id
+REVIEW_SCHEMA = pa.schema(
+    [
+        # position of the document in the stream
+        pa.field("doc_id", pa.int64(), nullable=False),
+        pa.field("phrase", pa.string()),
+        pa.field("rank", pa.float64()),
+        pa.field("count", pa.int64()),
+        pa.field("text", pa.string()),
+        pa.field("kb_id", pa.string()),
+    ]
+)
+
+
+def review_records(docs: Iterable[Doc], top_phrases: int = 30) -> Iterator[tuple]:
+    """Rows to review, one per unlinked entity of each of the top phrases of each document."""
+    for doc_id, doc in enumerate(docs):
+        for phrase in doc._.phrases[:top_phrases]:
+            # the distinct entities of the phrase, in order of appearance
+            entities = dict.fromkeys(
+                (ent.text, ent.kb_id_) for chunk in phrase.chunks for ent in chunk.ents
             )
-        raw_entities = pd.DataFrame.from_records(
-            records, columns=["phrase", "rank", "count", "entities"]
-        ).explode("entities")
-        df = pd.concat(  # type: ignore
-            [
-                raw_entities.drop(columns="entities"),
-                pd.json_normalize(raw_entities.entities).set_index(raw_entities.index),  # type: ignore
-            ],
-            axis=1,
-        )
-        entities_to_review = df.loc[lambda d: (d.text.notnull()) & (d.kb_id == "")]
-        for_review.append(entities_to_review)
-    return for_review
+            for text, kb_id in entities:
+                if kb_id == "":
+                    yield doc_id, phrase.text, phrase.rank, phrase.count, text, kb_id
+
+
+def review_batches(
+    docs: Iterable[Doc], batch_size: int = 10_000, top_phrases: int = 30
+) -> Iterator[pa.RecordBatch]:
+    """The rows of `review_records` as Arrow record batches of at most `batch_size` rows."""
+    batch: list[tuple] = []
+    for record in review_records(docs, top_phrases):
+        batch.append(record)
+        if len(batch) == batch_size:
+            yield _to_batch(batch)
+            batch = []
+    if batch:
+        yield _to_batch(batch)
+
+
+def _to_batch(records: list[tuple]) -> pa.RecordBatch:
+    return pa.RecordBatch.from_arrays(
+        [pa.array(column, type=field.type) for column, field in zip(zip(*records), REVIEW_SCHEMA)],
+        schema=REVIEW_SCHEMA,
+    )
+
+
+def write_review_batches(
+    batches: Iterable[pa.RecordBatch], review_path: str | pathlib.Path
+) -> Iterator[pa.RecordBatch]:
+    """Append the rows of each batch to a JSONL file as the batch goes through.
+
+    The rows of the documents processed so far are on disk, even when the run is interrupted.
+    """
+    with open(review_path, "w") as outfile:
+        for batch in batches:
+            outfile.writelines(json.dumps(row) + "\n" for row in batch.to_pylist())
+            outfile.flush()
+            yield batch
+
+
+@instrumented(items=len)
+def analyse_el_docs(
+    docs: Iterable[Doc], review_path: str | pathlib.Path | None = None, batch_size: int = 10_000
+) -> pd.DataFrame:
+    """Entities to review of all documents, in a single frame with a doc_id column.
+
+    With `review_path`, the rows are also written to that JSONL file as they are found.
+    """
+    batches = review_batches(docs, batch_size)
+    if review_path is not None:
+        batches = write_review_batches(batches, review_path)
+    return pa.Table.from_batches(list(batches), schema=REVIEW_SCHEMA).to_pandas()
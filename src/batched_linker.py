@@ -0,0 +1,228 @@
+"""Entity linker that queries the knowledge base once per batch of documents.
+
+`AnnLinker` embeds each mention and each sentence around a mention on its own, and queries
+LanceDB for every mention. Within a batch of documents, the linker here embeds the distinct
+mention texts in a single encoder call, and the distinct sentences in another. It searches the
+aliases once per distinct mention text, with a single multi-vector query when LanceDB supports
+them, and runs the full-text search of the disambiguation once per distinct mention text.
+With a `LinkingCache`, the mentions already linked in earlier batches or runs are not queried.
+"""
+
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator
+
+import pyarrow as pa
+from loguru import logger
+from spacy.language import Language
+from spacy.tokens import Doc, Span
+from spacy.util import minibatch
+from spacy_lancedb_linker.linker import AnnLinker
+from spacy_lancedb_linker.types import Alias, Entity
+
+from src.linking_cache import CacheKey, LinkingCache, mention_key
+from src.scrape_cache import content_hash
+
+
+@dataclass
+class LinkingStats:
+    """What the linker did, summed over the batches of a run."""
+
+    docs: int = 0
+    # mentions not linked by an earlier component
+    mentions: int = 0
+    # mention texts and sentences embedded, and searched in the aliases table
+    distinct_mentions: int = 0
+    distinct_contexts: int = 0
+    alias_queries: int = 0
+    batches: int = 0
+
+
+@dataclass
+class BatchedAnnLinker(AnnLinker):
+    """An `AnnLinker` that links the mentions of a batch of documents together.
+
+    The candidates and the links are the same as the ones of `AnnLinker`.
+    """
+
+    batch_size: int = 64
+    stats: LinkingStats = field(default_factory=LinkingStats)
+    # whether LanceDB answers several query vectors in one search, found out on the first batch
+    multi_vector_search: bool | None = None
+    cache: LinkingCache | None = None
+
+    def __call__(self, doc: Doc) -> Doc:
+        self.link_batch([doc])
+        return doc
+
+    def pipe(self, stream: Iterable[Doc], batch_size: int | None = None) -> Iterator[Doc]:
+        for docs in minibatch(stream, size=batch_size or self.batch_size):
+            self.link_batch(docs)
+            yield from docs
+
+    def _search_aliases(self, vectors: list) -> list[list[tuple[Alias, float]]]:
+        """ANN search of the aliases, for each query vector, filtered like `AnnKnowledgeBase`."""
+        table = self.kb.db.open_table("aliases")  # type: ignore[union-attr]
+
+        def query(vector):
+            return (
+                table.search(vector)
+                .metric("cosine")
+                .limit(self.kb.top_k)  # type: ignore[union-attr]
+                .select(["alias"])
+            )
+
+        if len(vectors) > 1 and self.multi_vector_search is None:
+            try:
+                columns = query(vectors[:2]).to_arrow().column_names
+            except (pa.ArrowInvalid, ValueError):
+                # older LanceDB versions only take one query vector per search
+                columns = []
+            self.multi_vector_search = "query_index" in columns
+            if not self.multi_vector_search:
+                logger.info("LanceDB takes one query vector per search, querying each mention")
+
+        if len(vectors) > 1 and self.multi_vector_search:
+            results: list[list[dict]] = [[] for _ in vectors]
+            for row in query(vectors).to_arrow().to_pylist():
+                results[row["query_index"]].append(row)
+            self.stats.alias_queries += 1
+        else:
+            results = [query(vector).to_list() for vector in vectors]
+            self.stats.alias_queries += len(vectors)
+
+        return [
+            [
+                (Alias(**result["alias"]), abs(result["_distance"]))
+                for result in rows
+                if abs(result["_distance"]) < self.kb.max_distance  # type: ignore[union-attr]
+            ]
+            for rows in results
+        ]
+
+    def _full_text_search(self, text: str) -> list[tuple[Entity, float]]:
+        table = self.kb.db.open_table("entities")  # type: ignore[union-attr]
+        results = table.search(text, query_type="fts").select(["entity"]).to_list()
+        return [(Entity(**result["entity"]), 0) for result in results]
+
+    def _context_search(
+        self, candidate_entities: list[str], context_embedding
+    ) -> list[tuple[Entity, float]]:
+        table = self.kb.db.open_table("entities")  # type: ignore[union-attr]
+        results = (
+            table.search(context_embedding)
+            .metric("cosine")
+            .where(f"list_has({candidate_entities}, entity.entity_id)", prefilter=True)
+            .limit(self.kb.top_k)  # type: ignore[union-attr]
+            .select(["entity"])
+            .to_list()
+        )
+        return [(Entity(**result["entity"]), abs(result["_distance"])) for result in results]
+
+    def set_kb(self, kb) -> None:
+        super().set_kb(kb)
+        if self.cache is not None:
+            self.cache.validate(getattr(kb, "fingerprint", None))
+
+    def set_cache(self, cache: LinkingCache) -> None:
+        """Reuse the linking results of earlier batches and runs, for the same knowledge base."""
+        self.cache = cache
+        if self.kb is not None:
+            cache.validate(getattr(self.kb, "fingerprint", None))
+
+    def _lookup(self, key: CacheKey):
+        return self.cache.get(key) if self.cache is not None else None
+
+    def _store(self, key: CacheKey, value) -> None:
+        if self.cache is not None:
+            self.cache.put(key, value)
+
+    def link_batch(self, docs: list[Doc]) -> None:
+        """Annotate the mentions of the documents like `AnnLinker` does, one query per batch."""
+        if not self.kb:
+            raise ValueError("KnowledgeBase `kb` required for AnnLinker")
+
+        # the mentions linked by an earlier component, e.g. the exact aliases, are kept as is
+        mentions: list[Span] = [ent for doc in docs for ent in doc.ents if not ent.kb_id_]
+        self.stats.docs += len(docs)
+        self.stats.mentions += len(mentions)
+        self.stats.batches += 1
+        if not mentions:
+            return
+
+        # with a cache, the mentions are keyed by their normalized text, and their label
+        keys = [
+            mention_key(ent) if self.cache is not None else (ent.text, ent.label_)
+            for ent in mentions
+        ]
+        # the alias candidates of each key, and the entities found by full-text search
+        candidates: dict[CacheKey, tuple[list, list]] = {}
+        missing: dict[CacheKey, str] = {}
+        for ent, key in zip(mentions, keys):
+            if key not in candidates and key not in missing:
+                cached = self._lookup(key)
+                if cached is not None:
+                    candidates[key] = cached
+                else:
+                    missing[key] = ent.text
+
+        texts = list(missing.values())
+        vectors = self.kb.encoder.generate_embeddings(texts) if texts else []
+        for (key, text), alias_candidates in zip(
+            missing.items(), self._search_aliases(list(vectors))
+        ):
+            # the full-text search does not depend on the candidates, nor on the context
+            full_text = self._full_text_search(text) if alias_candidates else []
+            candidates[key] = (alias_candidates, full_text)
+            self._store(key, candidates[key])
+        self.stats.distinct_mentions += len(texts)
+
+        # the entities found by context, for the mentions with candidates but no full-text match
+        by_context: dict[CacheKey, list] = {}
+        missing_contexts: dict[CacheKey, Span] = {}
+        for ent, key in zip(mentions, keys):
+            alias_candidates, full_text = candidates[key]
+            if not alias_candidates or full_text:
+                continue
+            ctx_key = (*key, content_hash(ent.sent.text))
+            if ctx_key not in by_context and ctx_key not in missing_contexts:
+                cached = self._lookup(ctx_key)
+                if cached is not None:
+                    by_context[ctx_key] = cached
+                else:
+                    missing_contexts[ctx_key] = ent
+
+        contexts = list(dict.fromkeys(ent.sent.text for ent in missing_contexts.values()))
+        context_embeddings = (
+            dict(zip(contexts, self.kb.encoder.generate_embeddings(contexts))) if contexts else {}
+        )
+        for ctx_key, ent in missing_contexts.items():
+            by_context[ctx_key] = self._context_search(
+                self.kb._aliases_to_entities(candidates[ctx_key[:-1]][0]),
+                context_embeddings[ent.sent.text],
+            )
+            self._store(ctx_key, by_context[ctx_key])
+        self.stats.distinct_contexts += len(contexts)
+
+        for ent, key in zip(mentions, keys):
+            alias_candidates, full_text = candidates[key]
+            ent._.alias_candidates = alias_candidates
+            if not alias_candidates:
+                continue
+
+            kb_candidates = full_text or by_context[(*key, content_hash(ent.sent.text))]
+            ent._.kb_candidates = kb_candidates
+
+            if self.use_disambiguation_threshold:
+                kb_candidates = [
+                    (entity, cosine_score)
+                    for entity, cosine_score in kb_candidates
+                    if cosine_score < self.kb.max_distance
+                ]
+            if kb_candidates:
+                for token in ent:
+                    token.ent_kb_id_ = kb_candidates[0][0].entity_id
+
+
+@Language.factory("batched_ann_linker", default_config={"batch_size": 64})
+def create_batched_ann_linker(nlp: Language, name: str, batch_size: int) -> BatchedAnnLinker:
+    return BatchedAnnLinker(batch_size=batch_size)
@@ -0,0 +1,105 @@
+"""spaCy datasets stored as DocBin shards.
+
+A single `DocBin` holds every Doc of the dataset in memory until it is written. The writer here
+starts a new DocBin file whenever the current one reaches a size bound, and the dataset is read
+back one shard at a time, so memory stays flat however many articles are scraped.
+"""
+
+import json
+import pathlib
+import shutil
+from dataclasses import dataclass, field
+from typing import Iterator
+
+from spacy.tokens import Doc, DocBin
+from spacy.vocab import Vocab
+
+SHARDS_MANIFEST: str = "shards.json"
+# size of a shard before compression, as estimated from its token attributes and texts
+MAX_SHARD_BYTES: int = 64 * 2**20
+
+
+@dataclass
+class DocShards:
+    """A spaCy dataset on disk, either a directory of DocBin shards or a single DocBin file.
+
+    Only the paths are kept in memory, so the dataset can be passed between assets cheaply.
+    """
+
+    path: str
+    shards: list[str] = field(default_factory=list)
+    num_docs: int = 0
+
+    @classmethod
+    def from_disk(cls, path: str | pathlib.Path) -> "DocShards":
+        path = pathlib.Path(path)
+        if path.is_file():
+            return cls(str(path.parent), [path.name], len(DocBin().from_disk(path)))
+        with open(path / SHARDS_MANIFEST) as fp:
+            manifest = json.load(fp)
+        return cls(str(path), manifest["shards"], manifest["num_docs"])
+
+    def __len__(self) -> int:
+        return self.num_docs
+
+    def get_docs(self, vocab: Vocab) -> Iterator[Doc]:
+        """Docs of the dataset in order, with a single shard in memory at a time."""
+        for shard in self.shards:
+            yield from DocBin().from_disk(pathlib.Path(self.path) / shard).get_docs(vocab)
+
+
+class DocShardWriter:
+    """Write Docs to DocBin shards of bounded size in a directory, replacing it when closed.
+
+    The shards are written to a staging directory as they fill up, a reader never sees a
+    dataset half written.
+    """
+
+    def __init__(self, path: str | pathlib.Path, max_shard_bytes: int = MAX_SHARD_BYTES):
+        self.path = pathlib.Path(path)
+        self.max_shard_bytes = max_shard_bytes
+        self.staging = self.path.with_name(f".{self.path.name}.tmp")
+        shutil.rmtree(self.staging, ignore_errors=True)
+        self.staging.mkdir(parents=True)
+        self.shards: list[str] = []
+        self.num_docs = 0
+        self._doc_bin = DocBin()
+        self._shard_bytes = 0
+
+    def add(self, doc: Doc) -> None:
+        self._doc_bin.add(doc)
+        self.num_docs += 1
+        # DocBin keeps an uint64 array of the attributes of each token, and the text
+        self._shard_bytes += len(doc) * len(self._doc_bin.attrs) * 8 + len(doc.text.encode())
+        if self._shard_bytes >= self.max_shard_bytes:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not len(self._doc_bin):
+            return
+        shard = f"{len(self.shards):05d}.spacy"
+        self._doc_bin.to_disk(self.staging / shard)
+        self.shards.append(shard)
+        self._doc_bin = DocBin()
+        self._shard_bytes = 0
+
+    def close(self) -> DocShards:
+        self._flush()
+        with open(self.staging / SHARDS_MANIFEST, "w") as fp:
+            json.dump({"shards": self.shards, "num_docs": self.num_docs}, fp)
+        # the dataset used to be a single DocBin file
+        if self.path.is_file():
+            self.path.unlink()
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.staging.rename(self.path)
+        return DocShards(str(self.path), self.shards, self.num_docs)
+
+    def abort(self) -> None:
+        shutil.rmtree(self.staging, ignore_errors=True)
+
+    def __enter__(self) -> "DocShardWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        if exc_type is not None:
+            self.abort()
@@ -0,0 +1,112 @@
+"""Exact-alias fast path of the entity linking.
+
+Most mentions in the articles are written exactly like one of the aliases of the Senzing
+results, and most aliases belong to a single entity. The component here links such mentions to
+their entity straight away, with a lookup of the mention text in a table of the unambiguous
+aliases of the knowledge base, see `read_kb_inputs`. The ANN linker then only queries the
+knowledge base for the other mentions. The table is saved with msgpack, so that loading the
+pipeline does not rebuild it from millions of aliases.
+
+The table is looked up rather than matched with a PhraseMatcher of the `generate_patterns`
+patterns, for three reasons:
+
+- the mentions are the NER spans, the ones the ANN linker links too: matching the patterns over
+  the whole text would also link phrases that the NER did not find, and so change the results
+  of the linking instead of speeding it up;
+- a PhraseMatcher is not serializable as such, it pickles its pattern Docs and adds them again
+  when it is loaded, which is the rebuild from millions of aliases on every startup;
+- the patterns hold every raw alias, ambiguous ones and entities missing from the knowledge
+  base included, which have to be left out of the fast path anyway.
+"""
+
+import pathlib
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Iterable
+
+import srsly
+from loguru import logger
+from spacy.language import Language
+from spacy.tokens import Doc
+from spacy_lancedb_linker.types import Alias, Entity
+
+from src.knowledge_base import read_kb_inputs
+
+# bump whenever the table changes for the same entities and aliases
+EXACT_ALIASES_VERSION: str = "2"
+EXACT_ALIASES_FILE: str = "exact_aliases.msgpack"
+
+
+def build_exact_aliases(
+    entities: Iterable[Entity], aliases: Iterable[Alias]
+) -> tuple[dict[str, str], int]:
+    """Map from each alias of a single entity to its entity id, and the number of other aliases.
+
+    The entities and aliases are those of the knowledge base, entity names included. Only the
+    entities of the knowledge base can be linked, the others are left out of the aliases.
+    """
+    known = {entity.entity_id for entity in entities}
+    entity_ids: dict[str, set[str]] = defaultdict(set)
+    for alias in aliases:
+        ids = known.intersection(alias.entities)
+        if ids:
+            entity_ids[alias.alias].update(ids)
+    table = {alias: next(iter(ids)) for alias, ids in entity_ids.items() if len(ids) == 1}
+    return table, len(entity_ids) - len(table)
+
+
+def write_exact_aliases(
+    entities_path: str | pathlib.Path,
+    aliases_path: str | pathlib.Path,
+    output_path: str | pathlib.Path,
+) -> tuple[int, int]:
+    """Save the exact aliases of the knowledge base JSONL files, see `build_exact_aliases`."""
+    aliases, ambiguous = build_exact_aliases(*read_kb_inputs(entities_path, aliases_path))
+    ExactAliasLinker(aliases).to_disk(output_path)
+    return len(aliases), ambiguous
+
+
+@dataclass
+class ExactAliasLinker:
+    """Link the mentions that are exactly an unambiguous alias, ahead of the ANN linker."""
+
+    aliases: dict[str, str] = field(default_factory=dict)
+    # mentions seen, and linked by an exact alias, by this process: the linking runs in a single
+    # process, so they count every mention of the documents
+    mentions: int = 0
+    linked: int = 0
+
+    def __call__(self, doc: Doc) -> Doc:
+        for ent in doc.ents:
+            self.mentions += 1
+            entity_id = self.aliases.get(ent.text)
+            if entity_id is not None and not ent.kb_id_:
+                for token in ent:
+                    token.ent_kb_id_ = entity_id
+                self.linked += 1
+        return doc
+
+    def to_disk(self, path: str | pathlib.Path, exclude: Iterable[str] = tuple()) -> None:
+        path = pathlib.Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        srsly.write_msgpack(
+            path / EXACT_ALIASES_FILE, {"version": EXACT_ALIASES_VERSION, "aliases": self.aliases}
+        )
+
+    def from_disk(
+        self, path: str | pathlib.Path, exclude: Iterable[str] = tuple()
+    ) -> "ExactAliasLinker":
+        data = srsly.read_msgpack(pathlib.Path(path) / EXACT_ALIASES_FILE)
+        if data["version"] != EXACT_ALIASES_VERSION:
+            raise ValueError(
+                f"{path} holds version {data['version']} of the exact aliases, "
+                f"expected {EXACT_ALIASES_VERSION}: build it again"
+            )
+        self.aliases = data["aliases"]
+        logger.info(f"Loaded {len(self.aliases)} exact aliases from {path}")
+        return self
+
+
+@Language.factory("exact_alias_linker")
+def create_exact_alias_linker(nlp: Language, name: str) -> ExactAliasLinker:
+    return ExactAliasLinker()
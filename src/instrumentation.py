@@ -0,0 +1,246 @@
+"""Wall time, CPU time, peak memory and throughput of the stages of the pipelines.
+
+A stage is a block of code timed with `stage`, or a function decorated with `instrumented`:
+
+    with stage("generate_entities") as timing:
+        entities = generate_entities_batch(features, countries)
+        timing.items = entities.num_rows
+
+Each stage is logged with its numbers as structured fields. The stages that finish within
+`collect_stages` are collected too, e.g. by the dagster assets to report them as metadata.
+
+Setting the ERKG_PROFILE environment variable to a comma-separated list of stage names, or to
+"all", also samples the call stacks of those stages. The samples are written as collapsed stacks,
+which flame graph tools read, to the ERKG_PROFILE_DIR directory.
+"""
+
+import functools
+import os
+import pathlib
+import re
+import resource
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Iterator
+
+from loguru import logger
+
+PROFILE_ENV: str = "ERKG_PROFILE"
+PROFILE_DIR_ENV: str = "ERKG_PROFILE_DIR"
+PROFILE_DIR: str = "data/profiles"
+
+
+@dataclass
+class StageTiming:
+    """What a stage took, and how many items it processed."""
+
+    stage: str
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    peak_rss_mb: float = 0.0
+    # "process" where the peak cannot be reset at the start of the stage, e.g. outside Linux:
+    # peak_rss_mb is then the peak of the process so far, not of the stage
+    peak_rss_scope: str = "stage"
+    items: int = 0
+    profile_path: str | None = None
+
+    @property
+    def items_per_second(self) -> float:
+        return self.items / self.wall_seconds if self.wall_seconds else 0.0
+
+    def metadata(self) -> dict[str, float | int | str]:
+        """The numbers of the stage, with keys prefixed by its name."""
+        metadata: dict[str, float | int | str] = {
+            f"{self.stage}_wall_seconds": self.wall_seconds,
+            f"{self.stage}_cpu_seconds": self.cpu_seconds,
+            f"{self.stage}_peak_rss_mb": self.peak_rss_mb,
+            f"{self.stage}_peak_rss_scope": self.peak_rss_scope,
+            f"{self.stage}_items": self.items,
+            f"{self.stage}_items_per_second": self.items_per_second,
+        }
+        if self.profile_path is not None:
+            metadata[f"{self.stage}_profile"] = self.profile_path
+        return metadata
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of the current process, in MiB.
+
+    The stages reset it on Linux, see `reset_peak_rss`, so the peak of a block of code is the one
+    of its `stage` timing.
+    """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kibibytes on Linux
+    return max_rss / 2**20 if sys.platform == "darwin" else max_rss / 2**10
+
+
+def _proc_status_mb(field: str) -> float | None:
+    try:
+        with open("/proc/self/status") as fp:
+            match = re.search(rf"^{field}:\s+(\d+) kB", fp.read(), re.MULTILINE)
+    except OSError:
+        return None
+    return int(match.group(1)) / 2**10 if match else None
+
+
+def reset_peak_rss() -> bool:
+    """Reset the peak resident set size of the process to the current one, only on Linux.
+
+    getrusage reports the reset peak too.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as fp:
+            fp.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def stage_peak_rss_mb() -> float:
+    """Peak resident set size since the last reset, since the process started without one."""
+    return _proc_status_mb("VmHWM") or peak_rss_mb()
+
+
+class SamplingProfiler:
+    """Sample the call stack of a thread at a fixed interval, from a background thread."""
+
+    def __init__(self, thread_id: int | None = None, interval: float = 0.005):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.samples: Counter[str] = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self) -> None:
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{pathlib.Path(code.co_filename).name}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def write(self, path: str | pathlib.Path) -> None:
+        """Write the samples as collapsed stacks, one "frame;frame;frame count" line per stack."""
+        with open(path, "w") as fp:
+            for stack, count in self.samples.most_common():
+                fp.write(f"{stack} {count}\n")
+
+
+def _profiled(name: str) -> bool:
+    stages = {value.strip() for value in os.environ.get(PROFILE_ENV, "").split(",")}
+    return name in stages or "all" in stages
+
+
+# the stages in progress, innermost last, and the collectors of finished stages, of the current
+# thread or task: the stages of another thread are neither enclosing nor collected
+_running: ContextVar[tuple[StageTiming, ...]] = ContextVar("running_stages", default=())
+_collectors: ContextVar[tuple[list[StageTiming], ...]] = ContextVar("stage_collectors", default=())
+
+
+@contextmanager
+def stage(name: str, profile: bool | None = None) -> Iterator[StageTiming]:
+    """Time the block as the stage `name`, the block sets the items it processed.
+
+    The stage is profiled when `profile` is True, or when ERKG_PROFILE names it. The peak RSS is
+    that of the process, so it also covers the stages running concurrently in other threads.
+    """
+    timing = StageTiming(name)
+    profiler = SamplingProfiler() if (profile if profile is not None else _profiled(name)) else None
+
+    # the peak of an enclosing stage also covers the stages within it
+    outer_peak = stage_peak_rss_mb()
+    for running in _running.get():
+        running.peak_rss_mb = max(running.peak_rss_mb, outer_peak)
+    if not reset_peak_rss():
+        timing.peak_rss_scope = "process"
+    token = _running.set((*_running.get(), timing))
+
+    if profiler is not None:
+        profiler.start()
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield timing
+    finally:
+        timing.wall_seconds = time.perf_counter() - wall
+        timing.cpu_seconds = time.process_time() - cpu
+        timing.peak_rss_mb = max(timing.peak_rss_mb, stage_peak_rss_mb())
+        _running.reset(token)
+        for running in _running.get():
+            running.peak_rss_mb = max(running.peak_rss_mb, timing.peak_rss_mb)
+
+        if profiler is not None:
+            profiler.stop()
+            profile_dir = pathlib.Path(os.environ.get(PROFILE_DIR_ENV, PROFILE_DIR))
+            profile_dir.mkdir(parents=True, exist_ok=True)
+            profile_path = profile_dir / f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.folded"
+            profiler.write(profile_path)
+            timing.profile_path = str(profile_path)
+
+        logger.bind(**asdict(timing), items_per_second=timing.items_per_second).info(
+            f"{name}: {timing.wall_seconds:.2f}s wall, {timing.cpu_seconds:.2f}s CPU, "
+            f"{timing.peak_rss_mb:.0f} MiB {timing.peak_rss_scope} peak RSS, {timing.items} items, "
+            f"{timing.items_per_second:,.0f} items/s"
+        )
+        for collector in _collectors.get():
+            collector.append(timing)
+
+
+def instrumented(
+    name: str | None = None,
+    items: Callable[[Any], int] | None = None,
+    input_items: Callable[[Any], int] | None = None,
+) -> Callable[[Callable], Callable]:
+    """Time each call of the decorated function as a stage, named after the function by default.
+
+    `items` counts the items of the stage from the return value of the function, `input_items`
+    from its first argument, e.g. for the functions writing their input to a file.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name or func.__name__) as timing:
+                result = func(*args, **kwargs)
+                if items is not None:
+                    timing.items = items(result)
+                elif input_items is not None and args:
+                    timing.items = input_items(args[0])
+                return result
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def collect_stages() -> Iterator[list[StageTiming]]:
+    """Collect the stages that finish within the block, in order."""
+    timings: list[StageTiming] = []
+    token = _collectors.set((*_collectors.get(), timings))
+    try:
+        yield timings
+    finally:
+        _collectors.reset(token)
+
+
+def stages_metadata(timings: list[StageTiming]) -> dict[str, float | int | str]:
+    """The metadata of the stages, a stage that ran several times is reported by its last run."""
+    metadata: dict[str, float | int | str] = {}
+    for timing in timings:
+        metadata.update(timing.metadata())
+    return metadata
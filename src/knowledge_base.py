@@ -0,0 +1,256 @@
+"""Persistent LanceDB knowledge base for the entity linker.
+
+`AnnKnowledgeBase` overwrites its tables when it is created, so every description used to be
+embedded again on each run. The knowledge base here keeps its tables, with a fingerprint of the
+JSONL files it was built from and a content hash of each of its rows. A run with the same files
+reuses it as is, and a run with new files only upserts the entities and aliases that changed.
+"""
+
+import json
+import math
+import pathlib
+import time
+from dataclasses import dataclass
+from typing import Iterable
+
+import pyarrow as pa
+import srsly
+from loguru import logger
+from spacy_lancedb_linker.kb import FAST_AND_SMALL, AnnKnowledgeBase
+from spacy_lancedb_linker.types import Alias, Entity
+
+from src.senzing_cache import hash_file
+from src.senzing_incremental import diff_fingerprints, fingerprints
+
+KB_MANIFEST: str = "kb-manifest.json"
+# bump whenever the rows of the knowledge base change for the same input, to rebuild it
+KB_VERSION: str = "1"
+
+KB_STATE_SCHEMA = pa.schema(
+    [
+        pa.field("key", pa.string(), nullable=False),
+        pa.field("fingerprint", pa.binary(16), nullable=False),
+    ]
+)
+
+
+@dataclass
+class KnowledgeBaseDelta:
+    """How the knowledge base was brought up to date, reported as asset metadata."""
+
+    fingerprint: str
+    reused: bool
+    entities_upserted: int
+    entities_removed: int
+    aliases_upserted: int
+    aliases_removed: int
+    ann_index_rebuilt: bool
+    seconds: float
+
+
+def fingerprint_inputs(entities_path: str | pathlib.Path, aliases_path: str | pathlib.Path) -> str:
+    """Fingerprint of the files a knowledge base is built from."""
+    return f"{hash_file(entities_path)}-{hash_file(aliases_path)}"
+
+
+def read_kb_inputs(
+    entities_path: str | pathlib.Path, aliases_path: str | pathlib.Path
+) -> tuple[list[Entity], list[Alias]]:
+    """Entities and aliases of the knowledge base; each entity name is an alias of its entity."""
+    entities = [Entity(**entity) for entity in srsly.read_jsonl(entities_path)]
+    aliases = [Alias(**alias) for alias in srsly.read_jsonl(aliases_path)] + [
+        Alias(alias=entity.name, entities=[entity.entity_id], probabilities=[1])
+        for entity in entities
+    ]
+    return entities, aliases
+
+
+def _sql_in(column: str, keys: list[str]) -> str:
+    quoted = ", ".join("'" + key.replace("'", "''") + "'" for key in keys)
+    return f"{column} IN ({quoted})"
+
+
+@dataclass
+class PersistentKnowledgeBase(AnnKnowledgeBase):
+    """An `AnnKnowledgeBase` whose tables are kept from one run to the next."""
+
+    # an ANN index is rebuilt once this fraction of the rows of a table changed since the last one
+    index_rebuild_fraction: float = 0.1
+    # below this many rows, the exhaustive search is fast enough and no ANN index is built
+    index_min_rows: int = 10_000
+    embed_batch_size: int = 256
+    # number of keys per delete statement
+    delete_batch_size: int = 1_000
+
+    def _initialize_db(self) -> None:
+        # unlike the parent class, existing tables are kept, unless they were built differently
+        self.manifest = self._read_manifest()
+        built_with = {"version": KB_VERSION, "encoder": FAST_AND_SMALL}
+        if any(self.manifest.get(key) != value for key, value in built_with.items()):
+            self.db.create_table("aliases", schema=self.LanceAlias, mode="overwrite")
+            self.db.create_table("entities", schema=self.LanceEntity, mode="overwrite")
+            for state in self._path.glob("*.state.arrow"):
+                state.unlink()
+            self.manifest = built_with
+
+    @property
+    def _path(self) -> pathlib.Path:
+        return pathlib.Path(self.uri)
+
+    def _read_manifest(self) -> dict:
+        path = self._path / KB_MANIFEST
+        if not path.exists():
+            return {}
+        with open(path) as fp:
+            return json.load(fp)
+
+    def _write_manifest(self) -> None:
+        staging = self._path / f".{KB_MANIFEST}.tmp"
+        with open(staging, "w") as fp:
+            json.dump(self.manifest, fp)
+        staging.replace(self._path / KB_MANIFEST)
+
+    def _read_state(self, name: str) -> pa.Table:
+        path = self._path / f"{name}.state.arrow"
+        if not path.exists():
+            return KB_STATE_SCHEMA.empty_table()
+        with pa.memory_map(str(path), "r") as source:
+            return pa.ipc.open_file(source).read_all()
+
+    def _write_state(self, name: str, state: pa.Table) -> None:
+        staging = self._path / f".{name}.state.arrow.tmp"
+        with pa.OSFile(str(staging), "wb") as sink:
+            with pa.ipc.new_file(sink, state.schema) as writer:
+                writer.write_table(state)
+        staging.replace(self._path / f"{name}.state.arrow")
+
+    @property
+    def fingerprint(self) -> str | None:
+        """Fingerprint of the inputs the knowledge base is up to date with."""
+        return self.manifest.get("fingerprint")
+
+    def _embed_batch(self, texts: list[str]) -> list:
+        return [
+            vector
+            for start in range(0, len(texts), self.embed_batch_size)
+            for vector in self.encoder.generate_embeddings(
+                texts[start : start + self.embed_batch_size]
+            )
+        ]
+
+    def _upsert(
+        self, name: str, model: type, field: str, key: str, text: str, rows: dict[str, list]
+    ) -> tuple[int, int, bool]:
+        """Bring a table up to date with its rows, grouped by their `key` attribute.
+
+        Returns the number of upserted and removed keys, and whether the ANN index was rebuilt.
+        """
+        table = self.db.open_table(name)
+        keys = pa.array(list(rows), type=pa.string())
+        current = fingerprints(
+            pa.array(
+                [json.dumps([row.model_dump() for row in group]) for group in rows.values()],
+                type=pa.string(),
+            )
+        )
+        previous = self._read_state(name)
+        added, changed, removed = diff_fingerprints(previous, keys, current, key="key")
+
+        stale = keys.filter(added | changed).to_pylist()
+        # added keys are deleted too, in case an interrupted sync already added them
+        deleted = stale + previous.column("key").filter(removed).to_pylist()
+        for start in range(0, len(deleted), self.delete_batch_size):
+            batch = deleted[start : start + self.delete_batch_size]
+            table.delete(_sql_in(f"{field}.{key}", batch))
+
+        new_rows = [row for group in stale for row in rows[group]]
+        if new_rows:
+            vectors = self._embed_batch([getattr(row, text) for row in new_rows])
+            table.add([model(**{field: row, "vector": vec}) for row, vec in zip(new_rows, vectors)])
+        self._write_state(
+            name, pa.table({"key": keys, "fingerprint": current}, schema=KB_STATE_SCHEMA)
+        )
+
+        # LanceDB searches the rows added since the last index build exhaustively
+        unindexed = self.manifest.get(f"{name}_unindexed", 0) + len(new_rows) + int(removed.sum())
+        num_rows = table.count_rows()
+        index_rebuilt = (
+            num_rows >= self.index_min_rows and unindexed >= self.index_rebuild_fraction * num_rows
+        )
+        if index_rebuilt:
+            logger.info(f"Rebuilding the ANN index of {name}: {unindexed} changed rows")
+            table.create_index(
+                metric="cosine",
+                # the usual rule of thumb for IVF indexes
+                num_partitions=max(1, int(math.sqrt(num_rows))),
+                vector_column_name="vector",
+                replace=True,
+            )
+            unindexed = 0
+        self.manifest[f"{name}_unindexed"] = unindexed
+
+        return len(stale), int(removed.sum()), index_rebuilt
+
+    def sync(
+        self, entities: Iterable[Entity], aliases: Iterable[Alias], fingerprint: str
+    ) -> KnowledgeBaseDelta:
+        """Upsert the entities and aliases that changed since the last sync, and remove the others.
+
+        Entities are keyed by entity_id. Aliases are keyed by alias text, so all the rows of an
+        alias text are replaced together.
+        """
+        start = time.perf_counter()
+        if fingerprint == self.fingerprint:
+            logger.info(f"Knowledge base at {self.uri} is up to date")
+            return KnowledgeBaseDelta(
+                fingerprint, True, 0, 0, 0, 0, False, time.perf_counter() - start
+            )
+
+        entity_rows: dict[str, list] = {}
+        for entity in entities:
+            entity_rows.setdefault(entity.entity_id, []).append(entity)
+        alias_rows: dict[str, list] = {}
+        for alias in aliases:
+            alias_rows.setdefault(alias.alias, []).append(alias)
+
+        entities_upserted, entities_removed, entities_index = self._upsert(
+            "entities", self.LanceEntity, "entity", "entity_id", "description", entity_rows
+        )
+        if entities_upserted or entities_removed:
+            # the full-text-search index is not updated with the table
+            self.db.open_table("entities").create_fts_index("entity.name", replace=True)
+        aliases_upserted, aliases_removed, aliases_index = self._upsert(
+            "aliases", self.LanceAlias, "alias", "alias", "alias", alias_rows
+        )
+
+        self.manifest["fingerprint"] = fingerprint
+        self._write_manifest()
+        delta = KnowledgeBaseDelta(
+            fingerprint=fingerprint,
+            reused=False,
+            entities_upserted=entities_upserted,
+            entities_removed=entities_removed,
+            aliases_upserted=aliases_upserted,
+            aliases_removed=aliases_removed,
+            ann_index_rebuilt=entities_index or aliases_index,
+            seconds=time.perf_counter() - start,
+        )
+        logger.info(f"Knowledge base at {self.uri} updated: {delta}")
+        return delta
+
+
+def sync_knowledge_base(
+    uri: str,
+    entities_path: str | pathlib.Path,
+    aliases_path: str | pathlib.Path,
+    index_rebuild_fraction: float = 0.1,
+) -> tuple[PersistentKnowledgeBase, KnowledgeBaseDelta]:
+    """Open the knowledge base at `uri`, and bring it up to date with the JSONL files."""
+    ann_kb = PersistentKnowledgeBase(uri=uri, index_rebuild_fraction=index_rebuild_fraction)
+    fingerprint = fingerprint_inputs(entities_path, aliases_path)
+    entities, aliases = (
+        read_kb_inputs(entities_path, aliases_path)
+        if fingerprint != ann_kb.fingerprint
+        else ([], [])
+    )
+    return ann_kb, ann_kb.sync(entities, aliases, fingerprint)
@@ -0,0 +1,160 @@
+"""Cache of the linking results of the mentions, across documents and runs.
+
+The same mentions appear in many ICIJ articles. The knowledge base queries of a mention only
+depend on its text, except for the disambiguation by context, which only runs when the full-text
+search found nothing. The cache therefore keeps the candidates by normalized mention text and
+label, and the disambiguated entities by the same plus a fingerprint of the sentence. It evicts
+the least recently used entries beyond a size bound, can be persisted between runs, and is
+emptied whenever the knowledge base it was filled from changes.
+"""
+
+import pathlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+
+import srsly
+from loguru import logger
+from spacy.tokens import Span
+from spacy_lancedb_linker.types import Alias, Entity
+
+from src.senzing_pipeline import normalize_text
+
+# bump whenever the cached values change for the same knowledge base
+LINKING_CACHE_VERSION: str = "2"
+
+# (normalized text, label) for the candidates of a mention and the entities found by full-text
+# search, (normalized text, label, sentence fingerprint) for the entities found by context
+CacheKey = tuple[str, ...]
+
+
+@dataclass
+class LinkingCacheStats:
+    """Lookups of a run, for the candidates of the mentions and their disambiguation by context."""
+
+    mention_hits: int = 0
+    mention_misses: int = 0
+    context_hits: int = 0
+    context_misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.mention_hits + self.mention_misses + self.context_hits + self.context_misses
+        return (self.mention_hits + self.context_hits) / lookups if lookups else 0.0
+
+
+def mention_key(ent: Span) -> CacheKey:
+    # the words are kept in their order, the knowledge base queries depend on it
+    return normalize_text(ent.text), ent.label_
+
+
+class LinkingCache:
+    """LRU cache of the linking results, for a knowledge base fingerprint."""
+
+    def __init__(
+        self,
+        max_entries: int = 100_000,
+        path: str | pathlib.Path | None = None,
+        kb_fingerprint: str | None = None,
+    ):
+        self.max_entries = max_entries
+        self.path = pathlib.Path(path) if path is not None else None
+        self.kb_fingerprint = kb_fingerprint
+        self.stats = LinkingCacheStats()
+        self._entries: OrderedDict[CacheKey, Any] = OrderedDict()
+
+    @classmethod
+    def open(
+        cls,
+        path: str | pathlib.Path | None,
+        max_entries: int = 100_000,
+        kb_fingerprint: str | None = None,
+    ) -> "LinkingCache":
+        """The cache persisted at `path` if any.
+
+        The cache is empty if it was filled from another knowledge base.
+        """
+        cache = cls(max_entries, path, kb_fingerprint)
+        if cache.path is None or not cache.path.exists():
+            return cache
+        data = srsly.read_msgpack(cache.path)
+        if (data["version"], data["kb_fingerprint"]) != (LINKING_CACHE_VERSION, kb_fingerprint):
+            logger.info(f"Linking cache {cache.path} is stale, starting from an empty one")
+            return cache
+        for key, value in data["entries"][-max_entries:]:
+            cache._entries[tuple(key)] = _from_msgpack(tuple(key), value)
+        return cache
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        staging = self.path.with_name(f".{self.path.name}.tmp")
+        srsly.write_msgpack(
+            staging,
+            {
+                "version": LINKING_CACHE_VERSION,
+                "kb_fingerprint": self.kb_fingerprint,
+                # in LRU order, the most recently used last
+                "entries": [
+                    [list(key), _to_msgpack(key, value)] for key, value in self._entries.items()
+                ],
+            },
+        )
+        staging.replace(self.path)
+
+    def validate(self, kb_fingerprint: str | None) -> None:
+        """Empty the cache if it was filled from another knowledge base."""
+        if kb_fingerprint != self.kb_fingerprint:
+            if self._entries:
+                logger.info("Knowledge base changed, emptying the linking cache")
+            self._entries.clear()
+            self.kb_fingerprint = kb_fingerprint
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: CacheKey) -> Any:
+        """The cached value of the key, None when it is not cached."""
+        context = len(key) == 3
+        value = self._entries.get(key)
+        if value is None:
+            if context:
+                self.stats.context_misses += 1
+            else:
+                self.stats.mention_misses += 1
+            return None
+        self._entries.move_to_end(key)
+        if context:
+            self.stats.context_hits += 1
+        else:
+            self.stats.mention_hits += 1
+        return value
+
+    def put(self, key: CacheKey, value: Any) -> None:
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+
+def _to_msgpack(key: CacheKey, value) -> list:
+    if len(key) == 2:
+        alias_candidates, full_text = value
+        return [
+            [[alias.model_dump(), score] for alias, score in alias_candidates],
+            [[entity.model_dump(), score] for entity, score in full_text],
+        ]
+    return [[entity.model_dump(), score] for entity, score in value]
+
+
+def _from_msgpack(key: CacheKey, value: list):
+    if len(key) == 2:
+        alias_candidates, full_text = value
+        return (
+            [(Alias(**alias), score) for alias, score in alias_candidates],
+            [(Entity(**entity), score) for entity, score in full_text],
+        )
+    return [(Entity(**entity), score) for entity, score in value]
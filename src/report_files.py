@@ -0,0 +1,141 @@
+"""Streaming reads of the Senzing results, as plain JSON lines or compressed.
+
+The results are published as a zip of a multi-GB JSON lines file. Reading the `.zip`, or a
+`.gz` or `.zst` recompression of it, directly saves writing that file to disk and reading it
+back: the lines are decompressed as they are parsed.
+
+The decompression runs on a background thread, a few blocks ahead of the parsing. zlib and zstd
+release the GIL while they decompress, so the two overlap.
+"""
+
+import gzip
+import io
+import pathlib
+import queue
+import threading
+import zipfile
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator
+
+COMPRESSED_SUFFIXES: tuple[str, ...] = (".zip", ".gz", ".zst")
+BLOCK_SIZE: int = 8 * 2**20
+# blocks decompressed ahead of the parsing
+READ_AHEAD: int = 4
+
+
+def is_compressed(path: str | pathlib.Path) -> bool:
+    return pathlib.Path(path).suffix.lower() in COMPRESSED_SUFFIXES
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError as error:
+        raise ImportError("Reading .zst files needs zstandard, `pip install zstandard`") from error
+    return zstandard
+
+
+def _report_member(archive: zipfile.ZipFile) -> zipfile.ZipInfo:
+    """The single file of a zip archive of the Senzing results."""
+    members = [
+        member
+        for member in archive.infolist()
+        if not member.is_dir() and not member.filename.startswith("__MACOSX/")
+    ]
+    if len(members) != 1:
+        raise ValueError(
+            f"Expected a single file in {archive.filename}, found {[m.filename for m in members]}"
+        )
+    return members[0]
+
+
+@contextmanager
+def open_report(path: str | pathlib.Path) -> Iterator[BinaryIO]:
+    """Open the Senzing results for reading, decompressing them on the fly if need be."""
+    path = pathlib.Path(path)
+    suffix = path.suffix.lower()
+
+    if suffix == ".zip":
+        with zipfile.ZipFile(path) as archive, archive.open(_report_member(archive)) as fp:
+            yield fp  # type: ignore[misc]
+    elif suffix == ".gz":
+        with gzip.open(path, "rb") as fp:
+            yield fp  # type: ignore[misc]
+    elif suffix == ".zst":
+        with open(path, "rb") as raw, _zstandard().ZstdDecompressor().stream_reader(raw) as fp:
+            yield fp
+    else:
+        with open(path, "rb") as fp:
+            yield fp
+
+
+def report_size(path: str | pathlib.Path) -> int | None:
+    """Size of the uncompressed Senzing results, if it is known without decompressing them."""
+    path = pathlib.Path(path)
+    suffix = path.suffix.lower()
+    if suffix == ".zip":
+        with zipfile.ZipFile(path) as archive:
+            return _report_member(archive).file_size
+    if suffix in COMPRESSED_SUFFIXES:
+        return None
+    return path.stat().st_size
+
+
+def _read_ahead(fp: BinaryIO, block_size: int) -> Iterator[bytes]:
+    """Read `fp` block by block on a background thread, up to READ_AHEAD blocks ahead."""
+    blocks: queue.Queue[bytes | BaseException] = queue.Queue(maxsize=READ_AHEAD)
+    stopped = threading.Event()
+
+    def read() -> None:
+        try:
+            while not stopped.is_set():
+                block = fp.read(block_size)
+                blocks.put(block)
+                if not block:
+                    return
+        except BaseException as error:
+            blocks.put(error)
+
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+    try:
+        while True:
+            block = blocks.get()
+            if isinstance(block, BaseException):
+                raise block
+            if not block:
+                return
+            yield block
+    finally:
+        # unblock the reader when the blocks are not consumed to the end
+        stopped.set()
+        while reader.is_alive():
+            try:
+                blocks.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        reader.join()
+
+
+def iter_report_blocks(path: str | pathlib.Path, block_size: int = BLOCK_SIZE) -> Iterator[bytes]:
+    """Blocks of whole lines of the Senzing results, of about `block_size` bytes each."""
+    with open_report(path) as fp:
+        rest = b""
+        for block in _read_ahead(fp, block_size):
+            block = rest + block
+            end = block.rfind(b"\n") + 1
+            rest = block[end:]
+            if end:
+                yield block[:end]
+        if rest:
+            yield rest
+
+
+def iter_report_lines(path: str | pathlib.Path) -> Iterator[bytes]:
+    """Lines of the Senzing results, decompressed on a background thread if need be."""
+    if not is_compressed(path):
+        with open(path, "rb") as fp:
+            yield from fp
+        return
+    for block in iter_report_blocks(path):
+        yield from io.BytesIO(block)
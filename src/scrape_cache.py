@@ -0,0 +1,172 @@
+"""On-disk cache of the scraped articles.
+
+ICIJ articles rarely change once published. The cache keeps the last response of each URL, to
+make conditional requests with its ETag and Last-Modified validators, and the spaCy Doc of each
+article text, keyed by a content hash of the text. A page that did not change is then neither
+parsed nor processed by spaCy again, and neither is an article already scraped from another URL.
+"""
+
+import hashlib
+import json
+import pathlib
+import threading
+from dataclasses import dataclass
+
+import requests
+import spacy
+from spacy.tokens import Doc
+
+SCRAPE_CACHE_DIR: str = "data/scrape-cache"
+
+
+@dataclass
+class ScrapeStats:
+    """What a scraper run fetched and processed, reported at the end of the run."""
+
+    pages: int = 0
+    failed: int = 0
+    # answers to conditional requests: 304 Not Modified are hits, full responses are misses
+    not_modified: int = 0
+    downloaded: int = 0
+    bytes_downloaded: int = 0
+    bytes_saved: int = 0
+    # pages whose article text is known from a previous run, and were not parsed
+    unchanged: int = 0
+    parsed: int = 0
+    # pages with an article already in the dataset
+    duplicates: int = 0
+    doc_cache_hits: int = 0
+    nlp_runs: int = 0
+
+
+def content_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+def _write_atomic(path: pathlib.Path, data: bytes) -> None:
+    staging = path.with_name(f".{path.name}.tmp.{threading.get_ident()}")
+    staging.write_bytes(data)
+    staging.replace(path)
+
+
+class ScrapeCache:
+    """Responses by URL and spaCy Docs by article text, in a cache directory.
+
+    The methods are safe to call from the fetching threads.
+    """
+
+    def __init__(self, cache_dir: str | pathlib.Path = SCRAPE_CACHE_DIR):
+        self.responses_dir = pathlib.Path(cache_dir) / "responses"
+        self.docs_dir = pathlib.Path(cache_dir) / "docs"
+        self.responses_dir.mkdir(parents=True, exist_ok=True)
+        self.docs_dir.mkdir(parents=True, exist_ok=True)
+        self.stats = ScrapeStats()
+        self._lock = threading.Lock()
+        # the records read or written during the run, each URL is read from disk once
+        self._responses: dict[str, dict | None] = {}
+
+    def count(self, **increments: int) -> None:
+        with self._lock:
+            for name, increment in increments.items():
+                setattr(self.stats, name, getattr(self.stats, name) + increment)
+
+    def _response_path(self, url: str) -> pathlib.Path:
+        return self.responses_dir / f"{content_hash(url)}.json"
+
+    def _read_response(self, url: str) -> dict | None:
+        if url in self._responses:
+            return self._responses[url]
+        path = self._response_path(url)
+        response = None
+        if path.exists():
+            with open(path) as fp:
+                response = json.load(fp)
+            # in the unlikely case of a hash collision
+            response = response if response["url"] == url else None
+        self._responses[url] = response
+        return response
+
+    def _write_response(self, url: str, response: dict) -> None:
+        _write_atomic(self._response_path(url), json.dumps(response).encode())
+        self._responses[url] = response
+
+    def validators(self, url: str) -> dict[str, str]:
+        """Headers of a conditional request for the URL, if a response of it is cached."""
+        cached = self._read_response(url)
+        if cached is None:
+            return {}
+        headers = {}
+        if cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        if cached["last_modified"]:
+            headers["If-Modified-Since"] = cached["last_modified"]
+        return headers
+
+    def resolve(self, url: str, response: requests.Response) -> str | None:
+        """Body of the page: the cached one for a 304 answer, otherwise the new one, cached.
+
+        Returns None for a 304 answer when the cached response is gone in the meantime.
+        """
+        if response.status_code == 304:
+            cached = self._read_response(url)
+            if cached is None:
+                return None
+            self.count(not_modified=1, bytes_saved=len(cached["body"].encode()))
+            return cached["body"]
+
+        body = response.text
+        self.count(downloaded=1, bytes_downloaded=len(response.content))
+        cached = self._read_response(url) or {}
+        body_hash = content_hash(body)
+        record = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "body_hash": body_hash,
+            # the article text is the same as long as the page is
+            "extractor": cached.get("extractor") if cached.get("body_hash") == body_hash else None,
+            "text_hash": cached.get("text_hash") if cached.get("body_hash") == body_hash else None,
+            "body": body,
+        }
+        self._write_response(url, record)
+        return body
+
+    def text_hash(self, url: str, body: str, extractor: str) -> str | None:
+        """Content hash of the article text of the page, if a previous run extracted it."""
+        cached = self._read_response(url)
+        if cached is None or cached["body_hash"] != content_hash(body):
+            return None
+        return cached["text_hash"] if cached.get("extractor") == extractor else None
+
+    def set_text_hash(self, url: str, body: str, extractor: str, text_hash: str) -> None:
+        cached = self._read_response(url)
+        if cached is not None and cached["body_hash"] == content_hash(body):
+            self._write_response(url, {**cached, "extractor": extractor, "text_hash": text_hash})
+
+    def _doc_path(self, nlp: spacy.Language, text_hash: str) -> pathlib.Path:
+        # Docs from another pipeline are not reused
+        pipeline = f"{nlp.meta['lang']}_{nlp.meta['name']}-{nlp.meta['version']}"
+        pipeline += "-" + "-".join(nlp.pipe_names)
+        return self.docs_dir / content_hash(pipeline) / f"{text_hash}.doc"
+
+    def has_doc(self, nlp: spacy.Language, text_hash: str) -> bool:
+        return self._doc_path(nlp, text_hash).exists()
+
+    def load_doc(self, nlp: spacy.Language, text_hash: str) -> Doc | None:
+        """The cached Doc of the text, None if it is missing or cannot be read."""
+        path = self._doc_path(nlp, text_hash)
+        try:
+            doc = Doc(nlp.vocab).from_bytes(path.read_bytes())
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            # a truncated or corrupt Doc, stored again once the text is processed
+            path.unlink(missing_ok=True)
+            return None
+        self.count(doc_cache_hits=1)
+        return doc
+
+    def store_doc(self, nlp: spacy.Language, text_hash: str, doc: Doc) -> None:
+        path = self._doc_path(nlp, text_hash)
+        path.parent.mkdir(exist_ok=True)
+        _write_atomic(path, doc.to_bytes())
@@ -1,7 +1,25 @@
+import argparse
+import functools
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Iterator
+from urllib.parse import urlsplit
+
 import requests
 import spacy
 from bs4 import BeautifulSoup, SoupStrainer
-from spacy.tokens import DocBin
+from loguru import logger
+from requests.adapters import HTTPAdapter
+from spacy.tokens import Doc
+from urllib3.util.retry import Retry
+
+from src.doc_shards import MAX_SHARD_BYTES, DocShards, DocShardWriter
+from src.instrumentation import stage
+from src.scrape_cache import SCRAPE_CACHE_DIR, ScrapeCache, ScrapeStats, content_hash
 
 SPACY_MODEL: str = "en_core_web_md"
 SCRAPE_HEADERS: dict[str, str] = {
@@ -46,33 +64,402 @@ class IcijScraper(BeautifulSoup):
         """
 
 
-def main(spacy_dataset_path: str = "./data/dataset.spacy") -> DocBin:
-    """Entrypoint for the scraper."""
-    scrape_nlp: spacy.Language = spacy.load(SPACY_MODEL, disable=["ner"])
+@dataclass
+class FetchConfig:
+    """How the article pages are fetched."""
 
-    # ref: https://spacy.io/api/docbin
-    doc_bin = DocBin()
+    # number of pages fetched at the same time, across all hosts
+    workers: int = 8
+    # at most this many requests in flight, and this many requests started per second, per host
+    max_per_host: int = 4
+    max_rate_per_host: float = 2.0
+    # seconds to connect, and to wait for the server to send a response
+    connect_timeout: float = 5.0
+    read_timeout: float = 30.0
+    # retries of connection errors and transient HTTP errors, with exponential backoff
+    retries: int = 3
+    backoff_factor: float = 0.5
 
-    for url in URLS:
-        response: requests.Response = requests.get(
-            url,
-            headers=SCRAPE_HEADERS,
-        )
 
-        soup: IcijScraper = IcijScraper(response.text)
-        text_contents = soup.find_all(
-            ["h1", "p", "figcaption"],
-        )
+def read_urls(urls_path: str) -> list[str]:
+    """URLs to scrape from a file, one per line, ignoring blank lines and # comments."""
+    with open(urls_path) as fp:
+        return [line.strip() for line in fp if line.strip() and not line.startswith("#")]
 
-        scrape_doc: spacy.tokens.doc.Doc = scrape_nlp(
-            "\n".join(
-                [
-                    text_content.text.strip() + "." * (idx == 0)
-                    for idx, text_content in enumerate(text_contents)
-                ]
+
+def make_session(config: FetchConfig) -> requests.Session:
+    """HTTP session with a pool of keep-alive connections per host, retrying transient errors."""
+    retry = Retry(
+        total=config.retries,
+        backoff_factor=config.backoff_factor,
+        status_forcelist=[429, 500, 502, 503, 504],
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(pool_maxsize=config.workers, max_retries=retry)
+    session = requests.Session()
+    session.headers.update(SCRAPE_HEADERS)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class HostLimiter:
+    """Bound the number of requests in flight and the request rate, per host."""
+
+    def __init__(self, max_per_host: int, max_rate_per_host: float):
+        self.max_per_host = max_per_host
+        self.min_interval = 1 / max_rate_per_host
+        self._lock = threading.Lock()
+        self._semaphores: dict[str, threading.BoundedSemaphore] = {}
+        self._next_start: dict[str, float] = {}
+
+    @contextmanager
+    def limit(self, url: str) -> Iterator[None]:
+        host = urlsplit(url).netloc
+        with self._lock:
+            semaphore = self._semaphores.setdefault(
+                host, threading.BoundedSemaphore(self.max_per_host)
             )
+        with semaphore:
+            # requests to a host start at least min_interval apart
+            with self._lock:
+                now = time.monotonic()
+                start = max(now, self._next_start.get(host, now))
+                self._next_start[host] = start + self.min_interval
+            time.sleep(start - now)
+            yield
+
+
+def fetch_pages(
+    urls: list[str], config: FetchConfig | None = None, cache: ScrapeCache | None = None
+) -> Iterator[str | None]:
+    """Fetch the pages concurrently, and yield them in the order of the URLs.
+
+    At most two pages per worker are fetched ahead of the one consumed, so that the pages are
+    never all in memory. With a cache, the requests are conditional and the pages that did not
+    change come from the cache. A page that cannot be fetched is logged and comes back as None,
+    the other pages are still fetched.
+    """
+    config = config or FetchConfig()
+    limiter = HostLimiter(config.max_per_host, config.max_rate_per_host)
+
+    with make_session(config) as session:
+
+        def get(url: str, headers: dict[str, str]) -> requests.Response:
+            with limiter.limit(url):
+                response = session.get(
+                    url, headers=headers, timeout=(config.connect_timeout, config.read_timeout)
+                )
+            response.raise_for_status()
+            return response
+
+        def fetch(url: str) -> str | None:
+            try:
+                if cache is None:
+                    return get(url, {}).text
+                page = cache.resolve(url, get(url, cache.validators(url)))
+                return page if page is not None else cache.resolve(url, get(url, {}))
+            except requests.RequestException as error:
+                logger.warning(f"Skipping {url}: {error}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=config.workers) as executor:
+            pending: deque[Future[str | None]] = deque()
+            try:
+                for url in urls:
+                    pending.append(executor.submit(fetch, url))
+                    if len(pending) > 2 * config.workers:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                # the pages are not consumed to the end
+                for future in pending:
+                    future.cancel()
+
+
+def _join_paragraphs(paragraphs: list[str]) -> str:
+    return "\n".join(
+        [paragraph.strip() + "." * (idx == 0) for idx, paragraph in enumerate(paragraphs)]
+    )
+
+
+def bs4_article_text(markup: str) -> str:
+    """Text of the header and body of an ICIJ article, one paragraph per line.
+
+    This is the reference extractor, the other ones give the same text.
+    """
+    soup: IcijScraper = IcijScraper(markup)
+    text_contents = soup.find_all(
+        ["h1", "p", "figcaption"],
+    )
+    return _join_paragraphs([text_content.text for text_content in text_contents])
+
+
+def _has_class(name: str) -> str:
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+# the paragraphs of IcijScraper, in document order
+ARTICLE_XPATH: str = (
+    "//*[self::h1 or self::p or self::figcaption]"
+    f"[ancestor::header[{_has_class('post-header')}] or ancestor::div[{_has_class('post-body')}]]"
+)
+# like the text of a BeautifulSoup tag, without scripts, style sheets and templates
+TEXT_XPATH: str = ".//text()[not(ancestor::script or ancestor::style or ancestor::template)]"
+
+
+@functools.cache
+def _lxml_xpaths():
+    try:
+        from lxml import etree
+    except ImportError as error:
+        raise ImportError("The lxml extractor needs lxml, `pip install lxml`") from error
+    parse = functools.partial(etree.fromstring, parser=etree.HTMLParser(encoding="utf-8"))
+    return parse, etree.XPath(ARTICLE_XPATH), etree.XPath(TEXT_XPATH)
+
+
+def lxml_article_text(markup: str) -> str:
+    """Same as `bs4_article_text`, with the libxml2 HTML parser of lxml.
+
+    The texts only differ on broken markup the two parsers repair differently, e.g. html.parser
+    nests the paragraphs of unclosed <p> tags where libxml2 closes them.
+    """
+    parse, article_xpath, text_xpath = _lxml_xpaths()
+    # parsing bytes, as lxml rejects strings with an encoding declaration
+    root = parse(markup.encode())
+    if root is None:
+        return ""
+    return _join_paragraphs(["".join(text_xpath(element)) for element in article_xpath(root)])
+
+
+EXTRACTORS: dict[str, Callable[[str], str]] = {
+    "bs4": bs4_article_text,
+    "lxml": lxml_article_text,
+}
+
+
+def article_text(markup: str, extractor: str = "bs4") -> str:
+    """Text of the header and body of an ICIJ article, one paragraph per line."""
+    if extractor not in EXTRACTORS:
+        raise ValueError(f"Unknown extractor {extractor}, expected one of {tuple(EXTRACTORS)}")
+    return EXTRACTORS[extractor](markup)
+
+
+@dataclass
+class PipeConfig:
+    """How the article texts are processed with spaCy, and the dataset written."""
+
+    batch_size: int = 64
+    n_process: int = 1
+    # components of the pipeline run on the texts. The consumers of the dataset run their full
+    # pipeline on its Docs again, so by default only the tokenizer is.
+    components: list[str] = field(default_factory=list)
+    max_shard_bytes: int = MAX_SHARD_BYTES
+
+
+def load_scrape_nlp(config: PipeConfig | None = None) -> spacy.Language:
+    """The spaCy pipeline of the scraper, with only the components of the dataset enabled."""
+    config = config or PipeConfig()
+    scrape_nlp: spacy.Language = spacy.load(SPACY_MODEL)
+    scrape_nlp.select_pipes(enable=config.components)
+    return scrape_nlp
+
+
+def scrape(
+    urls: list[str],
+    scrape_nlp: spacy.Language,
+    fetch_config: FetchConfig | None = None,
+    cache: ScrapeCache | None = None,
+    pipe_config: PipeConfig | None = None,
+    extractor: str = "bs4",
+) -> tuple[Iterator[Doc], ScrapeStats]:
+    """Fetch the articles, and process them with spaCy as the Docs are consumed.
+
+    The pages are fetched as the Docs are consumed, and each distinct article text is processed
+    once, in batches with `nlp.pipe`. The Docs come in the order of the URLs, the stats are
+    complete once all of them were consumed.
+    """
+    pipe_config = pipe_config or PipeConfig()
+    stats = cache.stats if cache is not None else ScrapeStats()
+    stats.pages = len(urls)
+
+    def articles() -> Iterator[tuple[str, str, str | None, str]]:
+        """URL, text hash, text if it was extracted, and page of each distinct article."""
+        seen: set[str] = set()
+        for url, page in zip(urls, fetch_pages(urls, fetch_config, cache)):
+            if page is None:
+                stats.failed += 1
+                continue
+
+            text = None
+            text_hash = cache.text_hash(url, page, extractor) if cache is not None else None
+            if text_hash is None:
+                text = article_text(page, extractor)
+                text_hash = content_hash(text)
+                stats.parsed += 1
+                if cache is not None:
+                    cache.set_text_hash(url, page, extractor, text_hash)
+            else:
+                stats.unchanged += 1
+
+            if text_hash in seen:
+                stats.duplicates += 1
+                continue
+            seen.add(text_hash)
+            yield url, text_hash, text, page
+
+    def refetch(url: str, text_hash: str) -> Doc | None:
+        """Process the article again, when its cached Doc is gone or cannot be read."""
+        logger.warning(f"Cached Doc of {url} cannot be loaded, fetching it again")
+        [page] = fetch_pages([url], fetch_config, cache)
+        if page is None:
+            stats.failed += 1
+            return None
+        scrape_doc = scrape_nlp(article_text(page, extractor))
+        stats.nlp_runs += 1
+        cache.store_doc(scrape_nlp, text_hash, scrape_doc)  # type: ignore[union-attr]
+        return scrape_doc
+
+    def docs() -> Iterator[Doc]:
+        # the articles in order, the Docs of the cached ones are loaded once their turn comes
+        queue: deque[tuple[str, str, bool]] = deque()
+
+        def texts() -> Iterator[str]:
+            for url, text_hash, text, page in articles():
+                cached = cache is not None and cache.has_doc(scrape_nlp, text_hash)
+                queue.append((url, text_hash, cached))
+                if not cached:
+                    yield text if text is not None else article_text(page, extractor)
+
+        def cached_docs() -> Iterator[Doc]:
+            while queue and queue[0][2]:
+                url, text_hash, _ = queue.popleft()
+                cached_doc = cache.load_doc(scrape_nlp, text_hash)  # type: ignore[union-attr]
+                if cached_doc is None:
+                    cached_doc = refetch(url, text_hash)
+                if cached_doc is not None:
+                    yield cached_doc
+
+        processed = scrape_nlp.pipe(
+            texts(), batch_size=pipe_config.batch_size, n_process=pipe_config.n_process
         )
-        doc_bin.add(scrape_doc)
+        for scrape_doc in processed:
+            # the texts were queued up to this one at least
+            yield from cached_docs()
+            _, text_hash, _ = queue.popleft()
+            stats.nlp_runs += 1
+            if cache is not None:
+                cache.store_doc(scrape_nlp, text_hash, scrape_doc)
+            yield scrape_doc
+        yield from cached_docs()
+
+    return docs(), stats
+
+
+def run_scraper(
+    spacy_dataset_path: str = "./data/dataset",
+    urls_path: str | None = None,
+    fetch_config: FetchConfig | None = None,
+    cache_dir: str | None = SCRAPE_CACHE_DIR,
+    pipe_config: PipeConfig | None = None,
+    extractor: str = "bs4",
+) -> tuple[DocShards, ScrapeStats]:
+    """Scrape the articles into a sharded spaCy dataset, reusing the cache of previous runs.
+
+    The Docs are written to the shards as their batches are processed.
+    """
+    pipe_config = pipe_config or PipeConfig()
+    scrape_nlp = load_scrape_nlp(pipe_config)
+    urls = read_urls(urls_path) if urls_path else URLS
+    cache = ScrapeCache(cache_dir) if cache_dir is not None else None
+
+    with stage("scrape") as timing:
+        docs, stats = scrape(urls, scrape_nlp, fetch_config, cache, pipe_config, extractor)
+        with DocShardWriter(spacy_dataset_path, pipe_config.max_shard_bytes) as writer:
+            for scrape_doc in docs:
+                writer.add(scrape_doc)
+            dataset = writer.close()
+        timing.items = len(dataset)
+    logger.info(f"Scraped {len(dataset)} articles into {len(dataset.shards)} shards: {stats}")
+    return dataset, stats
+
+
+def main(
+    spacy_dataset_path: str = "./data/dataset",
+    urls_path: str | None = None,
+    fetch_config: FetchConfig | None = None,
+    cache_dir: str | None = SCRAPE_CACHE_DIR,
+    pipe_config: PipeConfig | None = None,
+    extractor: str = "bs4",
+) -> DocShards:
+    """Entrypoint for the scraper."""
+    return run_scraper(
+        spacy_dataset_path, urls_path, fetch_config, cache_dir, pipe_config, extractor
+    )[0]
+
+
+def cli(argv: list[str] | None = None) -> DocShards:
+    """Command line entrypoint for the scraper."""
+    defaults = FetchConfig()
+    parser = argparse.ArgumentParser(description="Scrape ICIJ articles into a spaCy dataset.")
+    parser.add_argument("--output", default="./data/dataset", help="directory of the DocBin shards")
+    parser.add_argument("--urls-file", help="file with one URL per line (default: URLS)")
+    parser.add_argument("--workers", type=int, default=defaults.workers)
+    parser.add_argument("--max-per-host", type=int, default=defaults.max_per_host)
+    parser.add_argument(
+        "--max-rate-per-host",
+        type=float,
+        default=defaults.max_rate_per_host,
+        help="requests started per second per host (default: %(default)s)",
+    )
+    parser.add_argument("--retries", type=int, default=defaults.retries)
+    parser.add_argument(
+        "--cache-dir",
+        default=SCRAPE_CACHE_DIR,
+        help="cache of the responses and spaCy Docs (default: %(default)s)",
+    )
+    parser.add_argument("--no-cache", action="store_true", help="fetch and process every page")
+    parser.add_argument(
+        "--extractor",
+        choices=list(EXTRACTORS),
+        default="bs4",
+        help="how the article text is extracted from a page, lxml is faster (default: %(default)s)",
+    )
+    parser.add_argument("--batch-size", type=int, default=PipeConfig.batch_size)
+    parser.add_argument("--n-process", type=int, default=PipeConfig.n_process)
+    parser.add_argument(
+        "--component",
+        action="append",
+        default=[],
+        dest="components",
+        help="pipeline component to run on the texts, repeatable (default: tokenizer only)",
+    )
+    parser.add_argument(
+        "--max-shard-mb",
+        type=float,
+        default=MAX_SHARD_BYTES / 2**20,
+        help="size of a DocBin shard before compression (default: %(default)s)",
+    )
+    args = parser.parse_args(argv)
 
-    doc_bin.to_disk(spacy_dataset_path)
-    return doc_bin
+    fetch_config = FetchConfig(
+        workers=args.workers,
+        max_per_host=args.max_per_host,
+        max_rate_per_host=args.max_rate_per_host,
+        retries=args.retries,
+    )
+    pipe_config = PipeConfig(
+        batch_size=args.batch_size,
+        n_process=args.n_process,
+        components=args.components,
+        max_shard_bytes=int(args.max_shard_mb * 2**20),
+    )
+    return main(
+        args.output,
+        args.urls_file,
+        fetch_config,
+        None if args.no_cache else args.cache_dir,
+        pipe_config,
+        args.extractor,
+    )
@@ -0,0 +1,358 @@
+"""Columnar cache of the parsed Senzing results.
+
+Parsing the Senzing report dominates the wall-clock time of the pipeline, yet the report only
+changes when Senzing publishes a new export. The parsed `SenzingReport` is therefore stored as
+Arrow IPC files, keyed by a fingerprint of the source file, and memory-mapped on later runs.
+"""
+
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import time
+from array import array
+from dataclasses import dataclass
+
+import numpy as np
+import pyarrow as pa
+from loguru import logger
+
+from src.instrumentation import collect_stages, stage
+from src.senzing_pipeline import (
+    AliasRecords,
+    Entity,
+    EntityFeature,
+    RecordList,
+    SenzingGraph,
+    SenzingReport,
+    Vocabulary,
+    entity_features_table,
+    read_senzing_report,
+)
+
+CACHE_DIR: str = "data/senzing-cache"
+CACHE_VERSION: str = "2"
+MANIFEST: str = "manifest.json"
+# the tables of an entry of the cache that make up the graph
+GRAPH_TABLES: tuple[str, ...] = ("graph", "adjacency", "edges", "records")
+
+GRAPH_SCHEMA = pa.schema(
+    [
+        pa.field("entity_uid", pa.int64(), nullable=False),
+        pa.field("name", pa.string()),
+        pa.field("num_recs", pa.int64()),
+        pa.field("has_ref", pa.bool_()),
+    ]
+)
+# the CSR adjacency arrays of the graph, and the offsets of the records of each node, see
+# SenzingGraph
+ADJACENCY_SCHEMA = pa.schema(
+    [
+        pa.field("entity_uid", pa.int64(), nullable=False),
+        pa.field("offset", pa.int64(), nullable=False),
+        pa.field("record_offset", pa.int64(), nullable=False),
+    ]
+)
+RECORDS_SCHEMA = pa.schema(
+    [
+        pa.field("record_id", pa.string()),
+        pa.field("data_source", pa.dictionary(pa.int32(), pa.string())),
+        pa.field("match_key", pa.dictionary(pa.int32(), pa.string())),
+    ]
+)
+EDGES_SCHEMA = pa.schema(
+    [
+        pa.field("neighbour", pa.int64(), nullable=False),
+        pa.field("match_level", pa.uint8(), nullable=False),
+    ]
+)
+
+
+@dataclass
+class CacheStats:
+    """How the Senzing results were obtained, reported as asset metadata."""
+
+    fingerprint: str
+    cache_hit: bool
+    load_seconds: float
+    peak_rss_mb: float
+    # measured when the cache entry was built from the JSON report
+    parse_seconds: float
+    parse_peak_rss_mb: float
+
+
+def hash_file(path: str | pathlib.Path, chunk_size: int = 2**20) -> str:
+    """Content hash of a file, read in chunks."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as fp:
+        while chunk := fp.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fingerprint_report(
+    icij_path: str | pathlib.Path, cache_dir: str | pathlib.Path = CACHE_DIR
+) -> str:
+    """Fingerprint of the Senzing results, from their size, mtime and content hash.
+
+    Hashing a multi-GB report takes a while, so the content hash of a cache entry is reused
+    when the size and mtime of the report still match the ones recorded in its manifest.
+    """
+    stat = os.stat(icij_path)
+    for manifest in _read_manifests(cache_dir):
+        if (
+            manifest["source"] == str(pathlib.Path(icij_path).resolve())
+            and manifest["size"] == stat.st_size
+            and manifest["mtime_ns"] == stat.st_mtime_ns
+        ):
+            return manifest["fingerprint"]
+    return f"{stat.st_size}-{hash_file(icij_path)}"
+
+
+def _read_manifests(cache_dir: str | pathlib.Path) -> list[dict]:
+    manifests = []
+    for manifest_path in pathlib.Path(cache_dir).glob(f"*/{MANIFEST}"):
+        with open(manifest_path) as fp:
+            manifests.append(json.load(fp))
+    return manifests
+
+
+def write_table(table: pa.Table, path: pathlib.Path) -> None:
+    with pa.OSFile(str(path), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+def read_table(path: pathlib.Path) -> pa.Table:
+    # the IPC file format can be memory-mapped, the table then references the pages directly
+    with pa.memory_map(str(path), "r") as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def graph_to_tables(graph: SenzingGraph) -> dict[str, pa.Table]:
+    """Convert the graph of the Senzing results to Arrow tables."""
+    entities_graph = graph.entities.values()
+    nodes = pa.table(
+        {
+            "entity_uid": [entity.entity_uid for entity in entities_graph],
+            "name": [entity.name for entity in entities_graph],
+            "num_recs": [entity.num_recs for entity in entities_graph],
+            "has_ref": [entity.has_ref for entity in entities_graph],
+        },
+        schema=GRAPH_SCHEMA,
+    )
+    adjacency = pa.table(
+        {
+            "entity_uid": graph.entity_uids,
+            "offset": graph.offsets[:-1],
+            "record_offset": graph.record_offsets[:-1],
+        },
+        schema=ADJACENCY_SCHEMA,
+    )
+    edges = pa.table(
+        {"neighbour": graph.neighbours, "match_level": graph.match_levels},
+        schema=EDGES_SCHEMA,
+    )
+    records = graph.records
+    records_table = pa.table(
+        {
+            "record_id": pa.array(records.record_ids, type=pa.string()),
+            "data_source": pa.DictionaryArray.from_arrays(
+                np.array(records.data_sources, dtype=np.int32),
+                pa.array(records.data_source_vocabulary.values, type=pa.string()),
+            ),
+            "match_key": pa.DictionaryArray.from_arrays(
+                np.array(records.match_keys, dtype=np.int32),
+                pa.array(records.match_key_vocabulary.values, type=pa.string()),
+            ),
+        },
+        schema=RECORDS_SCHEMA,
+    )
+    return {"graph": nodes, "adjacency": adjacency, "edges": edges, "records": records_table}
+
+
+def _dictionary_column(column: pa.ChunkedArray) -> tuple[np.ndarray, Vocabulary]:
+    """The codes and the vocabulary of a dictionary-encoded column."""
+    column = column.unify_dictionaries()
+    if not column.num_chunks:
+        return np.empty(0, dtype=np.uint32), Vocabulary()
+    values = column.chunk(0).dictionary.to_pylist()
+    codes = np.concatenate([chunk.indices.to_numpy() for chunk in column.chunks])
+    return codes.astype(np.uint32), Vocabulary(
+        values, {value: code for code, value in enumerate(values)}
+    )
+
+
+def tables_to_graph(tables: dict[str, pa.Table]) -> SenzingGraph:
+    """Convert Arrow tables back to the graph of the Senzing results."""
+    graph = tables["graph"]
+    entities_graph: dict[int, Entity] = {}
+    for entity_uid, name, num_recs, has_ref in zip(
+        *(graph.column(column).to_pylist() for column in GRAPH_SCHEMA.names)
+    ):
+        entities_graph[entity_uid] = Entity(
+            entity_uid=entity_uid, name=name, num_recs=num_recs, has_ref=has_ref
+        )
+
+    # the adjacency arrays are views on the memory-mapped tables
+    adjacency, edges, records = tables["adjacency"], tables["edges"], tables["records"]
+    entity_uids = adjacency.column("entity_uid").to_numpy()
+    record_offsets = np.append(adjacency.column("record_offset").to_numpy(), records.num_rows)
+    data_sources, data_source_vocabulary = _dictionary_column(records.column("data_source"))
+    match_keys, match_key_vocabulary = _dictionary_column(records.column("match_key"))
+    return SenzingGraph(
+        entities=entities_graph,
+        entity_uids=entity_uids,
+        offsets=np.append(adjacency.column("offset").to_numpy(), edges.num_rows),
+        neighbours=edges.column("neighbour").to_numpy(),
+        match_levels=edges.column("match_level").to_numpy(),
+        records=RecordList(
+            entity_uids=array("q", np.repeat(entity_uids, np.diff(record_offsets)).tobytes()),
+            record_ids=records.column("record_id").to_pylist(),
+            data_sources=array("I", data_sources.tobytes()),
+            match_keys=array("I", match_keys.tobytes()),
+            data_source_vocabulary=data_source_vocabulary,
+            match_key_vocabulary=match_key_vocabulary,
+        ),
+        record_offsets=record_offsets,
+    )
+
+
+def report_to_tables(report: SenzingReport) -> dict[str, pa.Table]:
+    """Convert the parsed Senzing results to Arrow tables."""
+    return {
+        "entities": entity_features_table(report.entities),
+        "aliases": report.aliases.to_table(),
+        **graph_to_tables(report.graph),
+    }
+
+
+def entities_from_table(entities: pa.Table) -> dict[str, dict[EntityFeature, str]]:
+    """Convert a table of entity features back to the raw entities of the Senzing results."""
+    features = {feature: entities.column(feature.value).to_pylist() for feature in EntityFeature}
+    return {
+        ent_id: {
+            feature: values[idx] for feature, values in features.items() if values[idx] is not None
+        }
+        for idx, ent_id in enumerate(entities.column("entity_id").to_pylist())
+    }
+
+
+def tables_to_report(tables: dict[str, pa.Table]) -> SenzingReport:
+    """Convert Arrow tables back to the parsed Senzing results."""
+    return SenzingReport(
+        entities=entities_from_table(tables["entities"]),
+        aliases=AliasRecords.from_table(tables["aliases"]),
+        graph=tables_to_graph(tables),
+    )
+
+
+def _read_entry(entry: pathlib.Path, manifest: dict) -> dict[str, pa.Table]:
+    return {name: read_table(entry / f"{name}.arrow") for name in manifest["tables"]}
+
+
+def cached_senzing_tables(
+    icij_path: str | pathlib.Path, cache_dir: str | pathlib.Path = CACHE_DIR, workers: int = 1
+) -> tuple[dict[str, pa.Table], CacheStats]:
+    """The Senzing results as the memory-mapped tables of their cache entry.
+
+    The report is parsed, and its entry written, only when the cache has no entry for it: a
+    cache hit builds no Python objects, the consumers of the tables convert what they need.
+
+    A cache entry is rebuilt whenever the fingerprint of the report or the version of the cache
+    changes, and the stale entries of the same report are removed.
+    """
+    start = time.perf_counter()
+    cache_dir = pathlib.Path(cache_dir)
+    source = str(pathlib.Path(icij_path).resolve())
+    fingerprint = fingerprint_report(icij_path, cache_dir)
+    entry = cache_dir / fingerprint
+    manifest_path = entry / MANIFEST
+
+    manifest = None
+    if manifest_path.exists():
+        with open(manifest_path) as fp:
+            manifest = json.load(fp)
+
+    if manifest is not None and manifest.get("version") == CACHE_VERSION:
+        logger.info(f"Loading Senzing results from cache: {entry}")
+        with stage("load_senzing_cache") as timing:
+            tables = _read_entry(entry, manifest)
+            timing.items = tables["entities"].num_rows
+
+        stat = os.stat(icij_path)
+        if (manifest["size"], manifest["mtime_ns"]) != (stat.st_size, stat.st_mtime_ns):
+            # same content under a new mtime: remember it to skip hashing next time
+            manifest.update(source=source, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+            with open(manifest_path, "w") as fp:
+                json.dump(manifest, fp)
+
+        stats = CacheStats(
+            fingerprint=fingerprint,
+            cache_hit=True,
+            load_seconds=time.perf_counter() - start,
+            peak_rss_mb=timing.peak_rss_mb,
+            parse_seconds=manifest["parse_seconds"],
+            parse_peak_rss_mb=manifest["parse_peak_rss_mb"],
+        )
+        return tables, stats
+
+    # the stages reset the peak RSS of the process, so it is read from the timing of the parse
+    with collect_stages() as timings:
+        report = read_senzing_report(icij_path, workers=workers)
+    parse_seconds = time.perf_counter() - start
+    parse_peak_rss = timings[-1].peak_rss_mb
+
+    logger.info(f"Caching Senzing results to: {entry}")
+    for manifest in _read_manifests(cache_dir):
+        if manifest["source"] == source:
+            shutil.rmtree(cache_dir / manifest["fingerprint"], ignore_errors=True)
+
+    staging = cache_dir / f".{fingerprint}.tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+    tables = report_to_tables(report)
+    del report
+    for name, table in tables.items():
+        write_table(table, staging / f"{name}.arrow")
+
+    stat = os.stat(icij_path)
+    manifest = {
+        "version": CACHE_VERSION,
+        "fingerprint": fingerprint,
+        "source": source,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "tables": list(tables),
+        "parse_seconds": parse_seconds,
+        "parse_peak_rss_mb": parse_peak_rss,
+    }
+    with open(staging / MANIFEST, "w") as fp:
+        json.dump(manifest, fp)
+    # an entry of another version of the cache is replaced
+    shutil.rmtree(entry, ignore_errors=True)
+    staging.rename(entry)
+
+    stats = CacheStats(
+        fingerprint=fingerprint,
+        cache_hit=False,
+        load_seconds=parse_seconds,
+        peak_rss_mb=parse_peak_rss,
+        parse_seconds=parse_seconds,
+        parse_peak_rss_mb=parse_peak_rss,
+    )
+    # the tables of the new entry, rather than the ones built in memory
+    return _read_entry(entry, manifest), stats
+
+
+def cached_senzing_report(
+    icij_path: str | pathlib.Path, cache_dir: str | pathlib.Path = CACHE_DIR, workers: int = 1
+) -> tuple[SenzingReport, CacheStats]:
+    """Parse the Senzing results, or reload them from the cache when the report is unchanged.
+
+    Prefer `cached_senzing_tables` when the tables are enough, this builds every Python object
+    of the report.
+    """
+    tables, stats = cached_senzing_tables(icij_path, cache_dir, workers)
+    return tables_to_report(tables), stats
@@ -0,0 +1,330 @@
+"""Incremental updates of the Senzing outputs.
+
+Senzing re-exports the ICIJ report periodically, and most entities do not change between exports.
+A content hash of each entity is kept next to an output from one run to the next, so that only
+the rows of the added, changed and removed entities are generated again. The other rows are copied
+from the previous output, which is then replaced in a single rename.
+"""
+
+import hashlib
+import heapq
+import json
+import os
+import pathlib
+from collections import defaultdict
+from dataclasses import dataclass
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from loguru import logger
+
+from src.instrumentation import instrumented
+from src.senzing_pipeline import (
+    AliasRawData,
+    AliasRecords,
+    EntityFeature,
+    entity_lines,
+    generate_aliases,
+    generate_entities_batch,
+    write_aliases,
+    write_entities_batch,
+)
+
+# bump whenever the generated rows change for the same input, to rebuild the outputs
+STATE_VERSION: str = "1"
+
+ENTITIES_STATE_SCHEMA = pa.schema(
+    [
+        pa.field("entity_id", pa.string(), nullable=False),
+        pa.field("fingerprint", pa.binary(16), nullable=False),
+        # whether the entity has a row in the output
+        pa.field("has_row", pa.bool_(), nullable=False),
+    ]
+)
+ALIASES_STATE_SCHEMA = pa.schema(
+    [
+        pa.field("entity_id", pa.string(), nullable=False),
+        pa.field("fingerprint", pa.binary(16), nullable=False),
+        # the aliases of the entity, i.e. the rows of the output it appears in
+        pa.field("aliases", pa.list_(pa.string()), nullable=False),
+    ]
+)
+
+
+@dataclass
+class OutputDelta:
+    """What an incremental run changed in an output, reported as asset metadata."""
+
+    full_rebuild: bool
+    added: int
+    changed: int
+    removed: int
+    unchanged: int
+    # rows copied from the previous output, generated again, and of the previous output dropped
+    rows_kept: int
+    rows_regenerated: int
+    rows_dropped: int
+
+
+def state_path(filepath: str | pathlib.Path) -> pathlib.Path:
+    """Where the content hashes of the entities behind an output are kept."""
+    return pathlib.Path(f"{filepath}.state.arrow")
+
+
+def fingerprints(values: pa.Array) -> pa.Array:
+    """Content hash of each string of an Arrow array."""
+    values = pc.cast(values, pa.binary())
+    offsets = np.frombuffer(values.buffers()[1], dtype=np.int32)
+    offsets = offsets[values.offset : values.offset + len(values) + 1].tolist()
+    data = memoryview(values.buffers()[2] or b"")
+    return pa.array(
+        [
+            hashlib.blake2b(data[start:end], digest_size=16).digest()
+            for start, end in zip(offsets, offsets[1:])
+        ],
+        type=pa.binary(16),
+    )
+
+
+def countries_fingerprint(countries: dict) -> str:
+    """Content hash of the country names, which end up in the entity descriptions."""
+    payload = json.dumps(sorted(countries.items())).encode()
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+def _read_state(filepath: str | pathlib.Path, **expected: str) -> pa.Table | None:
+    """The state of the previous run, unless the output was modified since or `expected` differs."""
+    path = state_path(filepath)
+    if not path.exists() or not os.path.exists(filepath):
+        return None
+    with pa.memory_map(str(path), "r") as source:
+        state = pa.ipc.open_file(source).read_all()
+
+    stat = os.stat(filepath)
+    expected.update(version=STATE_VERSION, size=str(stat.st_size), mtime_ns=str(stat.st_mtime_ns))
+    metadata = {key.decode(): value.decode() for key, value in state.schema.metadata.items()}
+    if any(metadata.get(key) != value for key, value in expected.items()):
+        logger.info(f"Previous state of {filepath} is stale, rebuilding it")
+        return None
+    return state
+
+
+def _write_state(filepath: str | pathlib.Path, state: pa.Table, **metadata: str) -> None:
+    stat = os.stat(filepath)
+    metadata.update(version=STATE_VERSION, size=str(stat.st_size), mtime_ns=str(stat.st_mtime_ns))
+    state = state.replace_schema_metadata(metadata)
+    staging = state_path(filepath).with_suffix(".tmp")
+    with pa.OSFile(str(staging), "wb") as sink:
+        with pa.ipc.new_file(sink, state.schema) as writer:
+            writer.write_table(state)
+    staging.replace(state_path(filepath))
+
+
+def _read_rows(filepath: str | pathlib.Path, keys: list) -> dict:
+    """Map the keys of the rows of the previous output to its lines, in order."""
+    with open(filepath, "rb") as fp:
+        lines = fp.readlines()[: len(keys)]
+    if len(lines) != len(keys):
+        raise ValueError(f"{filepath} has {len(lines)} rows, its state expects {len(keys)}")
+    return dict(zip(keys, lines))
+
+
+def _write_rows(filepath: str | pathlib.Path, lines) -> None:
+    staging = pathlib.Path(f"{filepath}.tmp")
+    with open(staging, "wb") as outfile:
+        outfile.writelines(lines)
+    staging.replace(filepath)
+
+
+def diff_fingerprints(
+    previous: pa.Table, entity_ids: pa.Array, current: pa.Array, key: str = "entity_id"
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Find the added and changed entities among the current ones, and the removed previous ones.
+
+    The previous fingerprints are in the "fingerprint" column of `previous`, next to the `key`
+    column. Returns boolean masks over the current entities for the first two, and over the
+    previous entities for the last one.
+    """
+    positions = pc.index_in(entity_ids, value_set=previous.column(key))
+    known = pc.is_valid(positions).to_numpy(zero_copy_only=False)
+    same = pc.equal(previous.column("fingerprint").take(positions), current)
+    same = same.fill_null(False).to_numpy(zero_copy_only=False)
+    removed = pc.invert(pc.is_in(previous.column(key), value_set=entity_ids))
+    return ~known, known & ~same, removed.to_numpy(zero_copy_only=False)
+
+
+@instrumented(items=lambda delta: delta.rows_regenerated)
+def update_entities(
+    features: pa.Table,
+    countries: dict,
+    filepath: str | pathlib.Path = "data/senzing/entities.jsonl",
+) -> OutputDelta:
+    """Bring the entities written by a previous run up to date with the Senzing results.
+
+    Only the rows of the added and changed entities are generated again, the output is the same
+    as the one of `write_entities_batch` after `generate_entities_batch`. The output is rebuilt
+    from scratch when the country names changed. The entity features are a table of
+    `entity_features_table`.
+    """
+    entity_ids = features.column("entity_id").combine_chunks()
+    columns = [
+        pc.fill_null(features.column(feature.value), "\x00").combine_chunks()
+        for feature in EntityFeature
+    ]
+    current = fingerprints(pc.binary_join_element_wise(*columns, "\x1f"))
+    countries_hash = countries_fingerprint(countries)
+
+    previous = _read_state(filepath, countries=countries_hash)
+    if previous is None:
+        entities = generate_entities_batch(features, countries)
+        write_entities_batch(entities, filepath)
+        has_row = pc.is_in(entity_ids, value_set=entities.column("entity_id"))
+        delta = OutputDelta(
+            full_rebuild=True,
+            added=len(entity_ids),
+            changed=0,
+            removed=0,
+            unchanged=0,
+            rows_kept=0,
+            rows_regenerated=entities.num_rows,
+            rows_dropped=0,
+        )
+    else:
+        added, changed, removed = diff_fingerprints(previous, entity_ids, current)
+        stale = added | changed
+        logger.info(
+            f"Updating entities in {filepath}: {added.sum()} added, {changed.sum()} changed, "
+            f"{removed.sum()} removed"
+        )
+
+        entities = generate_entities_batch(features.filter(stale), countries)
+        new_rows = dict(
+            zip(
+                entities.column("entity_id").to_pylist(),
+                [
+                    line.encode()
+                    for batch in entities.to_batches()
+                    for line in entity_lines(batch).to_pylist()
+                ],
+            )
+        )
+        old_rows = _read_rows(
+            filepath, previous.column("entity_id").filter(previous.column("has_row")).to_pylist()
+        )
+
+        rows = [
+            new_rows.get(ent_id) if is_stale else old_rows.get(ent_id)
+            for ent_id, is_stale in zip(entity_ids.to_pylist(), stale.tolist())
+        ]
+        _write_rows(filepath, (row for row in rows if row is not None))
+        has_row = pa.array([row is not None for row in rows])
+        rows_kept = sum(row is not None for row in rows) - len(new_rows)
+        delta = OutputDelta(
+            full_rebuild=False,
+            added=int(added.sum()),
+            changed=int(changed.sum()),
+            removed=int(removed.sum()),
+            unchanged=int((~stale).sum()),
+            rows_kept=rows_kept,
+            rows_regenerated=len(new_rows),
+            rows_dropped=len(old_rows) - rows_kept,
+        )
+
+    state = pa.table(
+        {"entity_id": entity_ids, "fingerprint": current, "has_row": has_row},
+        schema=ENTITIES_STATE_SCHEMA,
+    )
+    _write_state(filepath, state, countries=countries_hash)
+    return delta
+
+
+@instrumented(items=lambda delta: delta.rows_regenerated)
+def update_aliases(
+    raw_aliases: AliasRecords, filepath: str | pathlib.Path = "data/senzing/aliases.jsonl"
+) -> OutputDelta:
+    """Bring the aliases written by a previous run up to date with the Senzing results.
+
+    An alias row is generated again when one of the entities it lists, or used to list, has
+    changed alias records. The other rows are copied from the previous output, so the order of
+    their entities is the order of first appearance in the run that generated them.
+    """
+    records: dict[str, list[AliasRawData]] = defaultdict(list)
+    for record in raw_aliases:
+        records[str(record["entity"])].append(record)
+    entity_ids = pa.array(list(records), type=pa.string())
+    entity_aliases = [
+        # `generate_aliases` drops the records without alias
+        list(dict.fromkeys(alias["alias"] for alias in recs if alias["alias"] is not None))
+        for recs in records.values()
+    ]
+    current = fingerprints(
+        pa.array(
+            [json.dumps([(rec["alias"], rec["type"]) for rec in recs]) for recs in records.values()]
+        )
+    )
+
+    previous = _read_state(filepath)
+    if previous is None:
+        aliases = generate_aliases(raw_aliases)
+        write_aliases(aliases, filepath)
+        delta = OutputDelta(
+            full_rebuild=True,
+            added=len(entity_ids),
+            changed=0,
+            removed=0,
+            unchanged=0,
+            rows_kept=0,
+            rows_regenerated=len(aliases),
+            rows_dropped=0,
+        )
+    else:
+        added, changed, removed = diff_fingerprints(previous, entity_ids, current)
+        stale = added | changed
+        logger.info(
+            f"Updating aliases in {filepath}: {added.sum()} added, {changed.sum()} changed, "
+            f"{removed.sum()} removed"
+        )
+
+        previous_stale = pc.invert(
+            pc.is_in(previous.column("entity_id"), value_set=entity_ids.filter(~added & ~changed))
+        )
+        affected = set(
+            pc.list_flatten(previous.column("aliases").filter(previous_stale)).to_pylist()
+        )
+        affected.update(
+            alias
+            for aliases, is_stale in zip(entity_aliases, stale)
+            if is_stale
+            for alias in aliases
+        )
+
+        aliases = generate_aliases(
+            raw_aliases.select([alias in affected for alias in raw_aliases.aliases])
+        )
+        lines = aliases.to_json(orient="records", lines=True) if len(aliases) else ""
+        new_rows = [line.encode() + b"\n" for line in lines.split("\n")[:-1]]
+        previous_aliases = pc.unique(pc.list_flatten(previous.column("aliases"))).to_pylist()
+        old_rows = _read_rows(filepath, sorted(previous_aliases))
+        kept = [(alias, row) for alias, row in old_rows.items() if alias not in affected]
+
+        rows = [row for _, row in heapq.merge(kept, zip(aliases["alias"], new_rows))]
+        # like `write_aliases`, an empty output is a single empty line
+        _write_rows(filepath, rows or [b"\n"])
+        delta = OutputDelta(
+            full_rebuild=False,
+            added=int(added.sum()),
+            changed=int(changed.sum()),
+            removed=int(removed.sum()),
+            unchanged=int((~stale).sum()),
+            rows_kept=len(kept),
+            rows_regenerated=len(new_rows),
+            rows_dropped=len(old_rows) - len(kept),
+        )
+
+    state = pa.table(
+        {"entity_id": entity_ids, "fingerprint": current, "aliases": entity_aliases},
+        schema=ALIASES_STATE_SCHEMA,
+    )
+    _write_state(filepath, state)
+    return delta
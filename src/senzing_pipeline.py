@@ -1,22 +1,40 @@
 """Extract Entity Linking artefacts from Senzing results.
 
-Requires this data asset as input:
+Requires this data asset as input, which can be read zipped:
 - https://storage.googleapis.com/erkg/icij/ICIJ-entity-report-2024-06-21_12-04-57-std.json.zip
 """
 
+import argparse
 import csv
+import functools
 import json
+import os
 import pathlib
 import re
-from collections import Counter
+import unicodedata
+from array import array
+from collections import defaultdict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
 from dataclasses import dataclass, field
 from enum import Enum
-from typing import TypedDict
+from itertools import compress, repeat
+from typing import Callable, Iterable, Iterator, Sequence, TypedDict
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 from loguru import logger
 from tqdm import tqdm
 
+from src.instrumentation import instrumented
+from src.report_files import (
+    is_compressed,
+    iter_report_blocks,
+    iter_report_lines,
+    report_size,
+)
+
 
 def load_countries(country_codes_path: str | pathlib.Path = "data/senzing/country.tsv") -> dict:
     """Map from a country code to a full name."""
@@ -51,33 +69,21 @@ class EntityFeature(Enum):
     WEBSITE = "WEBSITE"
 
 
+def parse_entity_features(entity: dict) -> dict[EntityFeature, str]:
+    """Map a Senzing RESOLVED_ENTITY to its available entity features."""
+    return {
+        EntityFeature(key): feature[0]["FEAT_DESC"] for key, feature in entity["FEATURES"].items()
+    }
+
+
 def load_entities(
     icij_path: str | pathlib.Path = "data/ICIJ-entity-report-2024-06-21_12-04-57-std.json",
 ) -> dict[str, dict[EntityFeature, str]]:
-    """Map from entity_id to the available entity features in the Senzing results."""
-    ents: dict[str, dict[EntityFeature, str]] = {}
-
-    logger.info(f"Parsing Senzing results: {icij_path}")
-    num_lines = sum(1 for _ in open(icij_path))
-
-    with tqdm(total=num_lines) as pbar:
-        with open(icij_path, "r", encoding="utf-8") as fp:
-            while line := fp.readline():
-                dat = json.loads(line.strip())
-                ent: dict = dat["RESOLVED_ENTITY"]
-
-                ent_id: str = str(ent["ENTITY_ID"])
-
-                features: dict[EntityFeature, str] = {
-                    EntityFeature(key): feature[0]["FEAT_DESC"]
-                    for key, feature in ent["FEATURES"].items()
-                }
+    """Map from entity_id to the available entity features in the Senzing results.
 
-                ents[ent_id] = features
-
-                pbar.update(1)
-
-    return ents
+    Prefer `read_senzing_report` when the aliases or the graph are needed as well.
+    """
+    return read_senzing_report(icij_path).entities
 
 
 PAT_LIST: list[str] = [
@@ -101,15 +107,54 @@ PAT_LIST: list[str] = [
 ]
 
 
+# the patterns are anchored at the start of the name, so a single match of their alternation
+# gives the same answer as searching for each of them in turn
+BEARER_PATTERN: re.Pattern = re.compile("|".join(f"(?:{pat})" for pat in PAT_LIST))
+
+
 def filter_bearer(name: str) -> bool:
     """These names are used to hide the identity of a company shareholder."""
-    name = str(name).lower()
+    return BEARER_PATTERN.match(str(name).lower()) is None
+
 
-    for pat in PAT_LIST:
-        if re.search(pat, name) is not None:
-            return False
+# a name can only match PAT_LIST if it contains "bearer" or "portador", or starts with "nan" or
+# "?", possibly after whitespace that `str.strip` removes. Apart from "İ" and the Kelvin sign, no
+# character lowercases to an ASCII letter, so a case-insensitive search on the name finds the same
+# candidates as a search on its lowercase.
+BEARER_PREFILTER: str = r"bearer|portador|^[\t-\r\x1c-\x1f\x85\pZ]*(?:nan|\?)"
 
-    return True
+
+def bearer_candidates(names: pa.Array | pa.ChunkedArray) -> np.ndarray:
+    """Positions of the names that `filter_bearer` may reject, after `str.strip` or not.
+
+    They are found with a vectorized search over the Arrow array of the names. Missing names are
+    candidates too, their string representation decides.
+    """
+    return np.flatnonzero(
+        pc.match_substring_regex(names, BEARER_PREFILTER, ignore_case=True)
+        .fill_null(True)
+        .to_numpy(zero_copy_only=False)
+    )
+
+
+def filter_bearer_batch(names: pd.Series, strip: bool = False) -> pd.Series:
+    """Apply `filter_bearer` to a whole column of names, e.g. a column of an Arrow table.
+
+    Only the `bearer_candidates` go through `filter_bearer`, after `str.strip` if `strip` is set.
+    The result is aligned on the index of the names.
+    """
+    try:
+        texts = pa.array(names, type=pa.string(), from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        texts = pa.array([str(name) for name in names], type=pa.string())
+
+    candidates = bearer_candidates(texts)
+    accepted = np.ones(len(names), dtype=bool)
+    accepted[candidates] = [
+        filter_bearer(str(name).strip() if strip else name)
+        for name in names.iloc[candidates].to_numpy(dtype=object)
+    ]
+    return pd.Series(accepted, index=names.index)
 
 
 class EntityData(TypedDict):
@@ -135,17 +180,13 @@ def get_entity_type(entity_features: dict[EntityFeature, str]) -> str:
     return "MISC"
 
 
+@instrumented(items=len)
 def generate_entities(
     raw_entities: dict[str, dict[EntityFeature, str]], countries: dict
 ) -> dict[str, EntityData]:
     """Generate entity entities (or description) that can be used in Entity Linking."""
     entities: dict[str, EntityData] = {}
 
-    logger.remove()
-    logger.add(
-        lambda msg: tqdm.write(msg, end=""),
-        colorize=True,
-    )
     logger.info("Generating entities")
     for ent_id, ent_feat in tqdm(raw_entities.items()):
         if EntityFeature.NAME in ent_feat:
@@ -198,6 +239,7 @@ def generate_entities(
     return entities
 
 
+@instrumented(input_items=len)
 def write_entities(
     summaries: dict[str, EntityData], filepath: str | pathlib.Path = "data/senzing/entities.jsonl"
 ):
@@ -209,64 +251,359 @@ def write_entities(
             outfile.write("\n")
 
 
+ENTITY_DATA_FIELDS: list[str] = ["entity_id", "type", "name", "description"]
+
+# the entity features as columns of an Arrow table, one row per entity
+ENTITIES_SCHEMA = pa.schema(
+    [pa.field("entity_id", pa.string(), nullable=False)]
+    + [pa.field(feature.value, pa.string()) for feature in EntityFeature]
+)
+
+# the features `get_entity_type` looks at
+ENTITY_TYPE_FEATURES: list[EntityFeature] = [
+    EntityFeature.RECORD_TYPE,
+    EntityFeature.DOB,
+    EntityFeature.GROUP_ASSOCIATION,
+    EntityFeature.DUNS_NUMBER,
+    EntityFeature.WEBSITE,
+]
+
+# the clauses of the entity descriptions, in the order `generate_entities` appends them
+DESCRIPTION_CLAUSES: dict[str, list[tuple[EntityFeature, str]]] = {
+    "ORG": [
+        (EntityFeature.ADDRESS, ", located at "),
+        (EntityFeature.DUNS_NUMBER, ", DUNS "),
+        (EntityFeature.PHONE, ", phone "),
+        (EntityFeature.COUNTRY_OF_ASSOCIATION, ", in "),
+        (EntityFeature.WEBSITE, ", website "),
+    ],
+    "PER": [
+        (EntityFeature.DOB, ", born "),
+        (EntityFeature.PHONE, ", phone "),
+        (EntityFeature.ADDRESS, ", located at "),
+        (EntityFeature.GROUP_ASSOCIATION, ", associated with "),
+        (EntityFeature.COUNTRY_OF_ASSOCIATION, ", in "),
+    ],
+}
+
+# characters that `json.dumps` escapes in a string with the default ensure_ascii=True
+JSON_ESCAPED: str = r'[\\"]|[^ -~]'
+
+
+def entity_features_table(raw_entities: dict[str, dict[EntityFeature, str]]) -> pa.Table:
+    """Arrow table of the entity features, with one column per EntityFeature."""
+    return pa.table(
+        {
+            "entity_id": [str(ent_id) for ent_id in raw_entities.keys()],
+            **{
+                feature.value: [feats.get(feature) for feats in raw_entities.values()]
+                for feature in EntityFeature
+            },
+        },
+        schema=ENTITIES_SCHEMA,
+    )
+
+
+def filter_entity_features(features: pa.Table, entity_ids: set[str]) -> pa.Table:
+    """Rows of a table of entity features for the given entity ids, in the order of the table."""
+    return features.filter(
+        pc.is_in(features.column("entity_id"), value_set=pa.array(list(entity_ids), pa.string()))
+    )
+
+
+def get_entity_types(features: pa.Table) -> pa.Array:
+    """Apply `get_entity_type` to a table of entity features.
+
+    The type only depends on which of ENTITY_TYPE_FEATURES are available and on the record type,
+    so it is computed once per distinct combination of those.
+    """
+    record_types = pc.dictionary_encode(features.column(EntityFeature.RECORD_TYPE.value))
+    keys = pc.fill_null(record_types.combine_chunks().indices, -1).to_numpy().astype(np.int64) + 1
+    for feature in ENTITY_TYPE_FEATURES:
+        present = pc.is_valid(features.column(feature.value)).to_numpy(zero_copy_only=False)
+        keys = keys * 2 + present
+
+    combinations = pc.dictionary_encode(pa.array(keys)).indices.to_numpy()
+    firsts = np.empty(combinations.max(initial=-1) + 1, dtype=np.int64)
+    firsts[combinations[::-1]] = np.arange(len(combinations))[::-1]
+
+    columns = [feature.value for feature in ENTITY_TYPE_FEATURES]
+    types = [
+        get_entity_type(
+            {EntityFeature(key): desc for key, desc in feats.items() if desc is not None}
+        )
+        for feats in features.select(columns).take(firsts).to_pylist()
+    ]
+    return pa.array(types, type=pa.string()).take(combinations)
+
+
+def _description_clause(prefix: str, values: pa.Array) -> pa.Array:
+    """The clause of a description for each value, or an empty string for a missing value."""
+    present = pc.fill_null(pc.not_equal(values, ""), False)
+    return pc.if_else(present, pc.binary_join_element_wise(prefix, values, ""), "")
+
+
+@instrumented(items=lambda entities: entities.num_rows)
+def generate_entities_batch(features: pa.Table, countries: dict) -> pa.Table:
+    """Generate the entities of `generate_entities` from a table of entity features.
+
+    The descriptions are built with Arrow compute functions over whole columns, and the output is
+    the same as the one of `generate_entities`, as a table with the fields of EntityData.
+    """
+    logger.info("Generating entities")
+    names = features.column(EntityFeature.NAME.value)
+    keep = pc.fill_null(pc.not_equal(names, ""), False).to_numpy(zero_copy_only=False)
+    candidates = bearer_candidates(names)
+    keep[candidates] &= np.array(
+        [filter_bearer(str(name).strip()) for name in names.take(candidates).to_pylist()],
+        dtype=bool,
+    )
+
+    entity_types = get_entity_types(features)
+    is_described = pc.is_in(entity_types, pa.array(list(DESCRIPTION_CLAUSES)))
+    is_described = is_described.to_numpy(zero_copy_only=False)
+    new_types = pc.value_counts(
+        features.column(EntityFeature.RECORD_TYPE.value).filter(keep & ~is_described)
+    )
+    for new_type in new_types.to_pylist():
+        logger.warning(f"New entity type: {new_type['values']} ({new_type['counts']} entities)")
+    features = features.select(
+        ["entity_id", EntityFeature.NAME.value]
+        + sorted(
+            {feature.value for clauses in DESCRIPTION_CLAUSES.values() for feature, _ in clauses}
+        )
+    ).filter(keep & is_described)
+    entity_types = entity_types.filter(keep & is_described)
+
+    # there are only a few distinct country codes, they are looked up once each
+    codes = pc.dictionary_encode(
+        features.column(EntityFeature.COUNTRY_OF_ASSOCIATION.value).combine_chunks()
+    )
+    countries_of_association = pa.array(
+        [get_country(countries, code) if code else None for code in codes.dictionary.to_pylist()],
+        type=pa.string(),
+    ).take(codes.indices)
+
+    # the clauses shared by the entity types are built once
+    description_clauses: dict[tuple[EntityFeature, str], pa.Array] = {}
+    for feature, prefix in {
+        clause for clauses in DESCRIPTION_CLAUSES.values() for clause in clauses
+    }:
+        if feature == EntityFeature.COUNTRY_OF_ASSOCIATION:
+            values = countries_of_association
+        else:
+            values = features.column(feature.value).combine_chunks()
+        description_clauses[feature, prefix] = _description_clause(prefix, values)
+
+    descriptions = pa.nulls(features.num_rows, type=pa.string())
+    for entity_type, clauses in DESCRIPTION_CLAUSES.items():
+        texts = [features.column(EntityFeature.NAME.value).combine_chunks()]
+        texts += [description_clauses[clause] for clause in clauses]
+        descriptions = pc.if_else(
+            pc.equal(entity_types, entity_type),
+            pc.binary_join_element_wise(*texts, ""),
+            descriptions,
+        )
+
+    return pa.table(
+        {
+            "entity_id": features.column("entity_id"),
+            "type": entity_types,
+            "name": features.column(EntityFeature.NAME.value),
+            "description": descriptions,
+        }
+    )
+
+
+def json_strings(values: pa.Array) -> pa.Array:
+    """The JSON string literals of the values, as `json.dumps` writes them.
+
+    Only the values with characters to escape go through the JSON encoder, the others are
+    quoted with a vectorized string join.
+    """
+    escaped = pc.match_substring_regex(values, JSON_ESCAPED)
+    literals = pc.binary_join_element_wise('"', values, '"', "")
+    to_escape = np.flatnonzero(escaped.to_numpy(zero_copy_only=False))
+    if len(to_escape) == 0:
+        return literals
+    encode = json.encoder.encode_basestring_ascii  # type: ignore[attr-defined]
+    return pc.replace_with_mask(
+        literals,
+        escaped,
+        pa.array([encode(value) for value in values.take(to_escape).to_pylist()], pa.string()),
+    )
+
+
+def entity_lines(entities: pa.RecordBatch) -> pa.Array:
+    """The JSON line `json.dump` writes for each EntityData in `write_entities`.
+
+    The lines end with their newline.
+    """
+    entity_id, entity_type, name, description = (
+        json_strings(entities.column(column)) for column in ENTITY_DATA_FIELDS
+    )
+    return pc.binary_join_element_wise(
+        '{"entity_id": ',
+        entity_id,
+        ', "type": ',
+        entity_type,
+        ', "name": ',
+        name,
+        ', "description": ',
+        description,
+        "}\n",
+        "",
+    )
+
+
+@instrumented(input_items=lambda entities: entities.num_rows)
+def write_entities_batch(
+    entities: pa.Table,
+    filepath: str | pathlib.Path = "data/senzing/entities.jsonl",
+    chunk_size: int = 100_000,
+):
+    """Write the generated entities to a file, in large buffered chunks of JSON lines.
+
+    The `entity_lines` of each chunk are assembled in an Arrow string array, whose data buffer is
+    written as is.
+    """
+    logger.info(f"Writing entities to: {filepath}")
+    with open(filepath, "wb") as outfile:
+        for batch in entities.to_batches(max_chunksize=chunk_size):
+            lines = entity_lines(batch)
+            offsets = np.frombuffer(lines.buffers()[1], dtype=np.int32)
+            offsets = offsets[lines.offset : lines.offset + len(lines) + 1]
+            outfile.write(memoryview(lines.buffers()[2])[offsets[0] : offsets[-1]])
+
+
 class AliasRawData(TypedDict):
     alias: str
     entity: int
     type: str
 
 
+# entity types of the alias records, stored per record as its index in this tuple
+ENTITY_TYPES: tuple[str, ...] = ("PER", "ORG", "MISC")
+
+ALIASES_SCHEMA = pa.schema(
+    [
+        pa.field("alias", pa.string()),
+        pa.field("entity", pa.int64()),
+        pa.field("type", pa.dictionary(pa.int8(), pa.string())),
+    ]
+)
+
+
+@dataclass
+class AliasRecords:
+    """Alias records of the Senzing results, as typed columns.
+
+    Iterating over the records yields them as `AliasRawData` dicts.
+    """
+
+    aliases: list[str | None] = field(default_factory=lambda: [])
+    entities: array = field(default_factory=lambda: array("q"))
+    types: array = field(default_factory=lambda: array("B"))
+
+    def append(self, alias: str | None, entity: int, entity_type: str) -> None:
+        self.aliases.append(alias)
+        self.entities.append(entity)
+        self.types.append(ENTITY_TYPES.index(entity_type))
+
+    def extend(self, records: "AliasRecords") -> None:
+        self.aliases.extend(records.aliases)
+        self.entities.extend(records.entities)
+        self.types.extend(records.types)
+
+    def __len__(self) -> int:
+        return len(self.aliases)
+
+    def __iter__(self) -> Iterator[AliasRawData]:
+        for alias, entity, type_code in zip(self.aliases, self.entities, self.types):
+            yield {"alias": alias, "entity": entity, "type": ENTITY_TYPES[type_code]}
+
+    def select(self, mask: Sequence[bool] | np.ndarray) -> "AliasRecords":
+        """The records where `mask` is true, in the same order."""
+        mask = np.asarray(mask, dtype=bool)
+        return AliasRecords(
+            aliases=list(compress(self.aliases, mask)),
+            entities=array("q", np.array(self.entities, dtype=np.int64)[mask].tobytes()),
+            types=array("B", np.array(self.types, dtype=np.uint8)[mask].tobytes()),
+        )
+
+    def filter_entities(self, entity_ids: set[str]) -> "AliasRecords":
+        """The records of the given entities, in the same order."""
+        ids = np.fromiter((int(entity_id) for entity_id in entity_ids), dtype=np.int64)
+        return self.select(np.isin(np.array(self.entities, dtype=np.int64), ids))
+
+    def to_table(self) -> pa.Table:
+        return pa.table(
+            {
+                "alias": pa.array(self.aliases, type=pa.string()),
+                "entity": np.array(self.entities, dtype=np.int64),
+                "type": pa.DictionaryArray.from_arrays(
+                    np.array(self.types, dtype=np.int8), pa.array(ENTITY_TYPES)
+                ),
+            },
+            schema=ALIASES_SCHEMA,
+        )
+
+    @classmethod
+    def from_table(cls, table: pa.Table) -> "AliasRecords":
+        types = pc.index_in(
+            table.column("type").cast(pa.string()), value_set=pa.array(ENTITY_TYPES)
+        )
+        return cls(
+            aliases=table.column("alias").to_pylist(),
+            entities=array("q", table.column("entity").to_numpy().astype(np.int64).tobytes()),
+            types=array("B", types.to_numpy().astype(np.uint8).tobytes()),
+        )
+
+
+def filter_alias_table(aliases: pa.Table, entity_ids: set[str]) -> pa.Table:
+    """Rows of a table of alias records for the given entity ids, in the order of the table."""
+    ids = pa.array([int(entity_id) for entity_id in entity_ids], pa.int64())
+    return aliases.filter(pc.is_in(aliases.column("entity"), value_set=ids))
+
+
+def parse_alias_records(
+    dat: dict, include_possibly_related: bool = True
+) -> Iterator[tuple[str | None, int, str]]:
+    """Extract the alias records of one line of the Senzing results, as (alias, entity, type)."""
+    entity: dict = dat["RESOLVED_ENTITY"]
+    related_entities: dict = dat["RELATED_ENTITIES"]
+
+    if not entity["ENTITY_NAME"]:
+        return
+
+    entity_type = get_entity_type(entity["FEATURES"])
+
+    # add aliases from resolved entities
+    for record in entity["RECORDS"]:
+        yield record["ENTITY_DESC"], record["INTERNAL_ID"], entity_type
+
+    # add aliases from related entities
+    if not include_possibly_related:
+        return
+    for record in related_entities:
+        # MATCH_LEVEL_CODE is either POSSIBLY_SAME or POSSIBLY_RELATED or RESOLVED or DISCLOSED
+        # we choose to add an alias record if POSSIBLY_SAME
+        if record["MATCH_LEVEL_CODE"] in ["POSSIBLY_SAME", "RESOLVED", "DISCLOSED"]:
+            yield entity["ENTITY_NAME"], record["ENTITY_ID"], entity_type
+        # and discard if POSSIBLY_RELATED
+        elif record["MATCH_LEVEL_CODE"] == "POSSIBLY_RELATED":
+            continue
+
+
 def load_aliases(
     icij_path: str | pathlib.Path = "data/ICIJ-entity-report-2024-06-21_12-04-57-std.json",
     include_possibly_related: bool = True,
-) -> list[AliasRawData]:
-    alias_records: list[AliasRawData] = []
-
-    logger.info(f"Parsing Senzing results: {icij_path}")
-    num_lines = sum(1 for _ in open(icij_path))
-
-    with tqdm(total=num_lines) as pbar:
-        with open(icij_path, "r", encoding="utf-8") as fp:
-            while line := fp.readline():
-                dat = json.loads(line.strip())
-                entity: dict = dat["RESOLVED_ENTITY"]
-                related_entities: dict = dat["RELATED_ENTITIES"]
-
-                if not entity["ENTITY_NAME"]:
-                    continue
-
-                entity_type = get_entity_type(entity["FEATURES"])
-
-                # add aliases from resolved entities
-                for record in entity["RECORDS"]:
-                    alias_records.append(
-                        {
-                            "alias": record["ENTITY_DESC"],
-                            "entity": record["INTERNAL_ID"],
-                            "type": entity_type,
-                        }
-                    )
+) -> AliasRecords:
+    """Alias records of the Senzing results.
 
-                # add aliases from related entities
-                if not include_possibly_related:
-                    continue
-                for record in related_entities:
-                    # MATCH_LEVEL_CODE is either POSSIBLY_SAME or POSSIBLY_RELATED or RESOLVED or DISCLOSED
-                    # we choose to add an alias record if POSSIBLY_SAME
-                    if record["MATCH_LEVEL_CODE"] in ["POSSIBLY_SAME", "RESOLVED", "DISCLOSED"]:
-                        alias_records.append(
-                            {
-                                "alias": entity["ENTITY_NAME"],
-                                "entity": record["ENTITY_ID"],
-                                "type": entity_type,
-                            }
-                        )
-                    # and discard if POSSIBLY_RELATED
-                    elif record["MATCH_LEVEL_CODE"] == "POSSIBLY_RELATED":
-                        continue
-
-                pbar.update(1)
-
-    return alias_records
+    Prefer `read_senzing_report` when the entities or the graph are needed as well.
+    """
+    return read_senzing_report(icij_path, include_possibly_related).aliases
 
 
 class EntityRulerPattern(TypedDict):
@@ -275,7 +612,7 @@ class EntityRulerPattern(TypedDict):
     id: str
 
 
-def generate_patterns(raw_aliases: list[AliasRawData]) -> list[EntityRulerPattern]:
+def generate_patterns(raw_aliases: AliasRecords) -> list[EntityRulerPattern]:
     return [
         {
             "label": alias["type"],
@@ -286,136 +623,747 @@ def generate_patterns(raw_aliases: list[AliasRawData]) -> list[EntityRulerPatter
     ]
 
 
-def generate_aliases(raw_aliases: list[AliasRawData]) -> pd.DataFrame:
-    logger.info("Generating aliases")
-    df = (
-        pd.DataFrame.from_records(raw_aliases)
-        .astype({"entity": str})
-        .groupby("alias")
-        .agg(counts=("entity", Counter))
-        .assign(entities=lambda d: d.counts.apply(list))
-        .assign(
-            probabilities=lambda d: d.counts.apply(
-                lambda x: [count / x.total() for k, count in x.items()]
-            )
+def alias_pair_counts(raw_aliases: AliasRecords) -> pd.DataFrame:
+    """Count of each (alias, entity) pair, in order of first appearance."""
+    return (
+        pd.DataFrame(
+            {"alias": raw_aliases.aliases, "entity": np.array(raw_aliases.entities, dtype=np.int64)}
         )
-        .drop(columns="counts")
+        .astype({"entity": str})
+        # without sorting, the pairs come in order of first appearance
+        .groupby(["alias", "entity"], sort=False)
+        .size()
+        .rename("count")
+        .reset_index()
+    )
+
+
+def aliases_from_pair_counts(pair_counts: pd.DataFrame) -> pd.DataFrame:
+    """Map from each alias to its entities, with the probability of each entity.
+
+    The counts can come from several `alias_pair_counts`, concatenated in the order of their
+    records, e.g. the shards of the Senzing results.
+    """
+    pairs = (
+        pair_counts.groupby(["alias", "entity"], sort=False)["count"]
+        .sum()
         .reset_index()
+        .sort_values("alias", kind="stable", ignore_index=True)
     )
-    return df
+    pairs["probability"] = pairs["count"] / pairs.groupby("alias")["count"].transform("sum")
+    if pairs.empty:
+        return pd.DataFrame(columns=["alias", "entities", "probabilities"])
 
+    # split the pairs into one block per alias
+    aliases = pairs["alias"].to_numpy(dtype=object)
+    starts = np.flatnonzero(np.concatenate([[True], aliases[1:] != aliases[:-1]]))
+    entities = np.split(pairs["entity"].to_numpy(dtype=object), starts[1:])
+    probabilities = np.split(pairs["probability"].to_numpy(), starts[1:])
 
+    return pd.DataFrame(
+        {
+            "alias": aliases[starts],
+            "entities": [block.tolist() for block in entities],
+            "probabilities": [block.tolist() for block in probabilities],
+        }
+    )
+
+
+@instrumented(items=len)
+def generate_aliases(raw_aliases: AliasRecords) -> pd.DataFrame:
+    """Map from each alias to its entities, with the probability of each entity.
+
+    The entities of an alias are listed in order of first appearance, and their probabilities
+    come from the count of each (alias, entity) pair, computed with grouped operations.
+    """
+    logger.info("Generating aliases")
+    return aliases_from_pair_counts(alias_pair_counts(raw_aliases))
+
+
+@instrumented(input_items=len)
 def write_aliases(
-    aliases: pd.DataFrame, filepath: str | pathlib.Path = "data/senzing/aliases.jsonl"
+    aliases: pd.DataFrame,
+    filepath: str | pathlib.Path = "data/senzing/aliases.jsonl",
+    chunk_size: int = 100_000,
 ):
+    """Write the aliases to a JSON lines file, one chunk of rows at a time."""
     logger.info(f"Writing aliases to: {filepath}")
-    aliases.to_json(filepath, orient="records", lines=True)
+    with open(filepath, "w") as outfile:
+        for start in range(0, max(len(aliases), 1), chunk_size):
+            outfile.write(
+                aliases.iloc[start : start + chunk_size].to_json(orient="records", lines=True)
+            )
 
 
-@dataclass(order=False, frozen=False)
+@dataclass(order=False, frozen=False, slots=True)
 class Entity:
     """
     A data class representing a resolved entity.
+
+    Its records are stored with the ones of the other entities, see `SenzingGraph.entity_records`.
     """
 
     entity_uid: int
     name: str
     num_recs: int
-    records: dict[str, str] = field(default_factory=lambda: {})
-    related: dict[int, dict] = field(default_factory=lambda: {})
     has_ref: bool = False
 
 
-def extract_senzing_results(filename: str | pathlib.Path) -> dict[int, Entity]:
-    """Parse the Senzing results."""
-    entities: dict[int, Entity] = {}
+# MATCH_LEVEL_CODE of the RELATED_ENTITIES, stored per edge as its index in this tuple
+MATCH_LEVEL_CODES: tuple[str, ...] = ("RESOLVED", "POSSIBLY_SAME", "POSSIBLY_RELATED", "DISCLOSED")
 
-    with open(filename, "r") as fp:
-        for line in tqdm(fp.readlines(), desc="read JSON"):
-            entity_dat: dict = json.loads(line)
-            entity_uid: int = entity_dat["RESOLVED_ENTITY"]["ENTITY_ID"]
 
-            entity_name: str = ""
-            records: dict[str, str] = {}
+@dataclass
+class EdgeList:
+    """Relationships between entities, accumulated while parsing the Senzing results."""
 
-            for rec in entity_dat["RESOLVED_ENTITY"]["RECORDS"]:
-                record_uid: str = ".".join([rec["DATA_SOURCE"].upper(), str(rec["RECORD_ID"])])
-                match_key: str = rec["MATCH_KEY"]
+    sources: array = field(default_factory=lambda: array("q"))
+    targets: array = field(default_factory=lambda: array("q"))
+    match_levels: array = field(default_factory=lambda: array("B"))
 
-                if match_key.strip() == "":
-                    match_key = "INITIAL"
-                records[record_uid] = match_key
+    def append(self, source: int, target: int, match_level: str) -> None:
+        self.sources.append(source)
+        self.targets.append(target)
+        self.match_levels.append(MATCH_LEVEL_CODES.index(match_level))
 
-                if entity_name == "" and rec["ENTITY_DESC"] != "":
-                    entity_name = rec["ENTITY_DESC"]
+    def extend(self, edges: "EdgeList") -> None:
+        self.sources.extend(edges.sources)
+        self.targets.extend(edges.targets)
+        self.match_levels.extend(edges.match_levels)
 
-            if entity_name == "":
-                entity_name = str(entity_uid)
 
-            entities[entity_uid] = Entity(
-                entity_uid=entity_uid,
-                name=entity_name,
-                records=records,
-                num_recs=len(records),
-                related={r["ENTITY_ID"]: r for r in entity_dat["RELATED_ENTITIES"]},
-            )
+@dataclass
+class Vocabulary:
+    """Dictionary encoding of strings with few distinct values, as the indexes of those values."""
 
-    for entity in entities.values():
-        if entity.num_recs > 0:
-            entity.has_ref = True
+    values: list[str] = field(default_factory=lambda: [])
+    codes: dict[str, int] = field(default_factory=lambda: {})
 
-        for rel_ent_id in entity.related:
-            entities[rel_ent_id].has_ref = True
+    def encode(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
 
-    return entities
+    def recode(self, other: "Vocabulary") -> np.ndarray:
+        """Map from the codes of another vocabulary to the codes of the same values in this one."""
+        return np.array([self.encode(value) for value in other.values], dtype=np.uint32)
 
 
-def filter_senzing(suspicions, graph) -> set[str]:
-    logger.info("Filter Senzing results for suspicions only")
-    df = pd.DataFrame.from_records(
-        [
-            (
-                name,
-                list(
-                    # here we filter for exact match, which is high precision + low recall
-                    # we might miss companies with names that differ slightly
-                    # we hope to catch them with the "friends of friends" filtering later
-                    filter(lambda ent: ent.name == name, [entity for k, entity in graph.items()])
-                ),
+@dataclass
+class RecordList:
+    """Records of the resolved entities, accumulated while parsing the Senzing results.
+
+    The DATA_SOURCE and MATCH_KEY of the records only take a few distinct values, so each record
+    stores their codes in the vocabularies of the list.
+    """
+
+    entity_uids: array = field(default_factory=lambda: array("q"))
+    record_ids: list[str] = field(default_factory=lambda: [])
+    data_sources: array = field(default_factory=lambda: array("I"))
+    match_keys: array = field(default_factory=lambda: array("I"))
+    data_source_vocabulary: Vocabulary = field(default_factory=Vocabulary)
+    match_key_vocabulary: Vocabulary = field(default_factory=Vocabulary)
+
+    def append(self, entity_uid: int, data_source: str, record_id: str, match_key: str) -> None:
+        self.entity_uids.append(entity_uid)
+        self.record_ids.append(record_id)
+        self.data_sources.append(self.data_source_vocabulary.encode(data_source))
+        self.match_keys.append(self.match_key_vocabulary.encode(match_key))
+
+    def extend(self, records: "RecordList") -> None:
+        self.entity_uids.extend(records.entity_uids)
+        self.record_ids.extend(records.record_ids)
+        # the other list encodes its values with its own vocabularies
+        data_sources = self.data_source_vocabulary.recode(records.data_source_vocabulary)
+        match_keys = self.match_key_vocabulary.recode(records.match_key_vocabulary)
+        self.data_sources.frombytes(data_sources[np.array(records.data_sources)].tobytes())
+        self.match_keys.frombytes(match_keys[np.array(records.match_keys)].tobytes())
+
+    def take(self, indices: np.ndarray) -> "RecordList":
+        """The records at the given indexes, with the same vocabularies."""
+        record_ids = self.record_ids
+        return RecordList(
+            entity_uids=array("q", np.array(self.entity_uids, dtype=np.int64)[indices].tobytes()),
+            record_ids=[record_ids[idx] for idx in indices.tolist()],
+            data_sources=array(
+                "I", np.array(self.data_sources, dtype=np.uint32)[indices].tobytes()
+            ),
+            match_keys=array("I", np.array(self.match_keys, dtype=np.uint32)[indices].tobytes()),
+            data_source_vocabulary=self.data_source_vocabulary,
+            match_key_vocabulary=self.match_key_vocabulary,
+        )
+
+    def __len__(self) -> int:
+        return len(self.record_ids)
+
+
+@dataclass
+class SenzingGraph:
+    """The resolved entities, with their relationships stored as CSR adjacency arrays.
+
+    The node at position `i` is the entity `entity_uids[i]`, its related entities are the
+    positions `neighbours[offsets[i]:offsets[i + 1]]` and the match levels of those edges are
+    `match_levels[offsets[i]:offsets[i + 1]]`, as indexes in MATCH_LEVEL_CODES. Once linked, its
+    records are `records[record_offsets[i]:record_offsets[i + 1]]`.
+    """
+
+    entities: dict[int, Entity] = field(default_factory=lambda: {})
+    entity_uids: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int64))
+    offsets: np.ndarray = field(default_factory=lambda: np.zeros(1, dtype=np.int64))
+    neighbours: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int64))
+    match_levels: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.uint8))
+    records: RecordList = field(default_factory=RecordList)
+    record_offsets: np.ndarray = field(default_factory=lambda: np.zeros(1, dtype=np.int64))
+
+    def __getitem__(self, entity_uid: int) -> Entity:
+        return self.entities[entity_uid]
+
+    def __len__(self) -> int:
+        return len(self.entities)
+
+    def items(self):
+        return self.entities.items()
+
+    def positions(self, entity_uids: Iterable[int]) -> np.ndarray:
+        """Positions of entities in the adjacency arrays."""
+        uids = np.fromiter(entity_uids, dtype=np.int64)
+        positions = np.searchsorted(self.entity_uids, uids)
+        found = positions < len(self.entity_uids)
+        found[found] = self.entity_uids[positions[found]] == uids[found]
+        if not found.all():
+            raise KeyError(int(uids[~found][0]))
+        return positions
+
+    def link(self, edges: EdgeList) -> None:
+        """Build the adjacency arrays from an edge list, and flag the referenced entities."""
+        self.entity_uids = np.sort(np.fromiter(self.entities.keys(), dtype=np.int64))
+        sources = self.positions(edges.sources)
+        targets = self.positions(edges.targets)
+
+        order = np.argsort(sources, kind="stable")
+        self.neighbours = targets[order]
+        self.match_levels = np.frombuffer(edges.match_levels, dtype=np.uint8)[order]
+        self.offsets = np.zeros(len(self.entity_uids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(self.entity_uids)), out=self.offsets[1:])
+
+        # the records, in the order of the nodes
+        owners = self.positions(self.records.entity_uids)
+        self.records = self.records.take(np.argsort(owners, kind="stable"))
+        self.record_offsets = np.zeros(len(self.entity_uids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(owners, minlength=len(self.entity_uids)), out=self.record_offsets[1:])
+
+        referenced = self.entity_uids[np.unique(self.neighbours)].tolist()
+        for entity_uid in referenced:
+            self.entities[entity_uid].has_ref = True
+        for entity in self.entities.values():
+            if entity.num_recs > 0:
+                entity.has_ref = True
+
+    def related(self, entity_uid: int) -> dict[int, str]:
+        """Map from the related entities of an entity to the match level of the relationship."""
+        (position,) = self.positions([entity_uid])
+        start, end = self.offsets[position], self.offsets[position + 1]
+        return {
+            int(self.entity_uids[neighbour]): MATCH_LEVEL_CODES[match_level]
+            for neighbour, match_level in zip(
+                self.neighbours[start:end], self.match_levels[start:end]
+            )
+        }
+
+    def entity_records(self, entity_uid: int) -> dict[str, str]:
+        """Map from the records of an entity, as DATA_SOURCE.RECORD_ID, to their match key."""
+        (position,) = self.positions([entity_uid])
+        start, end = self.record_offsets[position], self.record_offsets[position + 1]
+        records = self.records
+        data_sources = records.data_source_vocabulary.values
+        match_keys = records.match_key_vocabulary.values
+        return {
+            f"{data_sources[data_source]}.{record_id}": match_keys[match_key]
+            for record_id, data_source, match_key in zip(
+                records.record_ids[start:end],
+                records.data_sources[start:end],
+                records.match_keys[start:end],
             )
-            for name in suspicions
-        ],
-        columns=["suspicion", "matches"],
+        }
+
+    def expand(
+        self, seeds: Iterable[int], depth: int = 2, match_levels: Iterable[str] | None = None
+    ) -> set[int]:
+        """Entities within `depth` hops of the seeds, following only the allowed match levels.
+
+        Each hop expands the whole frontier at once with array operations.
+        """
+        allowed = np.zeros(len(MATCH_LEVEL_CODES), dtype=bool)
+        if match_levels is None:
+            allowed[:] = True
+        else:
+            allowed[[MATCH_LEVEL_CODES.index(code) for code in match_levels]] = True
+
+        visited = np.zeros(len(self.entity_uids), dtype=bool)
+        frontier = np.unique(self.positions(seeds))
+        visited[frontier] = True
+
+        for _ in range(depth):
+            if not len(frontier):
+                break
+            starts = self.offsets[frontier]
+            lengths = self.offsets[frontier + 1] - starts
+            # the edge indexes of every node in the frontier, i.e. concatenated aranges
+            edges = np.arange(lengths.sum()) + np.repeat(
+                starts - np.cumsum(lengths) + lengths, lengths
+            )
+            reached = np.unique(self.neighbours[edges[allowed[self.match_levels[edges]]]])
+            frontier = reached[~visited[reached]]
+            visited[frontier] = True
+
+        return set(self.entity_uids[visited].tolist())
+
+
+def parse_graph_entity(dat: dict, records: RecordList | None = None) -> Entity:
+    """Build the graph node of one line of the Senzing results, and add its records to `records`."""
+    entity_uid: int = dat["RESOLVED_ENTITY"]["ENTITY_ID"]
+
+    entity_name: str = ""
+    entity_records: dict[tuple[str, str], str] = {}
+
+    for rec in dat["RESOLVED_ENTITY"]["RECORDS"]:
+        match_key: str = rec["MATCH_KEY"]
+
+        if match_key.strip() == "":
+            match_key = "INITIAL"
+        entity_records[rec["DATA_SOURCE"].upper(), str(rec["RECORD_ID"])] = match_key
+
+        if entity_name == "" and rec["ENTITY_DESC"] != "":
+            entity_name = rec["ENTITY_DESC"]
+
+    if entity_name == "":
+        entity_name = str(entity_uid)
+
+    if records is not None:
+        for (data_source, record_id), match_key in entity_records.items():
+            records.append(entity_uid, data_source, record_id, match_key)
+
+    return Entity(
+        entity_uid=entity_uid,
+        name=entity_name,
+        num_recs=len(entity_records),
     )
 
-    # we filter Senzing results for: direct matches, related entities to direct matches and friends of friends
-    rank_0 = df.matches.explode().dropna().apply(lambda d: d.entity_uid).unique()
-    rank_1 = df.matches.explode().dropna().apply(lambda d: d.related.keys()).explode().unique()
-    rank_2 = set(
-        ent_id for seed_id in set(rank_0) | set(rank_1) for ent_id in graph[seed_id].related.keys()
+
+def parse_related_entities(dat: dict) -> dict[int, str]:
+    """Map from the related entities of one line of the Senzing results to their match level."""
+    return {r["ENTITY_ID"]: r["MATCH_LEVEL_CODE"] for r in dat["RELATED_ENTITIES"]}
+
+
+def extract_senzing_results(filename: str | pathlib.Path) -> SenzingGraph:
+    """Parse the Senzing results.
+
+    Prefer `read_senzing_report` when the raw entities or the aliases are needed as well.
+    """
+    return read_senzing_report(filename).graph
+
+
+@dataclass
+class SenzingReport:
+    """Everything the pipeline extracts from the Senzing results."""
+
+    entities: dict[str, dict[EntityFeature, str]] = field(default_factory=lambda: {})
+    aliases: AliasRecords = field(default_factory=AliasRecords)
+    graph: SenzingGraph = field(default_factory=SenzingGraph)
+    # the relationships, until they are linked into the graph
+    edges: EdgeList = field(default_factory=EdgeList)
+
+    def extend(self, other: "SenzingReport") -> None:
+        """Add the report of the lines that follow the ones of this report."""
+        self.entities.update(other.entities)
+        self.aliases.extend(other.aliases)
+        self.graph.entities.update(other.graph.entities)
+        self.graph.records.extend(other.graph.records)
+        self.edges.extend(other.edges)
+
+
+def parse_report_line(
+    dat: dict, report: SenzingReport, include_possibly_related: bool = True
+) -> None:
+    """Add one line of the Senzing results to the report."""
+    ent_id: str = str(dat["RESOLVED_ENTITY"]["ENTITY_ID"])
+
+    report.entities[ent_id] = parse_entity_features(dat["RESOLVED_ENTITY"])
+    for alias, entity_id, entity_type in parse_alias_records(dat, include_possibly_related):
+        report.aliases.append(alias, entity_id, entity_type)
+    entity = parse_graph_entity(dat, report.graph.records)
+    report.graph.entities[entity.entity_uid] = entity
+    for rel_ent_id, match_level in parse_related_entities(dat).items():
+        report.edges.append(entity.entity_uid, rel_ent_id, match_level)
+
+
+def parse_graph_line(dat: dict, report: SenzingReport) -> None:
+    """Add the graph node of one line of the Senzing results, without its records, to the report.
+
+    That is all `filter_senzing` needs, the first pass of the low-memory mode keeps nothing else.
+    """
+    entity = parse_graph_entity(dat)
+    report.graph.entities[entity.entity_uid] = entity
+    for rel_ent_id, match_level in parse_related_entities(dat).items():
+        report.edges.append(entity.entity_uid, rel_ent_id, match_level)
+
+
+def parse_subset_line(
+    dat: dict,
+    report: SenzingReport,
+    entity_ids: frozenset[str],
+    include_possibly_related: bool = True,
+) -> None:
+    """Add the features and the alias records of one line that concern the given entities.
+
+    The features are kept when the resolved entity is one of them, and each alias record when
+    the entity it points to is one of them, like the filtering of the full report does.
+    """
+    ent_id: str = str(dat["RESOLVED_ENTITY"]["ENTITY_ID"])
+    if ent_id in entity_ids:
+        report.entities[ent_id] = parse_entity_features(dat["RESOLVED_ENTITY"])
+    for alias, entity_id, entity_type in parse_alias_records(dat, include_possibly_related):
+        if str(entity_id) in entity_ids:
+            report.aliases.append(alias, entity_id, entity_type)
+
+
+def report_offsets(icij_path: str | pathlib.Path, num_chunks: int) -> list[int]:
+    """Byte offsets splitting the Senzing results into `num_chunks` line-aligned ranges.
+
+    A range is empty when a line spans several chunks, so that range `i` is always between
+    offsets `i` and `i + 1`. Compressed results cannot be read from an offset, so they are not
+    split.
+    """
+    if is_compressed(icij_path):
+        raise ValueError(
+            f"Cannot split the compressed Senzing results {icij_path}, decompress them"
+        )
+    size = os.path.getsize(icij_path)
+    offsets = [0]
+
+    with open(icij_path, "rb") as fp:
+        for idx in range(1, num_chunks):
+            fp.seek(max(size * idx // num_chunks, offsets[-1]))
+            # move on to the start of the next line
+            fp.readline()
+            offsets.append(min(fp.tell(), size))
+
+    offsets.append(size)
+    return offsets
+
+
+def split_report(icij_path: str | pathlib.Path, num_chunks: int) -> list[tuple[int, int]]:
+    """Split the Senzing results into byte ranges that start and end on line boundaries."""
+    offsets = report_offsets(icij_path, num_chunks)
+    return [(start, end) for start, end in zip(offsets, offsets[1:]) if start < end]
+
+
+def read_report_range(
+    icij_path: str | pathlib.Path,
+    start: int,
+    end: int,
+    parse_line: Callable[[dict, SenzingReport], None] = parse_report_line,
+) -> SenzingReport:
+    """Parse the lines of the Senzing results within a byte range.
+
+    This is the unit of work of the parallel ingest. The relationships are left for the
+    caller to link into the graph once every range is merged.
+    """
+    report = SenzingReport()
+
+    with open(icij_path, "rb") as fp:
+        fp.seek(start)
+        position = start
+        while position < end and (line := fp.readline()):
+            position += len(line)
+            if line.strip():
+                parse_line(json.loads(line), report)
+
+    return report
+
+
+def parse_report_block(
+    block: bytes, parse_line: Callable[[dict, SenzingReport], None] = parse_report_line
+) -> SenzingReport:
+    """Parse a block of whole lines of the Senzing results.
+
+    This is the unit of work of the parallel ingest of compressed results, which cannot be read
+    from a byte offset.
+    """
+    report = SenzingReport()
+    for line in block.split(b"\n"):
+        if line.strip():
+            parse_line(json.loads(line), report)
+    return report
+
+
+def _read_report(
+    icij_path: str | pathlib.Path,
+    parse_line: Callable[[dict, SenzingReport], None],
+    workers: int = 1,
+) -> SenzingReport:
+    """Parse each line of the Senzing results with `parse_line`, in file order."""
+    report = SenzingReport()
+
+    logger.info(f"Parsing Senzing results: {icij_path}")
+    with tqdm(total=report_size(icij_path), unit="B", unit_scale=True, desc="read JSON") as pbar:
+        if workers > 1 and is_compressed(icij_path):
+            # the lines are decompressed here and parsed by the pool, a few blocks at a time so
+            # that the decompressed results are never all in memory
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                pending: deque[tuple[Future[SenzingReport], int]] = deque()
+                for block in iter_report_blocks(icij_path):
+                    pending.append(
+                        (executor.submit(parse_report_block, block, parse_line), len(block))
+                    )
+                    while len(pending) > 2 * workers or (pending and pending[0][0].done()):
+                        future, size = pending.popleft()
+                        report.extend(future.result())
+                        pbar.update(size)
+                for future, size in pending:
+                    report.extend(future.result())
+                    pbar.update(size)
+        elif workers > 1:
+            # more ranges than workers, so that a slow range does not hold up the pool
+            ranges = split_report(icij_path, workers * 4)
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                partials = executor.map(
+                    read_report_range, repeat(icij_path), *zip(*ranges), repeat(parse_line)
+                )
+                for (start, end), partial in zip(ranges, partials):
+                    report.extend(partial)
+                    pbar.update(end - start)
+        else:
+            for line in iter_report_lines(icij_path):
+                pbar.update(len(line))
+                if line.strip():
+                    parse_line(json.loads(line), report)
+
+    return report
+
+
+@instrumented(items=lambda report: len(report.entities))
+def read_senzing_report(
+    icij_path: str | pathlib.Path = "data/ICIJ-entity-report-2024-06-21_12-04-57-std.json",
+    include_possibly_related: bool = True,
+    workers: int = 1,
+) -> SenzingReport:
+    """Parse the Senzing results in a single streaming pass.
+
+    Each line is decoded once and feeds the raw entity features, the alias records and the
+    graph nodes together. Progress is reported in bytes read, which avoids a first pass over
+    the file just to count its lines. The results can be compressed as .zip, .gz or .zst, they
+    are then decompressed as they are parsed.
+
+    With more than one worker, the file is split into line-aligned byte ranges which are parsed
+    in a process pool, or, when it is compressed, decompressed into blocks of lines for the pool.
+    The partial reports are merged in file order, so the result is the same as the one of the
+    serial pass.
+    """
+    report = _read_report(
+        icij_path,
+        functools.partial(parse_report_line, include_possibly_related=include_possibly_related),
+        workers,
+    )
+    report.graph.link(report.edges)
+    report.edges = EdgeList()
+
+    return report
+
+
+@instrumented(items=len)
+def read_report_graph(icij_path: str | pathlib.Path, workers: int = 1) -> SenzingGraph:
+    """First pass of the low-memory mode: the graph of the Senzing results, names and edges only."""
+    report = _read_report(icij_path, parse_graph_line, workers)
+    report.graph.link(report.edges)
+    return report.graph
+
+
+@instrumented(items=lambda report: len(report.entities))
+def read_report_subset(
+    icij_path: str | pathlib.Path,
+    entity_ids: set[str],
+    include_possibly_related: bool = True,
+    workers: int = 1,
+) -> SenzingReport:
+    """Second pass of the low-memory mode: the features and aliases of the given entities.
+
+    The result holds the same entities and aliases as the full report filtered to `entity_ids`,
+    in the same order, without a graph.
+    """
+    return _read_report(
+        icij_path,
+        functools.partial(
+            parse_subset_line,
+            entity_ids=frozenset(entity_ids),
+            include_possibly_related=include_possibly_related,
+        ),
+        workers,
+    )
+
+
+NAME_MATCHES: tuple[str, ...] = ("exact", "normalized", "tokens")
+
+
+def normalize_text(text: str) -> str:
+    """Normalize a text for lookups, ignoring case, punctuation and diacritics."""
+    decomposed = unicodedata.normalize("NFKD", text)
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(re.findall(r"\w+", stripped.casefold()))
+
+
+def normalize_name(name: str) -> str:
+    """Normalize a name for lookups, ignoring case, punctuation, diacritics and word order."""
+    return " ".join(sorted(normalize_text(name).split()))
+
+
+def build_name_index(graph: dict[int, Entity], name_match: str = "exact") -> dict[str, set[int]]:
+    """Map from a lookup key to the ids of the entities in the graph.
+
+    - exact: the key is the entity name as is
+    - normalized: the key is the normalized entity name
+    - tokens: the keys are the tokens of the normalized entity name
+    """
+    if name_match not in NAME_MATCHES:
+        raise ValueError(f"Unknown name match {name_match}, expected one of {NAME_MATCHES}")
+
+    index: dict[str, set[int]] = defaultdict(set)
+    for entity_uid, entity in graph.items():
+        if name_match == "exact":
+            index[entity.name].add(entity_uid)
+        elif name_match == "normalized":
+            index[normalize_name(entity.name)].add(entity_uid)
+        else:
+            for token in set(normalize_name(entity.name).split()):
+                index[token].add(entity_uid)
+    return dict(index)
+
+
+def lookup_name(index: dict[str, set[int]], name: str, name_match: str = "exact") -> set[int]:
+    """Ids of the entities matching a name, in an index built with the same name match."""
+    if name_match == "exact":
+        return index.get(name, set())
+    if name_match == "normalized":
+        return index.get(normalize_name(name), set())
+
+    # token blocking: the entity name has to contain every token of the name
+    postings = sorted(
+        (index.get(token, set()) for token in set(normalize_name(name).split())), key=len
     )
-    return set(str(ent_id) for ent_id in set(rank_0) | set(rank_1) | set(rank_2))
+    if not postings:
+        return set()
+    return set.intersection(*postings)
+
+
+@instrumented(items=len)
+def filter_senzing(
+    suspicions,
+    graph: SenzingGraph,
+    name_match: str = "exact",
+    hops: int = 2,
+    match_levels: Iterable[str] | None = None,
+) -> set[str]:
+    logger.info("Filter Senzing results for suspicions only")
+    # the exact match is high precision + low recall, we might miss companies with names that
+    # differ slightly. The normalized and tokens matches trade some precision for recall.
+    # We hope to catch the rest with the "friends of friends" filtering later
+    index = build_name_index(graph.entities, name_match)
+    rank_0 = set(ent_id for name in suspicions for ent_id in lookup_name(index, name, name_match))
+
+    # we filter Senzing results for: direct matches, related entities to direct matches and friends of friends
+    return set(str(ent_id) for ent_id in graph.expand(rank_0, hops, match_levels))
 
 
-def main():
+def main(argv: list[str] | None = None):
     """Entrypoint to the Senzing data pipeline."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes parsing the Senzing results (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--name-match",
+        choices=NAME_MATCHES,
+        default="exact",
+        help="how suspicions are matched to entity names (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--hops",
+        type=int,
+        default=2,
+        help="how many relationships away from a suspicion to go (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--match-levels",
+        nargs="+",
+        choices=MATCH_LEVEL_CODES,
+        help="relationships to follow, by MATCH_LEVEL_CODE (default: all of them)",
+    )
+    parser.add_argument(
+        "--senzing-results",
+        default="data/ICIJ-entity-report-2024-06-21_12-04-57-std.json",
+        help="Senzing results, as JSON lines or compressed as .zip, .gz or .zst",
+    )
+    parser.add_argument(
+        "--low-memory",
+        action="store_true",
+        help="read the Senzing results twice, the graph to filter them, then the filtered "
+        "entities only, so that memory scales with the filtered results",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only regenerate the rows of the entities that changed since the previous run",
+    )
+    args = parser.parse_args(argv)
+
     countries = load_countries()
-    raw_entities = load_entities()
-    raw_aliases = load_aliases()
 
     logger.info("Loading suspicions")
     with open("data/icij-example/suspicious.txt") as file:
         names = [line.rstrip() for line in file]
 
-    logger.info("Loading Senzing results")
-    entities = extract_senzing_results("data/ICIJ-entity-report-2024-06-21_12-04-57-std.json")
+    icij_path = args.senzing_results
+    if args.low_memory:
+        # the graph is freed before the second pass, which only keeps the filtered entities
+        logger.info("Loading the graph of the Senzing results")
+        entity_ids = filter_senzing(
+            names,
+            read_report_graph(icij_path, workers=args.workers),
+            args.name_match,
+            args.hops,
+            args.match_levels,
+        )
+        logger.info("Loading the filtered Senzing results")
+        subset = read_report_subset(icij_path, entity_ids, workers=args.workers)
+        filtered_entities = entity_features_table(subset.entities)
+        filtered_aliases = subset.aliases
+    else:
+        logger.info("Loading Senzing results")
+        report = read_senzing_report(icij_path, workers=args.workers)
+
+        entity_ids = filter_senzing(
+            names, report.graph, args.name_match, args.hops, args.match_levels
+        )
+        filtered_entities = filter_entity_features(
+            entity_features_table(report.entities), entity_ids
+        )
+        filtered_aliases = report.aliases.filter_entities(entity_ids)
+
+    if args.incremental:
+        # imported here, as the incremental updates build on this module
+        from src.senzing_incremental import update_aliases, update_entities
 
-    entity_ids = filter_senzing(names, entities)
-    filtered_entities = {k: v for k, v in raw_entities.items() if str(k) in entity_ids}
-    filtered_aliases = [alias for alias in raw_aliases if str(alias["entity"]) in entity_ids]
+        logger.info(f"Entities delta: {update_entities(filtered_entities, countries)}")
+        logger.info(f"Aliases delta: {update_aliases(filtered_aliases)}")
+        return
 
-    entities = generate_entities(filtered_entities, countries)
-    write_entities(entities)
+    entities = generate_entities_batch(filtered_entities, countries)
+    write_entities_batch(entities)
 
     aliases = generate_aliases(filtered_aliases)
     write_aliases(aliases)
@@ -0,0 +1,27 @@
+"""Every article text extractor of the scraper gives the golden text of the saved pages.
+
+The pages are in data/icij-pages, page.html with its expected article text in page.txt. New
+pages are saved with `python -m benchmarks.article_extractors --save urls.txt`.
+"""
+
+import pathlib
+
+import pytest
+
+from src.scraper import EXTRACTORS
+
+GOLDEN_CORPUS: pathlib.Path = pathlib.Path(__file__).parents[1] / "data" / "icij-pages"
+PAGES: list[pathlib.Path] = sorted(GOLDEN_CORPUS.glob("*.html"))
+
+
+def test_golden_corpus_is_not_empty():
+    assert PAGES, f"No saved pages in {GOLDEN_CORPUS}"
+
+
+@pytest.mark.parametrize("page", PAGES, ids=lambda page: page.stem)
+@pytest.mark.parametrize("extractor", sorted(EXTRACTORS))
+def test_golden_text(extractor: str, page: pathlib.Path):
+    if extractor == "lxml":
+        # lxml is an optional extra
+        pytest.importorskip("lxml")
+    assert EXTRACTORS[extractor](page.read_text()) == page.with_suffix(".txt").read_text()